@@ -21,6 +21,8 @@ model = dict(
         style='caffe',
         correlation_blocks=[5], # block index
         # attention_blocks=[2, 3, 4]
+        # keep the pretrained template branch and cache its features
+        # freeze_template=True,
         ), 
     # neck=dict(
     #     type='SemiFPN',
@@ -63,6 +65,8 @@ train_cfg = dict(
         ignore_iof_thr=-1),
     allowed_border=-1,
     pos_weight=-1,
+    # cache of the frozen template features, in memory and optionally on disk
+    # template_cache=dict(max_size=1024, cache_dir='./work_dirs/templates'),
     debug=False)
 test_cfg = dict(
     nms_pre=1000,
@@ -78,6 +82,8 @@ img_norm_cfg = dict(
 data = dict(
     imgs_per_gpu=16, 
     workers_per_gpu=8, 
+    # batches of 4 frames of the same videos, sharing their templates
+    # frames_per_video=4,
     train=dict(
         type=dataset_type,
         ann_file=data_root + 'Annotations/480p_trainval.json',
@@ -92,6 +98,10 @@ data = dict(
         with_crowd=False,
         with_label=True,
         resize_keep_ratio=False,
+        # ship the gt contours, the polar targets are assigned in the head
+        # with_contours=True,
+        # ship the targets of the positive points only
+        # sparse_targets=True,
         # for semi-FPN
         strides=[8, 16, 32, 64],
         regress_ranges=[(-1, 256), (256, 512), (512, 1024), (1024, 1e8)]),
@@ -113,6 +123,8 @@ data = dict(
         type=dataset_type,
         ann_file=data_root + 'Annotations/480p_val.json',
         img_prefix=data_root,
+        # a list of scales and/or flip_ratio=0.5 test with augmentations,
+        # e.g. img_scale=[(255, 255), (319, 319)]
         img_scale=(255, 255),
         img_norm_cfg=img_norm_cfg,
         refer_scale=(127, 127),
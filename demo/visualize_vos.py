@@ -11,7 +11,7 @@ import numpy as np
 import pycocotools.mask as maskUtils
 import matplotlib.pyplot as plt
 
-from mmdet.apis import init_detector, inference_tracker, show_result
+from mmdet.apis import init_detector, VOSTracker, show_result
 import mmcv
 
 config_file = '../configs/siampolar/siampolar_r101.py'
@@ -23,8 +23,8 @@ img_refer = '../data/DAVIS/JPEGImages/480p/car-roundabout/00000.jpg'
 # bbox = np.array([96, 214, 369, 221]) # bear
 bbox = np.array([160, 78, 382, 313]) # car-roundabout
 
-for i, img in enumerate(imgs):
-    result = inference_tracker(model, img, img_refer, bbox)
+tracker = VOSTracker(model, img_refer, bbox)
+for i, (img, result) in enumerate(zip(imgs, tracker.track_stream(imgs))):
     outfile = os.path.join('./', str(i)+'.png')
     show_result(img, result, model.CLASSES, score_thr=0.3, show=False, out_file=outfile)
     print("save {}".format(os.path.join('./', str(i)+'.png')))
@@ -11,7 +11,7 @@ import numpy as np
 import pycocotools.mask as maskUtils
 import matplotlib.pyplot as plt
 
-from mmdet.apis import init_detector, inference_tracker, show_result
+from mmdet.apis import init_detector, VOSTracker, show_result
 import mmcv
 
 config_file = '../configs/siampolar/siampolar_r101_tsd-max.py'
@@ -48,8 +48,8 @@ first_frame = {
 for video_name in inputs.keys():
     imgs = sorted(glob.glob(os.path.join('../data/TSD-MAX_VOS/JPEGImages/1080p', video_name, '*jpg')))
     img_refer = os.path.join('../data/TSD-MAX_VOS/JPEGImages/1080p/', video_name, first_frame[video_name])
-    for i, img in enumerate(imgs):
-        result = inference_tracker(model, img, img_refer, np.array(inputs[video_name]))
+    tracker = VOSTracker(model, img_refer, np.array(inputs[video_name]))
+    for i, (img, result) in enumerate(zip(imgs, tracker.track_stream(imgs))):
         outfile = os.path.join('/data/hyh/SiamPolar/demo/vis/', video_name, str(i)+'.png')
         show_result(img, result, model.CLASSES, score_thr=0.3, show=False, out_file=outfile)
         print("save {}".format(outfile))
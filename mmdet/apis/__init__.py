@@ -1,10 +1,11 @@
 from .env import get_root_logger, init_dist, set_random_seed
 from .inference import (inference_detector, init_detector, show_result,
-                        show_result_pyplot, inference_tracker)
+                        show_result_pyplot, inference_tracker,
+                        VOSTracker, KeyframeTracker, MultiVOSTracker)
 from .train import train_detector
 
 __all__ = [
     'init_dist', 'get_root_logger', 'set_random_seed', 'train_detector',
     'init_detector', 'inference_detector', 'show_result', 'show_result_pyplot', 
-    'inference_tracker'
+    'inference_tracker', 'VOSTracker', 'KeyframeTracker', 'MultiVOSTracker'
 ]
@@ -1,5 +1,6 @@
 import warnings
 
+import cv2
 import matplotlib.pyplot as plt
 import mmcv
 import numpy as np
@@ -7,7 +8,7 @@ import pycocotools.mask as maskUtils
 import torch
 from mmcv.runner import load_checkpoint
 
-from mmdet.core import get_classes
+from mmdet.core import bbox_mask2result, get_classes
 from mmdet.datasets import to_tensor
 from mmdet.datasets.transforms import ImageTransform
 from mmdet.models import build_detector
@@ -69,11 +70,11 @@ def inference_detector(model, imgs):
         return _inference_generator(model, imgs, img_transform, device)
 
 
-def _prepare_data(img, img_transform, cfg, device):
+def _prepare_data(img, img_transform, cfg, device, img_scale=None):
     ori_shape = img.shape
     img, img_shape, pad_shape, scale_factor = img_transform(
         img,
-        scale=cfg.data.test.img_scale,
+        scale=cfg.data.test.img_scale if img_scale is None else img_scale,
         keep_ratio=cfg.data.test.get('resize_keep_ratio', True))
     img = to_tensor(img).to(device).unsqueeze(0)
     img_meta = [
@@ -183,65 +184,380 @@ def show_result_pyplot(img,
 
 
 # For track
-def inference_tracker(model, imgs, img_refer, bbox):
-    """For Video Object Segmentation, inference image(s) with the detector.
+class BaseVOSTracker(object):
+    """Base of the VOS trackers.
+
+    The reference patches of the objects and their template features are
+    prepared once when the tracker is created, so every call to
+    :meth:`track` only pays for the search frame.
 
     Args:
         model (nn.Module): The loaded detector.
-        imgs (str/ndarray or list[str/ndarray]): Either image files or loaded images.
-        img_refer (str/ndarray): The object in first frame. 
-        bbox (list): [x1, x2, y1, y2]
+        img_refer (str/ndarray): The first frame, or its file name.
+        bboxes (list[list]): The objects in the first frame, [x1, y1, x2, y2].
+    """
 
-    Returns:
-        If imgs is a str, a generator will be returned, otherwise return the
-        detection results directly.
+    def __init__(self, model, img_refer, bboxes):
+        self.model = model
+        self.cfg = model.cfg
+        self.device = next(model.parameters()).device  # model device
+        self.img_transform = ImageTransform(
+            size_divisor=self.cfg.data.test.size_divisor,
+            **self.cfg.img_norm_cfg)
+        img_refer = mmcv.imread(img_refer)
+        self.img_refer = torch.cat(
+            [self._prepare_refer(img_refer, bbox) for bbox in bboxes])
+        with torch.no_grad():
+            self.template_feats = model.init_template(self.img_refer)
+
+    def _prepare_refer(self, img_refer, bbox):
+        # crop the object in first frame
+        img_refer = mmcv.imcrop(img_refer, np.array(bbox))
+        img_refer = mmcv.imresize(
+            np.float32(img_refer),
+            self.cfg.data.test.refer_scale,
+            return_scale=False)
+        return to_tensor(img_refer).permute(2, 0, 1).unsqueeze(0).to(
+            self.device)
+
+    def track(self, img):
+        raise NotImplementedError
+
+    def track_stream(self, imgs):
+        """Segment the tracked objects in every frame of an iterable,
+        yielding the results frame by frame.
+        """
+        for img in imgs:
+            yield self.track(img)
+
+
+class VOSTracker(BaseVOSTracker):
+    """Stateful tracker of one object for video object segmentation.
+
+    Args:
+        model (nn.Module): The loaded detector.
+        img_refer (str/ndarray): The first frame, or its file name.
+        bbox (list): The object in the first frame, [x1, y1, x2, y2].
+        label (int, optional): 0-based class of the object. It is only used
+            with ``test_cfg.target_only``, which scores the best class of
+            every point if the label is not given.
+        search_region (dict, optional): If given, every frame is searched in
+            a window around the previous prediction, so that the object
+            keeps its resolution with a small input. Its keys are
+            ``context`` (window size w.r.t. the previous bbox, default 2),
+            ``min_size`` (minimum window size in pixels, default 64),
+            ``img_scale`` (input scale of the window, default the test
+            img_scale) and ``score_thr`` (default 0.3). The full frame is
+            searched when the best score of the window is lower than
+            score_thr, until the object is found again.
     """
-    cfg = model.cfg
-    img_transform = ImageTransform(
-        size_divisor=cfg.data.test.size_divisor, **cfg.img_norm_cfg)
 
-    device = next(model.parameters()).device  # model device
-    if not isinstance(imgs, list):
-        return _inference_vos_single(model, imgs, img_refer, bbox, img_transform, device)
-    else:
-        return _inference_vos_generator(model, imgs, img_refer, bbox, img_transform, device)
+    def __init__(self, model, img_refer, bbox, label=None,
+                 search_region=None):
+        super(VOSTracker, self).__init__(model, img_refer, [bbox])
+        self.label = label
+        if search_region is not None:
+            search_region = dict(
+                dict(context=2., min_size=64, img_scale=None, score_thr=0.3),
+                **search_region)
+        self.search_region = search_region
+        # bbox of the object in the previous frame, None if it is lost
+        self.prev_bbox = np.array(bbox[:4], dtype=np.float32)
+
+    def _search_window(self, img_shape):
+        """The window around the previous bbox, inside the frame."""
+        img_h, img_w = img_shape[:2]
+        x1, y1, x2, y2 = self.prev_bbox
+        context = self.search_region['context']
+        min_size = self.search_region['min_size']
+        w = min(max((x2 - x1 + 1) * context, min_size), img_w)
+        h = min(max((y2 - y1 + 1) * context, min_size), img_h)
+        x1 = int(min(max((x1 + x2) / 2 - w / 2, 0), img_w - w))
+        y1 = int(min(max((y1 + y2) / 2 - h / 2, 0), img_h - h))
+        return np.array([x1, y1, x1 + int(w) - 1, y1 + int(h) - 1])
+
+    def _detect(self, img, window=None):
+        """Detect the object in the frame, or in a window of it, with the
+        bboxes and polygons in frame coordinates."""
+        img_scale = None
+        if window is not None:
+            img = mmcv.imcrop(img, window)
+            img_scale = self.search_region['img_scale']
+        data = _prepare_data(img, self.img_transform, self.cfg, self.device,
+                             img_scale)
+        if self.label is not None:
+            data['img_meta'][0][0]['refer_label'] = self.label
+        with torch.no_grad():
+            det_bboxes, det_labels, det_masks = self.model.simple_test_bboxes(
+                data['img'][0],
+                data['img_meta'][0],
+                self.img_refer,
+                rescale=True,
+                template_feats=self.template_feats)[0]
+        if window is not None:
+            offset = det_bboxes.new_tensor(window[:2])
+            det_bboxes[:, :4] += offset.repeat(2)
+            det_masks += offset[:, None]
+        return det_bboxes, det_labels, det_masks
+
+    def _best_detection(self, det_bboxes, det_labels):
+        """The index of the best detection of the object, or None."""
+        scores = det_bboxes[:, 4].clone()
+        if self.label is not None:
+            scores[det_labels != self.label] = -1
+        if scores.numel() == 0 or scores.max() < 0:
+            return None
+        return int(scores.argmax())
+
+    def _track_dets(self, img):
+        """The (det_bboxes, det_labels, det_masks) of a loaded frame."""
+        dets = None
+        if self.search_region is not None and self.prev_bbox is not None:
+            dets = self._detect(img, self._search_window(img.shape))
+            best = self._best_detection(dets[0], dets[1])
+            if best is None or dets[0][best, 4] < \
+                    self.search_region['score_thr']:
+                # the object is lost, search the full frame
+                dets = None
+        if dets is None:
+            dets = self._detect(img)
+        det_bboxes, det_labels, det_masks = dets
+
+        if self.search_region is not None:
+            best = self._best_detection(det_bboxes, det_labels)
+            if best is not None and det_bboxes[best, 4] >= \
+                    self.search_region['score_thr']:
+                self.prev_bbox = det_bboxes[best, :4].cpu().numpy()
+            else:
+                self.prev_bbox = None
+        return dets
+
+    def _dets2result(self, dets, img_shape):
+        det_bboxes, det_labels, det_masks = dets
+        return bbox_mask2result(det_bboxes, det_masks, det_labels,
+                                self.model.bbox_head.num_classes,
+                                dict(ori_shape=img_shape),
+                                self.model.test_cfg.get('max_per_mask', -1))
+
+    def track(self, img):
+        """Segment the tracked object in one frame.
+
+        Args:
+            img (str/ndarray): The frame or its file name.
+
+        Returns:
+            tuple: (bbox_results, mask_results) of the frame.
+        """
+        img = mmcv.imread(img)
+        return self._dets2result(self._track_dets(img), img.shape)
+
+
+class KeyframeTracker(VOSTracker):
+    """VOSTracker that only runs the detector on keyframes.
+
+    On the frames in between, the polygon of the object is propagated from
+    the previous frame: its vertices are tracked with pyramidal Lucas-Kanade
+    optical flow, and a similarity transform fitted to them with RANSAC
+    moves the center and scales the rays of the polygon. A frame is a
+    keyframe if ``interval`` frames have passed since the last one, if the
+    last keyframe did not find the object with a score of at least
+    ``score_thr``, or if the propagation is not reliable, i.e. less than
+    ``min_inliers`` of the vertices agree with the transform or the object
+    moved more than ``motion_thr`` of its size since the previous frame.
 
+    Args:
+        model (nn.Module): The loaded detector.
+        img_refer (str/ndarray): The first frame, or its file name.
+        bbox (list): The object in the first frame, [x1, y1, x2, y2].
+        label (int, optional): See :class:`VOSTracker`.
+        search_region (dict, optional): See :class:`VOSTracker`, it applies
+            to the keyframes.
+        interval (int): Maximum number of frames from a keyframe to the next
+            one, 1 runs the detector on every frame.
+        score_thr (float): Minimum score of the object on a keyframe to
+            propagate it to the next frames.
+        motion_thr (float): Maximum mean displacement of the vertices between
+            two frames, w.r.t. the square root of the bbox area.
+        min_inliers (float): Minimum ratio of the vertices that are tracked
+            and agree with the transform.
+        flow_cfg (dict, optional): ``win_size`` (default 15) and
+            ``max_level`` (default 2) of the optical flow.
+    """
 
-def _inference_vos_single(model, img, img_refer, bbox, img_transform, device):
-    img = mmcv.imread(img)
-    # crop the object in first frame
-    img_refer = mmcv.imread(img_refer)
-    # crop the bbox
-    img_refer = mmcv.imcrop(img_refer, bbox)
+    def __init__(self,
+                 model,
+                 img_refer,
+                 bbox,
+                 label=None,
+                 search_region=None,
+                 interval=5,
+                 score_thr=0.3,
+                 motion_thr=0.2,
+                 min_inliers=0.5,
+                 flow_cfg=None):
+        super(KeyframeTracker, self).__init__(model, img_refer, bbox, label,
+                                              search_region)
+        assert interval >= 1
+        self.interval = interval
+        self.score_thr = score_thr
+        self.motion_thr = motion_thr
+        self.min_inliers = min_inliers
+        self.flow_cfg = dict(win_size=15, max_level=2)
+        if flow_cfg is not None:
+            self.flow_cfg.update(flow_cfg)
+        self.num_frames = 0
+        self.num_keyframes = 0
+        # (bbox, label, polygon) of the object in the previous frame, None if
+        # the next frame must be a keyframe
+        self._obj = None
+        self._prev_gray = None
+        self._since_keyframe = 0
+
+    @property
+    def keyframe_rate(self):
+        """Ratio of the frames tracked so far that were keyframes."""
+        return self.num_keyframes / max(self.num_frames, 1)
+
+    def _set_keyframe(self, dets):
+        det_bboxes, det_labels, det_masks = dets
+        self._since_keyframe = 0
+        best = self._best_detection(det_bboxes, det_labels)
+        if best is None or det_bboxes[best, 4] < self.score_thr:
+            self._obj = None
+            return
+        self._obj = (det_bboxes[best].cpu().numpy(), int(det_labels[best]),
+                     det_masks[best].cpu().numpy())
+
+    def _propagate(self, gray):
+        """Move the polygon of the previous frame to this one, None if the
+        propagation is not reliable."""
+        bbox, label, polygon = self._obj
+        num_points = polygon.shape[1]
+        points = np.ascontiguousarray(polygon.T, dtype=np.float32)
+        win_size = self.flow_cfg['win_size']
+        new_points, status, _ = cv2.calcOpticalFlowPyrLK(
+            self._prev_gray,
+            gray,
+            points[:, None],
+            None,
+            winSize=(win_size, win_size),
+            maxLevel=self.flow_cfg['max_level'])
+        tracked = status.ravel() == 1
+        if tracked.sum() < max(self.min_inliers * num_points, 3):
+            return None
+        warp, inliers = cv2.estimateAffinePartial2D(
+            points[tracked],
+            new_points[tracked, 0],
+            method=cv2.RANSAC,
+            ransacReprojThreshold=3.)
+        if warp is None or inliers.sum() < self.min_inliers * num_points:
+            return None
+
+        img_h, img_w = gray.shape
+        new_polygon = warp[:, :2].dot(polygon) + warp[:, 2:]
+        new_polygon[0] = new_polygon[0].clip(0, img_w - 1)
+        new_polygon[1] = new_polygon[1].clip(0, img_h - 1)
+        size = np.sqrt((bbox[2] - bbox[0] + 1) * (bbox[3] - bbox[1] + 1))
+        motion = np.linalg.norm(new_polygon - polygon, axis=0).mean()
+        if motion > self.motion_thr * size:
+            return None
+        new_bbox = np.concatenate(
+            [new_polygon.min(axis=1), new_polygon.max(axis=1), bbox[4:]])
+        return (new_bbox.astype(np.float32), label,
+                new_polygon.astype(np.float32))
+
+    def track(self, img):
+        """Segment the tracked object in one frame.
+
+        Args:
+            img (str/ndarray): The frame or its file name.
+
+        Returns:
+            tuple: (bbox_results, mask_results) of the frame.
+        """
+        img = mmcv.imread(img)
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        obj = None
+        if self._obj is not None and \
+                self._since_keyframe < self.interval - 1:
+            obj = self._propagate(gray)
+        if obj is not None:
+            self._obj = obj
+            self._since_keyframe += 1
+            bbox, label, polygon = obj
+            # the search window of the next keyframe follows the object
+            self.prev_bbox = bbox[:4]
+            dets = (torch.from_numpy(bbox[None]), torch.tensor([label]),
+                    torch.from_numpy(polygon[None]))
+        else:
+            dets = self._track_dets(img)
+            self._set_keyframe(dets)
+            self.num_keyframes += 1
+        self._prev_gray = gray
+        self.num_frames += 1
+        return self._dets2result(dets, img.shape)
 
-    data = _prepare_vos_data(img, img_refer, img_transform, model.cfg, device)
-    with torch.no_grad():
-        result = model(return_loss=False, rescale=True, **data)
-    return result
 
-def _inference_vos_generator(model, imgs, img_refer, bbox, img_transform, device):
-    for img in imgs:
-        yield _inference_single(model, img, img_refer, bbox, img_transform, device)
+class MultiVOSTracker(BaseVOSTracker):
+    """Stateful tracker of several objects of a video, e.g. in DAVIS 2017.
 
+    Every frame goes through the search backbone once, and is correlated
+    with the templates of all the objects at once, see
+    :meth:`SiamPolar.simple_test_multi`.
 
-def _prepare_vos_data(img, img_refer, img_transform, cfg, device):
-    ori_shape = img.shape
-    img, img_shape, pad_shape, scale_factor = img_transform(
-        img,
-        scale=cfg.data.test.img_scale,
-        keep_ratio=cfg.data.test.get('resize_keep_ratio', True))
-    img = to_tensor(img).to(device).unsqueeze(0)
-    img_meta = [
-        dict(
-            ori_shape=ori_shape,
-            img_shape=img_shape,
-            pad_shape=pad_shape,
-            scale_factor=scale_factor,
-            flip=False)
-    ]
-    img_refer = torch.unsqueeze(
-                    to_tensor(mmcv.imresize(np.float32(img_refer), 
-                                            cfg.data.test.refer_scale, 
-                                            return_scale=False)).permute(2, 0, 1), dim=0).to(device)
+    Args:
+        model (nn.Module): The loaded detector.
+        img_refer (str/ndarray): The first frame, or its file name.
+        bboxes (list[list]): The objects in the first frame, [x1, y1, x2, y2].
+        obj_ids (list, optional): Ids of the objects, default 0..K-1.
+        labels (list[int], optional): 0-based class of every object, see
+            :class:`VOSTracker`.
+    """
 
-    return dict(img=[img], img_meta=[img_meta], img_refer=[img_refer])
\ No newline at end of file
+    def __init__(self, model, img_refer, bboxes, obj_ids=None, labels=None):
+        super(MultiVOSTracker, self).__init__(model, img_refer, bboxes)
+        self.obj_ids = list(range(len(bboxes))) if obj_ids is None else list(
+            obj_ids)
+        self.labels = labels
+
+    def track(self, img):
+        """Segment the tracked objects in one frame.
+
+        Args:
+            img (str/ndarray): The frame or its file name.
+
+        Returns:
+            OrderedDict: (bbox_results, mask_results) of every object id.
+        """
+        img = mmcv.imread(img)
+        data = _prepare_data(img, self.img_transform, self.cfg, self.device)
+        with torch.no_grad():
+            result = self.model.simple_test_multi(
+                data['img'][0],
+                data['img_meta'][0],
+                self.img_refer,
+                obj_ids=self.obj_ids,
+                refer_labels=self.labels,
+                rescale=True,
+                template_feats=self.template_feats)
+        return result
+
+
+def inference_tracker(model, imgs, img_refer, bbox):
+    """For Video Object Segmentation, inference image(s) with the detector.
+
+    Args:
+        model (nn.Module): The loaded detector.
+        imgs (str/ndarray or list[str/ndarray]): Either image files or loaded images.
+        img_refer (str/ndarray): The first frame.
+        bbox (list): The object in first frame, [x1, y1, x2, y2].
+
+    Returns:
+        If imgs is a list, a generator will be returned, otherwise return the
+        detection results directly.
+    """
+    tracker = VOSTracker(model, img_refer, bbox)
+    if not isinstance(imgs, list):
+        return tracker.track(imgs)
+    else:
+        return tracker.track_stream(imgs)
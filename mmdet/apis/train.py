@@ -139,7 +139,11 @@ def _dist_train(model, dataset, cfg, validate=False):
     dataset = dataset if isinstance(dataset, (list, tuple)) else [dataset]
     data_loaders = [
         build_dataloader(
-            ds, cfg.data.imgs_per_gpu, cfg.data.workers_per_gpu, dist=True)
+            ds,
+            cfg.data.imgs_per_gpu,
+            cfg.data.workers_per_gpu,
+            dist=True,
+            frames_per_video=cfg.data.get('frames_per_video', None))
         for ds in dataset
     ]
     # put model on gpus
@@ -195,7 +199,9 @@ def _non_dist_train(model, dataset, cfg, validate=False):
             cfg.data.imgs_per_gpu,
             cfg.data.workers_per_gpu,
             cfg.gpus,
-            dist=False) for ds in dataset
+            dist=False,
+            frames_per_video=cfg.data.get('frames_per_video', None))
+        for ds in dataset
     ]
     # put model on gpus
     model = MMDataParallel(model, device_ids=range(cfg.gpus)).cuda()
@@ -6,7 +6,8 @@ from .samplers import (BaseSampler, CombinedSampler,
                        PseudoSampler, RandomSampler, SamplingResult)
 from .transforms import (bbox2delta, bbox2result, bbox_mask2result, bbox2roi, bbox_flip,
                          bbox_mapping, bbox_mapping_back, delta2bbox,
-                         distance2bbox, roi2bbox)
+                         distance2bbox, mask_flip, mask_mapping,
+                         mask_mapping_back, roi2bbox)
 
 from .assign_sampling import (  # isort:skip, avoid recursive imports
     assign_and_sample, build_assigner, build_sampler)
@@ -18,5 +19,6 @@ __all__ = [
     'SamplingResult', 'build_assigner', 'build_sampler', 'assign_and_sample',
     'bbox2delta', 'delta2bbox', 'bbox_flip', 'bbox_mapping',
     'bbox_mapping_back', 'bbox2roi', 'roi2bbox', 'bbox2result',
-    'distance2bbox', 'bbox_target', 'bbox_mask2result'
+    'distance2bbox', 'bbox_target', 'bbox_mask2result', 'mask_flip',
+    'mask_mapping', 'mask_mapping_back'
 ]
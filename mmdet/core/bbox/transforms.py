@@ -107,6 +107,50 @@ def bbox_mapping_back(bboxes, img_shape, scale_factor, flip):
     return new_bboxes
 
 
+def mask_flip(masks, img_shape):
+    """Flip polygon masks horizontally.
+
+    The rays are re-indexed as well, so that the k-th vertex of a flipped
+    polygon is still on the ray of angle k * 360 / num_polar (the x of a ray
+    is the sine of its angle, which the flip negates).
+
+    Args:
+        masks (Tensor): Shape (n, 2, num_polar), [x, y] of every vertex.
+        img_shape (tuple): Image shape.
+
+    Returns:
+        Tensor: Flipped masks.
+    """
+    num_polar = masks.size(2)
+    inds = torch.arange(num_polar, device=masks.device).neg_() % num_polar
+    flipped = masks[:, :, inds]
+    flipped[:, 0] = img_shape[1] - flipped[:, 0] - 1
+    return flipped
+
+
+def _scale_masks(masks, scale_factor):
+    # scale_factor is a float or a (w, h, w, h) array
+    scale_factor = masks.new_tensor(scale_factor).reshape(-1)
+    if scale_factor.numel() > 1:
+        scale_factor = scale_factor[:2, None]
+    return masks * scale_factor
+
+
+def mask_mapping(masks, img_shape, scale_factor, flip):
+    """Map polygon masks from the original image scale to testing scale"""
+    new_masks = _scale_masks(masks, scale_factor)
+    if flip:
+        new_masks = mask_flip(new_masks, img_shape)
+    return new_masks
+
+
+def mask_mapping_back(masks, img_shape, scale_factor, flip):
+    """Map polygon masks from testing scale to original image scale"""
+    new_masks = mask_flip(masks, img_shape) if flip else masks
+    new_masks = _scale_masks(new_masks, 1. / np.asarray(scale_factor))
+    return new_masks
+
+
 def bbox2roi(bbox_list):
     """Convert a list of bboxes to roi format.
 
@@ -160,34 +204,81 @@ def bbox2result(bboxes, labels, num_classes):
         return [bboxes[labels == i, :] for i in range(num_classes - 1)]
 
 '''bbox and mask 转成result mask要画图'''
-def bbox_mask2result(bboxes, masks, labels, num_classes, img_meta):
+def polygon2rle(polygon, img_h, img_w):
+    """Rasterize a filled polygon and encode it as a COCO RLE.
+
+    The polygon is only drawn inside its bounding box, and the run lengths
+    are computed from that crop, so no full image mask is allocated.
+
+    Args:
+        polygon (ndarray): Integer vertices of shape (k, 2), (x, y).
+        img_h (int): Image height.
+        img_w (int): Image width.
+
+    Returns:
+        dict: Compressed RLE, the same as ``mask_util.encode`` of the
+            rasterized mask.
+    """
+    x0, y0 = np.maximum(polygon.min(axis=0), 0)
+    x1 = min(polygon[:, 0].max(), img_w - 1)
+    y1 = min(polygon[:, 1].max(), img_h - 1)
+    counts = [img_h * img_w]
+    if x0 <= x1 and y0 <= y1:
+        crop = np.zeros((y1 - y0 + 1, x1 - x0 + 1), dtype=np.uint8)
+        cv2.drawContours(crop, [polygon[:, None, :]], -1, 1, -1,
+                         offset=(-int(x0), -int(y0)))
+        # RLE runs in column-major order, a run never leaves a crop column
+        # except by continuing into the next image column
+        edges = np.diff(np.pad(crop, ((1, 1), (0, 0))).astype(np.int8),
+                        axis=0)
+        cols, rows = np.nonzero(edges.T)
+        if rows.size > 0:
+            bounds = (cols + x0) * img_h + rows + y0
+            # runs are [start, end) pairs, merge touching ones
+            starts, ends = bounds[0::2], bounds[1::2]
+            keep = np.ones(starts.size, dtype=bool)
+            keep[1:] = starts[1:] != ends[:-1]
+            bounds = np.stack(
+                [starts[keep],
+                 np.append(ends[np.nonzero(keep)[0][1:] - 1], ends[-1])],
+                axis=1).ravel()
+            bounds = np.concatenate([[0], bounds, [img_h * img_w]])
+            counts = np.diff(bounds).tolist()
+            if counts[-1] == 0:
+                counts.pop()
+    return mask_util.frPyObjects(
+        dict(size=[img_h, img_w], counts=counts), img_h, img_w)
+
+
+def bbox_mask2result(bboxes, masks, labels, num_classes, img_meta,
+                     max_num=-1):
     """Convert detection results to a list of numpy arrays.
 
     Args:
         bboxes (Tensor): shape (n, 5)
-        masks (Tensor): shape (n, 2, 36)
+        masks (Tensor): shape (n, 2, num_polar)
         labels (Tensor): shape (n, )
         num_classes (int): class number, including background class
+        img_meta (dict): meta info of the image
+        max_num (int): if > 0, only the top max_num detections by score
+            are kept and rasterized
 
     Returns:
-        list(ndarray): bbox results of each class
+        tuple(list): bbox results (ndarrays) and mask results (RLEs) of
+            each class
     """
     ori_shape = img_meta['ori_shape']
     img_h, img_w, _ = ori_shape
 
-    mask_results = [[] for _ in range(num_classes - 1)]
-
-    for i in range(masks.shape[0]):
-        im_mask = np.zeros((img_h, img_w), dtype=np.uint8)
-        mask = [masks[i].transpose(1,0).unsqueeze(1).int().data.cpu().numpy()]
-        im_mask = cv2.drawContours(im_mask, mask, -1,1,-1)
-        rle = mask_util.encode(
-            np.array(im_mask[:, :, np.newaxis], order='F'))[0]
-
-        label = labels[i]
-
-        mask_results[label].append(rle)
+    if max_num > 0 and bboxes.shape[0] > max_num:
+        _, inds = bboxes[:, -1].topk(max_num)
+        inds = inds.sort()[0]
+        bboxes, masks, labels = bboxes[inds], masks[inds], labels[inds]
 
+    mask_results = [[] for _ in range(num_classes - 1)]
+    polygons = masks.transpose(1, 2).int().cpu().numpy()
+    for polygon, label in zip(polygons, labels.tolist()):
+        mask_results[label].append(polygon2rle(polygon, img_h, img_w))
 
     if bboxes.shape[0] == 0:
         bbox_results = [
@@ -197,7 +288,12 @@ def bbox_mask2result(bboxes, masks, labels, num_classes, img_meta):
     else:
         bboxes = bboxes.cpu().numpy()
         labels = labels.cpu().numpy()
-        bbox_results = [bboxes[labels == i, :] for i in range(num_classes - 1)]
+        # only split the classes that are present, e.g. a single tracked one
+        bbox_results = [
+            np.zeros((0, 5), dtype=np.float32) for i in range(num_classes - 1)
+        ]
+        for i in np.unique(labels):
+            bbox_results[i] = bboxes[labels == i, :]
         return bbox_results, mask_results
 
 def distance2bbox(points, distance, max_shape=None):
@@ -9,6 +9,7 @@ from .class_names import (coco_classes, dataset_aliases, get_classes,
                           imagenet_det_classes, imagenet_vid_classes,
                           voc_classes)
 from .coco_utils import coco_eval, fast_eval_recall, results2json
+from .davis_eval import DAVISOnlineEval
 from .davis_utils import davis_eval
 from .eval_hooks import (CocoDistEvalmAPHook, CocoDistEvalRecallHook,
                          DistEvalHook, DistEvalmAPHook)
@@ -23,5 +24,5 @@ __all__ = [
     'CocoDistEvalRecallHook', 'CocoDistEvalmAPHook', 'average_precision',
     'eval_map', 'print_map_summary', 'eval_recalls', 'print_recall_summary',
     'plot_num_recall', 'plot_iou_recall', 
-    'davis_eval'
+    'davis_eval', 'DAVISOnlineEval'
 ]
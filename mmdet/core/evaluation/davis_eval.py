@@ -6,11 +6,124 @@
 @LastEditAuthor: JosieHong
 LastEditTime: 2021-01-17 01:23:17
 '''
-import numpy as np
 import time
 import warnings
+from collections import OrderedDict
+from multiprocessing import Pool
+
+import numpy as np
+import pycocotools.mask as mask_util
+from terminaltables import AsciiTable
+
+from .vos_measures import db_eval_iou, db_eval_boundary_batch, db_gt_boundary#, db_eval_t_stab
+
+# packed gt boundary maps, reused by every evaluation in this process
+_GT_BOUNDARY_CACHE = OrderedDict()
+_GT_BOUNDARY_CACHE_SIZE = 8192
+# frames of which the boundaries are evaluated at once
+_BATCH_SIZE = 8
+
+
+def _pack(mask):
+    return np.packbits(mask.astype(np.bool_), axis=None)
+
+
+def _unpack(packed, shape):
+    return np.unpackbits(packed)[:shape[0] * shape[1]].reshape(shape).astype(
+        np.bool_)
+
+
+def _gt_cache_key(rle):
+    counts = rle['counts']
+    return tuple(rle['size']), counts if isinstance(
+        counts, bytes) else str(counts)
+
+
+def _cache_gt_bounds(keys, gt_bounds):
+    for key, bounds in zip(keys, gt_bounds):
+        if bounds is not None:
+            _GT_BOUNDARY_CACHE[key] = bounds
+            _GT_BOUNDARY_CACHE.move_to_end(key)
+    while len(_GT_BOUNDARY_CACHE) > _GT_BOUNDARY_CACHE_SIZE:
+        _GT_BOUNDARY_CACHE.popitem(last=False)
+
+
+def _eval_frames(gt_rles, dt_rles, measures, gt_bounds):
+    """Measures of frames of the same size, the F measure is batched.
+
+    Arguments:
+        gt_rles (list): gt RLEs.
+        dt_rles (list): dt RLEs, None for a missing detection.
+        measures (list): measures to be computed.
+        gt_bounds (list): packed gt boundary maps, None if not cached.
+    Returns:
+        results (dict): per-frame values of every measure.
+        gt_bounds (list): packed gt boundary maps, for the cache.
+    """
+    annotations = np.stack([mask_util.decode(gt_rle) for gt_rle in gt_rles])
+    segmentations = np.zeros_like(annotations)
+    for i, dt_rle in enumerate(dt_rles):
+        if dt_rle is not None:
+            segmentations[i] = mask_util.decode(dt_rle)
+    results = {}
+    if 'J' in measures:
+        results['J'] = [
+            db_eval_iou(annotation, segmentation)
+            for annotation, segmentation in zip(annotations, segmentations)
+        ]
+    if 'F' in measures:
+        gt_bounds = list(gt_bounds)
+        missing = [i for i, bound in enumerate(gt_bounds) if bound is None]
+        if len(missing) > 0:
+            for i, gt_boundary, gt_dil in zip(
+                    missing, *db_gt_boundary(annotations[missing])):
+                gt_bounds[i] = (_pack(gt_boundary), _pack(gt_dil))
+        shape = annotations.shape[1:]
+        gt_boundaries, gt_dils = (np.stack(
+            [_unpack(bound[k], shape) for bound in gt_bounds])
+                                  for k in range(2))
+        results['F'] = db_eval_boundary_batch(
+            segmentations,
+            annotations,
+            gt_boundaries=gt_boundaries,
+            gt_dils=gt_dils)
+    return results, gt_bounds
+
+
+def _eval_sequence(task):
+    """Per-frame measures of one sequence, run in a worker process.
+
+    Arguments:
+        task (tuple): gt RLEs, dt RLEs (None for a missing detection),
+            measures and the packed gt boundary maps (None if not cached).
+    Returns:
+        results (dict): per-frame values of every measure.
+        gt_bounds (list): packed gt boundary maps, for the cache.
+    """
+    gt_rles, dt_rles, measures, gt_bounds = task
+    results = {measure: [] for measure in measures}
+    start = 0
+    while start < len(gt_rles):
+        # batches of at most _BATCH_SIZE frames of the same size
+        end = start + 1
+        while (end < len(gt_rles) and end - start < _BATCH_SIZE
+               and gt_rles[end]['size'] == gt_rles[start]['size']):
+            end += 1
+        batch_results, gt_bounds[start:end] = _eval_frames(
+            gt_rles[start:end], dt_rles[start:end], measures,
+            gt_bounds[start:end])
+        for measure in measures:
+            results[measure].extend(batch_results[measure])
+        start = end
+    return results, gt_bounds
+
+
+def _check_measures(measures):
+    for measure in measures:
+        if measure not in ('J', 'F'):
+            raise Exception("Unknown measure=[{}]. \
+                Valid options are measure={{J,F,T}}".format(measure))
 
-from .vos_measures import db_eval_iou, db_eval_boundary#, db_eval_t_stab
 
 class DAVISeval:
     # The usage for DAVISeval is as follows:
@@ -18,11 +131,12 @@ class DAVISeval:
     #  E = DavisEval(davisGt,davisDt);  # initialize DavisEval object
     #  E.evaluate();                    # run per method evaluation
 
-    def __init__(self, davisGt=None, davisDt=None):
+    def __init__(self, davisGt=None, davisDt=None, nproc=1):
         '''
         Initialize DavisEval using coco APIs for gt and dt
         :param davisGt: coco object with ground truth annotations
         :param davisDt: coco object with detection results
+        :param nproc: number of processes, sequences are evaluated in parallel
         :return: None
         '''
         self.davisGt = davisGt              # ground truth COCO API
@@ -33,6 +147,9 @@ class DAVISeval:
         if not davisGt is None:
             self.params.imgIds = sorted(davisGt.getImgIds())
             self.params.catIds = sorted(davisGt.getCatIds())
+        self.nproc = nproc
+        self.stats = {}                     # measure -> (M, O, D) over all frames
+        self.seq_stats = OrderedDict()      # sequence -> measure -> (M, O, D)
 
         # josie
         self.measures = ['J', 'F']
@@ -40,23 +157,15 @@ class DAVISeval:
 
     def _prepare(self):
         '''
-        Prepare ._gts and ._dts for evaluation based on params
+        Prepare ._gts and ._dts for evaluation based on params. The masks are
+        kept as annotations and only decoded by the evaluation workers.
         :return: None
         '''
-        def _toMask(anns, davis):
-            # modify ann['segmentation'] by reference
-            for ann in anns:
-                # rle = davis.annToRLE(ann)
-                mask = davis.annToMask(ann)
-                ann['segmentation'] = mask
         p = self.params
 
         gts=self.davisGt.loadAnns(self.davisGt.getAnnIds(imgIds=p.imgIds, catIds=p.catIds))
         dts=self.davisDt.loadAnns(self.davisDt.getAnnIds(imgIds=p.imgIds, catIds=p.catIds))
 
-        _toMask(gts, self.davisGt)
-        _toMask(dts, self.davisDt)
-
         # set ignore flag
         for gt in gts:
             gt['ignore'] = gt['ignore'] if 'ignore' in gt else 0
@@ -67,7 +176,6 @@ class DAVISeval:
         for dt in dts:
             if dt['image_id'] == last_img_id:
                 continue
-            self._dts.append(dt)
             if dt['image_id'] > last_img_id + 1:
                 missing_range = dt['image_id'] - (last_img_id + 1)
                 for i in range(missing_range):
@@ -75,20 +183,32 @@ class DAVISeval:
                     self._dts.append(dict({'image_id':last_img_id + 1 + i,
                                             'score': 0,
                                             'category_id': None,
-                                            'segmentation': np.zeros(dt['segmentation'].shape), 
+                                            'segmentation': None,
                                             'area': 0,
                                             'bbox': np.array([0, 0, 0, 0]),
                                             'id': None,
                                             'iscrowd': None}))
+            self._dts.append(dt)
             last_img_id = dt['image_id']
-        
 
-    def _eval(self, annotations, segmentations, eval_func, measure):
+    def _sequences(self):
+        '''
+        Split the frames into sequences, i.e. runs of gts of the same category.
+        :return: list of (sequence name, start frame, end frame)
+        '''
+        sequences = []
+        for i, gt in enumerate(self._gts):
+            if i == 0 or gt['category_id'] != self._gts[i - 1]['category_id']:
+                cat = self.davisGt.loadCats(gt['category_id'])[0]
+                sequences.append([cat['name'], i, i + 1])
+            else:
+                sequences[-1][2] = i + 1
+        return [tuple(seq) for seq in sequences]
+
+    def _eval(self, per_frame_values, measure):
         """ Evaluate all videos.
                 Arguments:
-                        annotations(ndarray):           binary annotation maps.
-            segmentations(ndarray):         binary segmentation maps.
-            eval_func(list: ['db_eval_iou', 'db_eval_boundary', 'db_eval_t_stab'])
+                        per_frame_values(ndarray):      per-frame measure of the frames.
                         measure(string: 'J','F','T'):   measure to be computed
                 Returns:
                         X: per-frame measure evaluation.
@@ -96,15 +216,7 @@ class DAVISeval:
                         O: recall of per-frame measure.
                         D: decay  of per-frame measure.
                 """
-        assert len(annotations) == len(segmentations)
-
-        # if measure == 'T':
-        #     return None
-        #     magic_number = 5.0
-        #     X = np.array([np.nan]+[eval_func(an,sg)*magic_number for an,sg
-                #               in zip(segmentations[:-1], segmentations[1:])] + [np.nan])
-        # else:
-        X = np.array([np.nan]+[eval_func(an, sg) for an,sg in zip(annotations, segmentations)]+[np.nan])
+        X = np.array([np.nan]+list(per_frame_values)+[np.nan])
 
         M,O,D = self.db_statistics(X)
 
@@ -142,111 +254,195 @@ class DAVISeval:
 
         return M,O,D
 
-    def evaluate(self):
+    def _run_sequences(self, sequences):
+        '''
+        Compute the per-frame measures of every sequence, in parallel if
+        nproc > 1. The gt boundary maps are cached for later evaluations.
+        :return: list of dict, measure -> per-frame values of a sequence
+        '''
+        _check_measures(self.measures)
+        gt_rles = [self.davisGt.annToRLE(gt) for gt in self._gts]
+        dt_rles = [None if dt['segmentation'] is None else self.davisDt.annToRLE(dt)
+                   for dt in self._dts]
+        assert len(gt_rles) == len(dt_rles)
+        keys = [_gt_cache_key(rle) for rle in gt_rles]
+
+        tasks = []
+        for _, start, end in sequences:
+            gt_bounds = [_GT_BOUNDARY_CACHE.get(key) for key in keys[start:end]]
+            tasks.append((gt_rles[start:end], dt_rles[start:end],
+                          self.measures, gt_bounds))
+        if self.nproc > 1 and len(tasks) > 1:
+            pool = Pool(min(self.nproc, len(tasks)))
+            outputs = pool.map(_eval_sequence, tasks, chunksize=1)
+            pool.close()
+            pool.join()
+        else:
+            outputs = [_eval_sequence(task) for task in tasks]
+
+        results = []
+        for (_, start, end), (seq_results, gt_bounds) in zip(sequences, outputs):
+            _cache_gt_bounds(keys[start:end], gt_bounds)
+            results.append(seq_results)
+        return results
+
+    def evaluate(self, per_sequence=True):
         '''
         Run evaluation on different functions
+        :param per_sequence: also print the statistics of every sequence
         :return: None
         '''
-        # metrix over all ---------------------------------------------------------------------------
         tic = time.time()
         self._prepare()
-        
-        annotations = [np.array(anno['segmentation']) for anno in self._gts]
-        segmentations = [np.array(segm['segmentation']) for segm in self._dts]
-
-        for measure in self.measures:
-            if measure == 'J':
-                J, Jm, Jo, Jd = self._eval(annotations, segmentations, db_eval_iou, measure)
-            elif measure=='F':
-                F, Fm, Fo, Fd = self._eval(annotations, segmentations, db_eval_boundary, measure)
-            # elif measure=='T':
-            #     T, Tm, To, Td = self._eval(annotations, segmentations, db_eval_t_stab, measure)
-            else:
-                raise Exception("Unknown measure=[{}}]. \
-                    Valid options are measure={J,F,T}".format(measure))
-
+        sequences = self._sequences()
+        results = self._run_sequences(sequences)
+        self._accumulate(sequences, results)
         toc = time.time()
         print('DONE (t={:0.2f}s).'.format(toc-tic))
+        self.summarize(per_sequence)
 
+    def _accumulate(self, sequences, results):
+        '''
+        Compute the statistics over all frames and per sequence
+        :param sequences: list of (sequence name, start frame, end frame)
+        :param results: list of dict, measure -> per-frame values of a sequence
+        :return: None
+        '''
+        # metrix over all ---------------------------------------------------------------------------
+        # the frames of all sequences are concatenated, as in a single pass
+        for measure in self.measures:
+            per_frame_values = np.concatenate(
+                [np.array(seq_results[measure], dtype=np.float64)
+                 for seq_results in results])
+            _, M, O, D = self._eval(per_frame_values, measure)
+            self.stats[measure] = (M, O, D)
+
+        # metrix per sequence ---------------------------------------------------------------------------
+        for (name, _, _), seq_results in zip(sequences, results):
+            self.seq_stats[name] = OrderedDict(
+                (measure, self._eval(seq_results[measure], measure)[1:])
+                for measure in self.measures)
+
+    def summarize(self, per_sequence=True):
+        '''
+        Print the statistics of the evaluation
+        :param per_sequence: also print the statistics of every sequence
+        :return: None
+        '''
+        if per_sequence:
+            table_data = [['sequence', 'J(M)', 'J(O)', 'J(D)', 'F(M)', 'F(O)', 'F(D)']]
+            for name, stats in self.seq_stats.items():
+                table_data.append([name] + [
+                    '{:.3f}'.format(value) for measure in ('J', 'F')
+                    for value in stats[measure]])
+            print(AsciiTable(table_data).table)
+
+        Jm, Jo, Jd = self.stats['J']
+        Fm, Fo, Fd = self.stats['F']
         print('J(M): {}, J(O): {}, J(D): {}'.format(Jm, Jo, Jd))
         print('F(M): {}, F(O): {}, F(D): {}'.format(Fm, Fo, Fd))
         print('T(M): unfinished')
 
+class DAVISOnlineEval(DAVISeval):
+    # Streaming DAVISeval, fed with the results while the test is running:
+    #  E = DAVISOnlineEval(davisGt)     # initialize with the ground truth
+    #  E.update(img_id, result)         # evaluate a frame, as soon as it is done
+    #  E.evaluate()                     # compute the statistics
+    # Only the per-frame measures are kept, so neither the results nor their
+    # json dump are needed and the memory does not grow with the masks.
+
+    def __init__(self, davisGt):
+        '''
+        Initialize DAVISOnlineEval with the gt of every frame
+        :param davisGt: coco object with ground truth annotations
+        :return: None
+        '''
+        super(DAVISOnlineEval, self).__init__(davisGt)
+        _check_measures(self.measures)
+        p = self.params
+        self._frames = {}                   # img_id -> frame
+        for img_id in p.imgIds:
+            ann_ids = davisGt.getAnnIds(imgIds=[img_id], catIds=p.catIds)
+            if len(ann_ids) == 0:
+                continue
+            self._frames[img_id] = len(self._gts)
+            self._gts.append(davisGt.loadAnns(ann_ids[:1])[0])
+        self._img_ids = sorted(self._frames, key=self._frames.get)
+        self.values = {measure: np.full(len(self._gts), np.nan)
+                       for measure in self.measures}
+        self.done = np.zeros(len(self._gts), dtype=np.bool_)
+
+    @staticmethod
+    def _first_segm(result):
+        # same as DAVISeval: the first mask of the first class with a detection
+        _, segm_result = result
+        if isinstance(segm_result, tuple):
+            segm_result = segm_result[0]
+        for segms in segm_result:
+            if len(segms) > 0:
+                return segms[0]
+        return None
+
+    def _update_frame(self, frame, dt_rle):
+        gt_rle = self.davisGt.annToRLE(self._gts[frame])
+        key = _gt_cache_key(gt_rle)
+        values, gt_bounds = _eval_frames([gt_rle], [dt_rle], self.measures,
+                                         [_GT_BOUNDARY_CACHE.get(key)])
+        _cache_gt_bounds([key], gt_bounds)
+        for measure in self.measures:
+            self.values[measure][frame] = values[measure][0]
+        self.done[frame] = True
+
+    def update(self, img_id, result):
+        '''
+        Evaluate the result of a frame, the result can be dropped afterwards
+        :param img_id: image id of the frame
+        :param result: (bbox results, segm results) of the frame
+        :return: None
+        '''
+        frame = self._frames.get(img_id)
+        if frame is not None:
+            self._update_frame(frame, self._first_segm(result))
+
+    def state(self):
+        '''
+        The per-frame measures, to be merged into the evaluator of another process
+        :return: dict
+        '''
+        return dict(values=self.values, done=self.done)
+
+    def merge(self, state):
+        '''
+        Merge the per-frame measures of another evaluator
+        :param state: output of state()
+        :return: None
+        '''
+        done = state['done'] & ~self.done
+        for measure in self.measures:
+            self.values[measure][done] = state['values'][measure][done]
+        self.done |= done
+
+    def evaluate(self, per_sequence=True):
+        '''
+        Compute the statistics of the frames evaluated so far, the missing
+        frames are evaluated as empty results
+        :param per_sequence: also print the statistics of every sequence
+        :return: None
+        '''
+        tic = time.time()
+        for frame in np.flatnonzero(~self.done):
+            print("Image {} is missing. An empty result is appended.".format(
+                self._img_ids[frame]))
+            self._update_frame(frame, None)
+        sequences = self._sequences()
+        results = [{measure: self.values[measure][start:end]
+                    for measure in self.measures}
+                   for _, start, end in sequences]
+        self._accumulate(sequences, results)
+        toc = time.time()
+        print('DONE (t={:0.2f}s).'.format(toc-tic))
+        self.summarize(per_sequence)
 
-        # # metrix per sequence ---------------------------------------------------------------------------
-        # # note: for every category (no shuffle)
-        # tic = time.time()
-        # self._prepare()
-
-        # last_category = -1
-        # start_frame = 0
-        # category_dict = {}
-        # for i, gt in enumerate(self._gts):
-        #     if gt['category_id'] != last_category:
-        #         category_dict[self._gts[i-1]['category_id']] = [start_frame, self._gts[i-1]['image_id']]
-        #         start_frame = gt['image_id']
-        #         last_category = gt['category_id']
-        # print('category_dict: ', category_dict)
-
-        # for category in category_dict.keys():
-        #     start_frame = category_dict[category][0]
-        #     end_frame = category_dict[category][1]
-        #     annotations = [np.array(anno['segmentation']) for anno in self._gts[start_frame:end_frame]]
-        #     segmentations = [np.array(segm['segmentation']) for segm in self._dts[start_frame:end_frame]]
-
-        #     for measure in self.measures:
-        #         if measure == 'J':
-        #             J, Jm, Jo, Jd = self._eval(annotations, segmentations, db_eval_iou, measure)
-        #         elif measure=='F':
-        #             F, Fm, Fo, Fd = self._eval(annotations, segmentations, db_eval_boundary, measure)
-        #         # elif measure=='T':
-        #         #     T, Tm, To, Td = self._eval(annotations, segmentations, db_eval_t_stab, measure)
-        #         else:
-        #             raise Exception("Unknown measure=[{}}]. \
-        #                 Valid options are measure={J,F,T}".format(measure))
-
-        #     print(category)
-        #     print('J(M): {}, J(O): {}, J(D): {}'.format(Jm, Jo, Jd))
-        #     print('F(M): {}, F(O): {}, F(D): {}'.format(Fm, Fo, Fd))
-        #     print('T(M): unfinished')
-
-        # toc = time.time()
-        # print('DONE (t={:0.2f}s).'.format(toc-tic))
-
-
-        # # metrix per sequence ---------------------------------------------------------------------------
-        # # note: for every category (no shuffle)
-        # tic = time.time()
-        # self._prepare()
-
-        # last_category = -1
-        # start_frame = 0
-        # category_dict = {}
-        # for i, gt in enumerate(self._gts):
-        #     if gt['category_id'] != last_category:
-        #         if last_category != -1:
-        #             category_dict[self._gts[i-1]['category_id']] = [start_frame, self._gts[i-1]['image_id']]
-        #         start_frame = gt['image_id']
-        #         last_category = gt['category_id']
-        # print('category_dict: ', category_dict)
-
-        # for category in category_dict.keys():
-        #     start_frame = category_dict[category][0]
-        #     end_frame = category_dict[category][1]
-        #     annotations = [np.array(anno['segmentation']) for anno in self._gts[start_frame:end_frame]]
-        #     segmentations = [np.array(segm['segmentation']) for segm in self._dts[start_frame:end_frame]]
-
-        #     ape = 0
-        #     for a, s in zip(annotations, segmentations):
-        #         ape += np.sum(a) - np.sum(a*s)
-        #     ape = ape / len(annotations)
-
-        #     print(category)
-        #     print('APE: ', ape)
-
-        # toc = time.time()
-        # print('DONE (t={:0.2f}s).'.format(toc-tic))
-        
 class Params:
     '''
     Params for davis evaluation api
@@ -6,7 +6,11 @@
 '''
 from .davis_eval import DAVISeval
 
-def davis_eval(result_files, davis):
+def davis_eval(result_files, davis, nproc=1, per_sequence=True):
+	"""Evaluate J&F of the segm results, with the sequences sharded over
+	nproc processes. Returns the DAVISeval, see its stats and seq_stats.
+	"""
 	davis_dets = davis.loadRes(result_files['segm'])
-	davisEval = DAVISeval(davis, davis_dets)
-	davisEval.evaluate()
\ No newline at end of file
+	davisEval = DAVISeval(davis, davis_dets, nproc=nproc)
+	davisEval.evaluate(per_sequence=per_sequence)
+	return davisEval
@@ -34,14 +34,89 @@ def db_eval_iou(annotation,segmentation):
 
 """ Utilities for computing, reading and saving benchmark evaluation."""
 
-def db_eval_boundary(foreground_mask,gt_mask,bound_th=0.008):
+def get_bound_pix(shape,bound_th=0.008):
+	""" Boundary tolerance in pixels of an image of the given shape. """
+	return bound_th if bound_th >= 1 else \
+			np.ceil(bound_th*np.linalg.norm(shape))
+
+def dilate_bmaps(bmaps,bound_pix):
+	"""
+	Dilate boundary maps with a disk of radius bound_pix, i.e. find the
+	pixels within bound_pix of a boundary pixel. A pixel is within reach iff
+	its euclidean distance to the nearest boundary pixel is <= bound_pix,
+	which is the same as binary_dilation with skimage's disk(bound_pix)
+	for integer radii, at the cost of one distance transform.
+	Arguments:
+		bmaps     (ndarray): binary boundary maps, of shape (h,w) or (n,h,w).
+		bound_pix (float):   dilation radius in pixels.
+	Returns:
+		dil (ndarray): dilated binary boundary maps, of the same shape.
+	"""
+	from scipy.ndimage import distance_transform_edt
+
+	bmaps = np.asarray(bmaps,dtype=np.bool_)
+	if bmaps.ndim == 3:
+		return np.stack([dilate_bmaps(bmap,bound_pix) for bmap in bmaps]) \
+				if len(bmaps) > 0 else np.zeros_like(bmaps)
+	if not bmaps.any():
+		return np.zeros_like(bmaps)
+	return distance_transform_edt(~bmaps) <= bound_pix
+
+def db_gt_boundary(gt_mask,bound_th=0.008):
+	"""
+	Compute the boundary map of an annotation and its dilation by the
+	boundary tolerance, which only depend on the annotation and can be
+	reused by every evaluation of it.
+	Arguments:
+		gt_mask (ndarray): binary annotated image, or (n,h,w) images.
+	Returns:
+		gt_boundary (ndarray): binary boundary map.
+		gt_dil      (ndarray): dilated binary boundary map.
+	"""
+	gt_boundary = _bmaps(gt_mask)
+	gt_dil = dilate_bmaps(gt_boundary,get_bound_pix(gt_mask.shape[-2:],bound_th))
+	return gt_boundary, gt_dil
+
+def db_eval_boundary_batch(foreground_masks,gt_masks,bound_th=0.008,gt_boundaries=None,gt_dils=None):
+	"""
+	Same as db_eval_boundary, for a batch of frames of the same size.
+	Arguments:
+		foreground_masks (ndarray): binary segmentation images (n,h,w).
+		gt_masks         (ndarray): binary annotated images (n,h,w).
+		gt_boundaries, gt_dils (ndarray, optional): precomputed boundary
+			maps of gt_masks, see db_gt_boundary.
+	Returns:
+		F (list): boundaries F-measure of every frame
+	"""
+	assert foreground_masks.ndim == 3
+
+	bound_pix = get_bound_pix(foreground_masks.shape[-2:],bound_th)
+
+	# Get the pixel boundaries of both masks
+	fg_boundary = _bmaps(foreground_masks)
+	fg_dil = dilate_bmaps(fg_boundary,bound_pix)
+	if gt_boundaries is None or gt_dils is None:
+		gt_boundaries, gt_dils = db_gt_boundary(gt_masks,bound_th)
+
+	# Area of the boundaries and of their intersections
+	n_fg     = np.count_nonzero(fg_boundary,axis=(1,2))
+	n_gt     = np.count_nonzero(gt_boundaries,axis=(1,2))
+	n_fg_match = np.count_nonzero(fg_boundary & gt_dils,axis=(1,2))
+	n_gt_match = np.count_nonzero(gt_boundaries & fg_dil,axis=(1,2))
+
+	return [_f_measure(*counts) for counts in
+			zip(n_fg,n_gt,n_fg_match,n_gt_match)]
+
+def db_eval_boundary(foreground_mask,gt_mask,bound_th=0.008,gt_boundary=None,gt_dil=None):
 	"""
 	Compute mean,recall and decay from per-frame evaluation.
 	Calculates precision/recall for boundaries between foreground_mask and
-	gt_mask using morphological operators to speed it up.
+	gt_mask using distance transforms to speed it up.
 	Arguments:
 		foreground_mask (ndarray): binary segmentation image.
 		gt_mask         (ndarray): binary annotated image.
+		gt_boundary, gt_dil (ndarray, optional): precomputed boundary maps
+			of gt_mask, see db_gt_boundary.
 	Returns:
 		F (float): boundaries F-measure
 		P (float): boundaries precision
@@ -49,26 +124,13 @@ def db_eval_boundary(foreground_mask,gt_mask,bound_th=0.008):
 	"""
 	assert np.atleast_3d(foreground_mask).shape[2] == 1
 
-	bound_pix = bound_th if bound_th >= 1 else \
-			np.ceil(bound_th*np.linalg.norm(foreground_mask.shape))
-
-	# Get the pixel boundaries of both masks
-	fg_boundary = seg2bmap(foreground_mask);
-	gt_boundary = seg2bmap(gt_mask);
-
-	from skimage.morphology import binary_dilation,disk
-
-	fg_dil = binary_dilation(fg_boundary,disk(bound_pix))
-	gt_dil = binary_dilation(gt_boundary,disk(bound_pix))
-
-	# Get the intersection
-	gt_match = gt_boundary * fg_dil
-	fg_match = fg_boundary * gt_dil
-
-	# Area of the intersection
-	n_fg     = np.sum(fg_boundary)
-	n_gt     = np.sum(gt_boundary)
+	if gt_boundary is not None and gt_dil is not None:
+		gt_boundary, gt_dil = gt_boundary[None], gt_dil[None]
+	return db_eval_boundary_batch(foreground_mask[None],gt_mask[None],
+			bound_th,gt_boundary,gt_dil)[0]
 
+def _f_measure(n_fg,n_gt,n_fg_match,n_gt_match):
+	""" Boundary F-measure from the boundary and intersection areas. """
 	#% Compute precision and recall
 	if n_fg == 0 and  n_gt > 0:
 		precision = 1
@@ -80,8 +142,8 @@ def db_eval_boundary(foreground_mask,gt_mask,bound_th=0.008):
 		precision = 1
 		recall = 1
 	else:
-		precision = np.sum(fg_match)/float(n_fg)
-		recall    = np.sum(gt_match)/float(n_gt)
+		precision = n_fg_match/float(n_fg)
+		recall    = n_gt_match/float(n_gt)
 
 	# Compute F measure
 	if precision + recall == 0:
@@ -91,6 +153,18 @@ def db_eval_boundary(foreground_mask,gt_mask,bound_th=0.008):
 
 	return F
 
+def _bmaps(segs):
+	"""
+	Same as seg2bmap at full size, for (h,w) or (n,h,w) segmentations,
+	without the shifted copies of the segmentations.
+	"""
+	segs = np.asarray(segs).astype(np.bool_)
+	b = np.zeros_like(segs)
+	b[...,:,:-1]    = segs[...,:,:-1] ^ segs[...,:,1:]
+	b[...,:-1,:]   |= segs[...,:-1,:] ^ segs[...,1:,:]
+	b[...,:-1,:-1] |= segs[...,:-1,:-1] ^ segs[...,1:,1:]
+	return b
+
 def seg2bmap(seg,width=None,height=None):
 	"""
 	From a segmentation, compute a binary boundary map with 1 pixel wide
@@ -122,18 +196,7 @@ def seg2bmap(seg,width=None,height=None):
 	assert not (width>w | height>h | abs(ar1-ar2)>0.01),\
 			'Can''t convert %dx%d seg to %dx%d bmap.'%(w,h,width,height)
 
-	e  = np.zeros_like(seg)
-	s  = np.zeros_like(seg)
-	se = np.zeros_like(seg)
-
-	e[:,:-1]    = seg[:,1:]
-	s[:-1,:]    = seg[1:,:]
-	se[:-1,:-1] = seg[1:,1:]
-
-	b        = seg^e | seg^s | seg^se
-	b[-1,:]  = seg[-1,:]^e[-1,:]
-	b[:,-1]  = seg[:,-1]^s[:,-1]
-	b[-1,-1] = 0
+	b = _bmaps(seg)
 
 	if w == width and h == height:
 		bmap = b
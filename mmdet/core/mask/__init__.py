@@ -1,4 +1,8 @@
 from .mask_target import mask_target
+from .polar_target import polar_distances, polar_target_from_contours
 from .utils import split_combined_polys
 
-__all__ = ['split_combined_polys', 'mask_target']
+__all__ = [
+    'split_combined_polys', 'mask_target', 'polar_target_from_contours',
+    'polar_distances'
+]
@@ -0,0 +1,195 @@
+import math
+
+import torch
+
+INF = 1e8
+
+
+def polar_target_from_contours(points,
+                               regress_ranges,
+                               strides,
+                               gt_bboxes_list,
+                               gt_labels_list,
+                               gt_centers_list,
+                               gt_contours_list,
+                               num_polar=36,
+                               radius=1.5,
+                               max_offset=5):
+    """Compute the polar targets of a batch from the gt contours.
+
+    This is the target assignment of the VOS datasets (``polar_target_single``
+    with mask-center sampling) as batched tensor ops, on the device of the
+    points: the gts of all images are padded to the same number, every point
+    is assigned to the smallest gt that samples it and covers its regress
+    range, and the ray distances of the positive points are computed at once
+    (see :func:`polar_distances`).
+
+    Args:
+        points (list[Tensor]): Points of every level, shape (n_i, 2).
+        regress_ranges (list[tuple]): Regress range of every level.
+        strides (list[int]): Stride of every level.
+        gt_bboxes_list (list[Tensor]): Gt bboxes of every image, (k, 4).
+        gt_labels_list (list[Tensor]): Gt labels of every image, (k, ).
+        gt_centers_list (list[Tensor]): Mass centers of the gt masks of every
+            image, (k, 2) as (x, y).
+        gt_contours_list (list[Tensor]): Contours of the gt masks of every
+            image, (k, m, 2) as (x, y), padded by repeating a point.
+        num_polar (int): Number of rays.
+        radius (float | None): Center sampling radius w.r.t. the stride, the
+            whole gt bbox is sampled if None.
+        max_offset (int): Largest angle offset (degrees) searched for rays
+            without a contour point.
+
+    Returns:
+        tuple[list[Tensor]]: labels (n, ), bbox_targets (n, 4) and
+            mask_targets (n, num_polar) of every image, n = sum(n_i).
+    """
+    num_imgs = len(gt_bboxes_list)
+    concat_points = torch.cat(points)
+    num_points = concat_points.size(0)
+    max_gts = max(gt_bboxes.size(0) for gt_bboxes in gt_bboxes_list)
+    if max_gts == 0:
+        return ([concat_points.new_zeros(num_points)] * num_imgs,
+                [concat_points.new_zeros(num_points, 4)] * num_imgs,
+                [concat_points.new_zeros(num_points, num_polar)] * num_imgs)
+
+    # pad the gts of every image to max_gts, padded gts are never assigned
+    gt_bboxes = concat_points.new_zeros(num_imgs, max_gts, 4)
+    gt_labels = concat_points.new_zeros(num_imgs, max_gts)
+    gt_centers = concat_points.new_zeros(num_imgs, max_gts, 2)
+    # the mask type of comparisons, uint8 or bool depending on PyTorch
+    num_gts = torch.tensor([bboxes.size(0) for bboxes in gt_bboxes_list],
+                           device=concat_points.device)
+    valid = torch.arange(
+        max_gts, device=concat_points.device)[None] < num_gts[:, None]
+    max_contour = max(contours.size(1) for contours in gt_contours_list)
+    gt_contours = concat_points.new_zeros(num_imgs, max_gts, max_contour, 2)
+    for i, contours in enumerate(gt_contours_list):
+        num_gts = gt_bboxes_list[i].size(0)
+        gt_bboxes[i, :num_gts] = gt_bboxes_list[i]
+        gt_labels[i, :num_gts] = gt_labels_list[i].to(gt_labels.dtype)
+        gt_centers[i, :num_gts] = gt_centers_list[i]
+        if num_gts > 0:
+            # repeating a contour point does not change the ray distances
+            gt_contours[i, :num_gts] = torch.cat([
+                contours,
+                contours[:, -1:].expand(num_gts,
+                                        max_contour - contours.size(1), 2)
+            ], 1)
+
+    # [num_imgs, num_points, max_gts]
+    xs = concat_points[None, :, 0, None]
+    ys = concat_points[None, :, 1, None]
+    x1, y1, x2, y2 = [gt_bboxes[:, None, :, i] for i in range(4)]
+    bbox_targets = torch.stack((xs - x1, ys - y1, x2 - xs, y2 - ys), -1)
+
+    # condition1: inside the sample region of a gt
+    if radius is not None:
+        lvl_radius = torch.cat([
+            concat_points.new_full((lvl_points.size(0), ), stride * radius)
+            for lvl_points, stride in zip(points, strides)
+        ])[None, :, None]
+        center_x = gt_centers[:, None, :, 0]
+        center_y = gt_centers[:, None, :, 1]
+        inside_gt_bbox_mask = torch.stack(
+            (xs - torch.max(center_x - lvl_radius, x1),
+             ys - torch.max(center_y - lvl_radius, y1),
+             torch.min(center_x + lvl_radius, x2) - xs,
+             torch.min(center_y + lvl_radius, y2) - ys), -1).min(-1)[0] > 0
+    else:
+        inside_gt_bbox_mask = bbox_targets.min(-1)[0] > 0
+
+    # condition2: limit the regression range for each location
+    concat_regress_ranges = torch.cat([
+        concat_points.new_tensor(regress_range)[None].expand(
+            lvl_points.size(0), 2)
+        for lvl_points, regress_range in zip(points, regress_ranges)
+    ])
+    max_regress_distance = bbox_targets.max(-1)[0]
+    inside_regress_range = (
+        max_regress_distance >= concat_regress_ranges[None, :, 0, None]) & (
+            max_regress_distance <= concat_regress_ranges[None, :, 1, None])
+
+    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+    areas = areas.expand(num_imgs, num_points, max_gts).clone()
+    areas[~(inside_gt_bbox_mask & inside_regress_range & valid[:, None])] = INF
+    min_area, min_area_inds = areas.min(dim=2)
+
+    labels = gt_labels.gather(1, min_area_inds)
+    labels[min_area == INF] = 0
+    bbox_targets = bbox_targets.gather(
+        2, min_area_inds[..., None, None].expand(num_imgs, num_points, 1,
+                                                 4)).squeeze(2)
+
+    mask_targets = concat_points.new_zeros(num_imgs, num_points, num_polar)
+    pos_inds = labels.nonzero()
+    if pos_inds.numel() > 0:
+        img_inds, pos_inds = pos_inds[:, 0], pos_inds[:, 1]
+        mask_targets[img_inds, pos_inds] = polar_distances(
+            concat_points[pos_inds],
+            gt_contours[img_inds, min_area_inds[img_inds, pos_inds]],
+            num_polar, max_offset)
+    return list(labels), list(bbox_targets), list(mask_targets)
+
+
+def polar_distances(points, contours, num_polar=36, max_offset=5):
+    """Ray distances from every point to its own contour.
+
+    Every contour point is binned by its integer angle (in degrees) around
+    the point, keeping the farthest one per bin. The distance of a ray is
+    read from the bin of its angle, or from the nearest non-empty bin within
+    max_offset degrees, searched in the order +1, -1, +2, -2, ... Rays
+    without any contour point get 1e-6.
+
+    Args:
+        points (Tensor): Shape (p, 2), (x, y).
+        contours (Tensor): Shape (p, m, 2), (x, y).
+        num_polar (int): Number of rays, starting from angle 0.
+        max_offset (int): Largest angle offset (degrees) searched for rays
+            without a contour point.
+
+    Returns:
+        Tensor: Shape (p, num_polar).
+    """
+    num_points = points.size(0)
+    if num_points == 0:
+        return points.new_zeros((0, num_polar))
+    x = contours[..., 0] - points[:, 0, None]
+    y = contours[..., 1] - points[:, 1, None]
+    angle = torch.atan2(x, y) * 180 / math.pi
+    angle[angle < 0] += 360
+    dist = torch.sqrt(x**2 + y**2).reshape(-1)
+
+    # farthest contour point of every (point, angle) bin, -1 if empty; bins
+    # are padded by max_offset on both sides so that the offset search never
+    # wraps around
+    width = 361 + 2 * max_offset
+    keys = (torch.arange(num_points, device=points.device)[:, None] * width +
+            angle.int().long() + max_offset).reshape(-1)
+    # sort by (key, dist), the farthest point of a bin is its last entry
+    _, dist_order = dist.sort()
+    dist_rank = torch.empty_like(dist_order)
+    dist_rank[dist_order] = torch.arange(
+        dist.numel(), device=points.device)
+    _, order = (keys * dist.numel() + dist_rank).sort()
+    keys, dist = keys[order], dist[order]
+    last = torch.cat([keys[1:] != keys[:-1], keys.new_ones(1) > 0])
+    table = dist.new_full((num_points * width, ), -1)
+    table[keys[last]] = dist[last]
+    table = table.reshape(num_points, width)
+
+    step_size = int(360 / num_polar)
+    offsets = [0]
+    for i in range(1, max_offset + 1):
+        offsets += [i, -i]
+    candidate_inds = (
+        torch.arange(0, 360, step_size, device=points.device)[:, None] +
+        torch.tensor(offsets, device=points.device)[None, :] + max_offset)
+    candidates = table[:, candidate_inds]  # [p, num_polar, num_offsets]
+    # the first valid offset has the largest (valid * decreasing) weight
+    weights = torch.arange(
+        len(offsets), 0, -1, device=points.device).float()
+    found, first = ((candidates >= 0).float() * weights).max(dim=-1)
+    distances = candidates.gather(-1, first[..., None])[..., 0]
+    distances[found == 0] = 1e-6
+    return distances
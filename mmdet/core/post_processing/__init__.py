@@ -1,8 +1,11 @@
-from .bbox_nms import multiclass_nms, multiclass_nms_with_mask
+from .bbox_nms import (agnostic_nms_with_mask, multiclass_nms,
+                       multiclass_nms_with_mask)
 from .merge_augs import (merge_aug_bboxes, merge_aug_masks,
-                         merge_aug_proposals, merge_aug_scores)
+                         merge_aug_polygons, merge_aug_proposals,
+                         merge_aug_scores)
 
 __all__ = [
     'multiclass_nms', 'multiclass_nms_with_mask', 'merge_aug_proposals', 'merge_aug_bboxes',
-    'merge_aug_scores', 'merge_aug_masks'
+    'merge_aug_scores', 'merge_aug_masks', 'merge_aug_polygons',
+    'agnostic_nms_with_mask'
 ]
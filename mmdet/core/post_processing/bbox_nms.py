@@ -72,11 +72,16 @@ def multiclass_nms_with_mask(multi_bboxes,
                    nms_cfg,
                    max_num=-1,
                    score_factors=None):
-    """NMS for multi-class bboxes.
+    """NMS for multi-class bboxes with polygon masks.
+
+    All classes are suppressed by a single NMS call: the bboxes of every
+    class are shifted by a class dependent offset so that bboxes of
+    different classes never overlap.
 
     Args:
         multi_bboxes (Tensor): shape (n, #class*4) or (n, 4)
         multi_scores (Tensor): shape (n, #class)
+        multi_masks (Tensor): shape (n, 2, num_polar)
         score_thr (float): bbox threshold, bboxes with scores lower than it
             will not be considered.
         nms_thr (float): NMS IoU threshold
@@ -86,50 +91,96 @@ def multiclass_nms_with_mask(multi_bboxes,
             applying NMS
 
     Returns:
-        tuple: (bboxes, labels), tensors of shape (k, 5) and (k, 1). Labels
-            are 0-based.
+        tuple: (bboxes, labels, masks), tensors of shape (k, 5), (k, ) and
+            (k, 2, num_polar). Labels are 0-based.
     """
     num_classes = multi_scores.shape[1]
-    bboxes, labels, masks = [], [], []
     nms_cfg_ = nms_cfg.copy()
     nms_type = nms_cfg_.pop('type', 'nms')
     nms_op = getattr(nms_wrapper, nms_type)
-    for i in range(1, num_classes):
-        cls_inds = multi_scores[:, i] > score_thr
-        if not cls_inds.any():
-            continue
-        # get bboxes and scores of this class
-        if multi_bboxes.shape[1] == 4:
-            _bboxes = multi_bboxes[cls_inds, :]
-            _masks  = multi_masks[cls_inds, :]
-        else:
-            _bboxes = multi_bboxes[cls_inds, i * 4:(i + 1) * 4]
-        _scores = multi_scores[cls_inds, i]
-        if score_factors is not None:
-            _scores *= score_factors[cls_inds]
-        cls_dets = torch.cat([_bboxes, _scores[:, None]], dim=1)
-        cls_dets, index = nms_op(cls_dets, **nms_cfg_)
-        cls_masks = _masks[index]
-        cls_labels = multi_bboxes.new_full((cls_dets.shape[0], ),
-                                           i - 1,
-                                           dtype=torch.long)
-        bboxes.append(cls_dets)
-        labels.append(cls_labels)
-        masks.append(cls_masks)
-    if bboxes:
-        bboxes = torch.cat(bboxes)
-        labels = torch.cat(labels)
-        masks = torch.cat(masks)
-        if bboxes.shape[0] > max_num:
-            _, inds = bboxes[:, -1].sort(descending=True)
-            inds = inds[:max_num]
-            bboxes = bboxes[inds]
-            labels = labels[inds]
-            masks = masks[inds]
-    else:
+
+    # (class, point) pairs above the threshold, in class-major order
+    valid = (multi_scores[:, 1:] > score_thr).t()
+    if not valid.any():
         bboxes = multi_bboxes.new_zeros((0, 5))
         labels = multi_bboxes.new_zeros((0, ), dtype=torch.long)
-        masks = multi_bboxes.new_zeros((0, 2, 36))
+        masks = multi_masks.new_zeros((0, 2, multi_masks.shape[-1]))
+        return bboxes, labels, masks
+    labels, inds = valid.nonzero().unbind(1)
+
+    if multi_bboxes.shape[1] == 4:
+        bboxes = multi_bboxes[inds]
+    else:
+        bboxes = multi_bboxes.view(multi_bboxes.size(0), -1, 4)[inds,
+                                                                labels + 1]
+    scores = multi_scores[inds, labels + 1]
+    if score_factors is not None:
+        scores = scores * score_factors[inds]
+
+    # shift the bboxes of each class apart
+    offsets = labels.to(bboxes) * (bboxes.max() + 1)
+    dets = torch.cat([bboxes + offsets[:, None], scores[:, None]], dim=1)
+    dets, keep = nms_op(dets, **nms_cfg_)
+    # NMS keeps bboxes by descending score, regroup them by class
+    labels = labels[keep]
+    order = (labels * keep.numel() +
+             torch.arange(keep.numel(), device=keep.device)).argsort()
+    keep, labels = keep[order], labels[order]
+    bboxes = torch.cat([bboxes[keep], dets[order, -1:]], dim=1)
+    masks = multi_masks[inds[keep]]
+
+    if max_num > 0 and bboxes.shape[0] > max_num:
+        _, inds = bboxes[:, -1].sort(descending=True)
+        inds = inds[:max_num]
+        bboxes = bboxes[inds]
+        labels = labels[inds]
+        masks = masks[inds]
 
     return bboxes, labels, masks
 
+
+def agnostic_nms_with_mask(multi_bboxes,
+                           multi_scores,
+                           multi_masks,
+                           multi_labels,
+                           score_thr,
+                           nms_cfg,
+                           max_num=-1,
+                           score_factors=None):
+    """Class-agnostic NMS for bboxes with one score and label each.
+
+    Used when a single object is tracked: every point has already been
+    assigned a label, so one NMS pass is enough and no per-class structures
+    are built.
+
+    Args:
+        multi_bboxes (Tensor): shape (n, 4)
+        multi_scores (Tensor): shape (n, )
+        multi_masks (Tensor): shape (n, 2, num_polar)
+        multi_labels (Tensor): shape (n, ), 0-based
+        score_thr (float): bbox threshold, bboxes with scores lower than it
+            will not be considered.
+        nms_cfg (dict): NMS config
+        max_num (int): if there are more than max_num bboxes after NMS,
+            only top max_num will be kept.
+        score_factors (Tensor): The factors multiplied to scores before
+            applying NMS
+
+    Returns:
+        tuple: (bboxes, labels, masks), tensors of shape (k, 5), (k, ) and
+            (k, 2, num_polar), sorted by descending score.
+    """
+    nms_cfg_ = nms_cfg.copy()
+    nms_type = nms_cfg_.pop('type', 'nms')
+    nms_op = getattr(nms_wrapper, nms_type)
+
+    inds = (multi_scores > score_thr).nonzero().reshape(-1)
+    scores = multi_scores[inds]
+    if score_factors is not None:
+        scores = scores * score_factors[inds]
+    dets = torch.cat([multi_bboxes[inds], scores[:, None]], dim=1)
+    bboxes, keep = nms_op(dets, **nms_cfg_)
+    if max_num > 0:
+        bboxes, keep = bboxes[:max_num], keep[:max_num]
+    inds = inds[keep]
+    return bboxes, multi_labels[inds], multi_masks[inds]
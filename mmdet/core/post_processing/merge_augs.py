@@ -2,7 +2,7 @@ import numpy as np
 import torch
 
 from mmdet.ops import nms
-from ..bbox import bbox_mapping_back
+from ..bbox import bbox_mapping_back, bbox_overlaps, mask_mapping_back
 
 
 def merge_aug_proposals(aug_proposals, img_metas, rpn_test_cfg):
@@ -93,3 +93,89 @@ def merge_aug_masks(aug_masks, img_metas, rcnn_test_cfg, weights=None):
         merged_masks = np.average(
             np.array(recovered_masks), axis=0, weights=np.array(weights))
     return merged_masks
+
+
+def merge_aug_polygons(aug_bboxes, aug_labels, aug_masks, img_metas,
+                       test_cfg):
+    """Merge augmented polygon detections (multiscale, flip, etc.)
+
+    The detections of every view are mapped back to the original image, with
+    the rays of flipped views re-indexed (see ``mask_flip``). A vertex is
+    the center plus the ray distance along a fixed angle, so averaging the
+    k-th vertices of matched polygons averages their centers and ray
+    distances, i.e. the polygons are fused in ray space.
+
+    The detections are matched greedily by score: the best one left is
+    merged with the best detection of every other view that has the same
+    label and an IoU of at least ``test_cfg.nms.iou_thr``. The score of a
+    merged detection is the sum of the matched scores over the number of
+    views, so a detection missed by some views is down-weighted.
+
+    Args:
+        aug_bboxes (list[Tensor]): shape (n, 5) of every view, in its
+            testing scale.
+        aug_labels (list[Tensor]): shape (n, )
+        aug_masks (list[Tensor]): shape (n, 2, num_polar)
+        img_metas (list[dict]): image info of every view including
+            "img_shape", "scale_factor" and "flip".
+        test_cfg (dict): test config.
+
+    Returns:
+        tuple: (bboxes, labels, masks) in the original image scale, sorted
+            by score.
+    """
+    recovered_bboxes, recovered_masks, views = [], [], []
+    for i, (bboxes, masks, img_info) in enumerate(
+            zip(aug_bboxes, aug_masks, img_metas)):
+        img_shape = img_info['img_shape']
+        scale_factor = img_info['scale_factor']
+        flip = img_info['flip']
+        _bboxes = bboxes.clone()
+        # scale_factor is a (w, h, w, h) array without keep_ratio
+        _bboxes[:, :4] = bbox_mapping_back(_bboxes[:, :4], img_shape,
+                                           bboxes.new_tensor(scale_factor),
+                                           flip)
+        recovered_bboxes.append(_bboxes)
+        recovered_masks.append(
+            mask_mapping_back(masks, img_shape, scale_factor, flip))
+        views.append(bboxes.new_full((bboxes.size(0), ), i, dtype=torch.long))
+    bboxes = torch.cat(recovered_bboxes)
+    labels = torch.cat(aug_labels)
+    masks = torch.cat(recovered_masks)
+    views = torch.cat(views)
+    if bboxes.size(0) == 0:
+        return bboxes, labels, masks
+
+    order = bboxes[:, 4].argsort(descending=True)
+    bboxes, labels, masks, views = (bboxes[order], labels[order],
+                                    masks[order], views[order])
+    matches = bbox_overlaps(bboxes[:, :4], bboxes[:, :4]) >= \
+        test_cfg.nms.iou_thr
+    matches &= labels[:, None] == labels[None, :]
+    merged = bboxes.new_zeros(bboxes.size(0), dtype=torch.bool)
+    clusters = []
+    for i in range(bboxes.size(0)):
+        if merged[i]:
+            continue
+        inds = (matches[i] & ~merged).nonzero().squeeze(1)
+        merged[inds] = True
+        # the best detection of every view, the first one as they are sorted
+        _, firsts = np.unique(views[inds].cpu().numpy(), return_index=True)
+        clusters.append(inds[inds.new_tensor(firsts)])
+        if 0 < test_cfg.max_per_img <= len(clusters):
+            break
+
+    merged_bboxes, merged_masks = [], []
+    for inds in clusters:
+        scores = bboxes[inds, 4]
+        weights = scores / scores.sum()
+        merged_bboxes.append(
+            torch.cat([(bboxes[inds, :4] * weights[:, None]).sum(dim=0),
+                       scores.sum(dim=0, keepdim=True) / len(img_metas)]))
+        merged_masks.append((masks[inds] * weights[:, None, None]).sum(dim=0))
+    merged_bboxes = torch.stack(merged_bboxes)
+    merged_labels = labels[torch.stack([inds[0] for inds in clusters])]
+    merged_masks = torch.stack(merged_masks)
+    # the merged scores may not be in the order of the best scores
+    order = merged_bboxes[:, 4].argsort(descending=True)
+    return merged_bboxes[order], merged_labels[order], merged_masks[order]
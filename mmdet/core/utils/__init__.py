@@ -1,7 +1,7 @@
-from .dist_utils import DistOptimizerHook, allreduce_grads
+from .dist_utils import DistOptimizerHook, allreduce_grads, gather_objects
 from .misc import multi_apply, tensor2imgs, unmap
 
 __all__ = [
-    'allreduce_grads', 'DistOptimizerHook', 'tensor2imgs', 'unmap',
-    'multi_apply'
+    'allreduce_grads', 'DistOptimizerHook', 'gather_objects', 'tensor2imgs',
+    'unmap', 'multi_apply'
 ]
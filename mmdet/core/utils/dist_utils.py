@@ -1,10 +1,14 @@
+import pickle
 from collections import OrderedDict
 
+import torch
 import torch.distributed as dist
-from mmcv.runner import OptimizerHook
+from mmcv.runner import OptimizerHook, get_dist_info
 from torch._utils import (_flatten_dense_tensors, _take_tensors,
                           _unflatten_dense_tensors)
 
+_GLOO_GROUP = None
+
 
 def _allreduce_coalesced(tensors, world_size, bucket_size_mb=-1):
     if bucket_size_mb > 0:
@@ -56,3 +60,53 @@ class DistOptimizerHook(OptimizerHook):
         if self.grad_clip is not None:
             self.clip_grads(runner.model.parameters())
         runner.optimizer.step()
+
+
+def _get_gloo_group():
+    """A gloo group of all the ranks, for point-to-point ops on CPU tensors
+    (not supported by nccl before PyTorch 1.7). It is created once, by the
+    first collective call that needs it."""
+    global _GLOO_GROUP
+    if dist.get_backend() == 'gloo':
+        return dist.group.WORLD
+    if _GLOO_GROUP is None:
+        _GLOO_GROUP = dist.new_group(backend='gloo')
+    return _GLOO_GROUP
+
+
+def gather_objects(obj, dst=0):
+    """Gather a picklable object of every rank on rank ``dst``.
+
+    Every other rank pickles its object into a uint8 tensor and sends it to
+    ``dst`` only, which receives them one rank at a time, so that only one
+    serialized object is in flight, without a shared tmp dir. The tensors
+    stay on the CPU and go through a gloo group.
+
+    Args:
+        obj (object): Object of this rank.
+        dst (int): Rank that gathers the objects.
+
+    Returns:
+        list | None: The objects ordered by rank on ``dst``, None elsewhere.
+    """
+    rank, world_size = get_dist_info()
+    group = _get_gloo_group()
+    if rank != dst:
+        data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+        buf = torch.tensor(bytearray(data), dtype=torch.uint8)
+        dist.send(torch.tensor([buf.numel()]), dst, group=group)
+        dist.send(buf, dst, group=group)
+        return None
+
+    objs = []
+    size = torch.zeros(1, dtype=torch.long)
+    for src in range(world_size):
+        if src == rank:
+            objs.append(obj)
+            continue
+        dist.recv(size, src, group=group)
+        buf = torch.empty((int(size.item()), ), dtype=torch.uint8)
+        dist.recv(buf, src, group=group)
+        objs.append(pickle.loads(buf.numpy().tobytes()))
+        del buf
+    return objs
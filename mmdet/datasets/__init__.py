@@ -11,7 +11,9 @@ from .coco import CocoDataset
 from .custom import CustomDataset
 from .dataset_wrappers import ConcatDataset, RepeatDataset
 from .extra_aug import ExtraAugmentation
-from .loader import DistributedGroupSampler, GroupSampler, build_dataloader
+from .loader import (DistributedGroupSampler, DistributedVideoGroupSampler,
+                     DistributedVideoSampler, GroupSampler,
+                     VideoGroupSampler, build_dataloader, get_videos)
 from .registry import DATASETS
 from .utils import random_scale, show_ann, to_tensor
 from .voc import VOCDataset
@@ -29,7 +31,9 @@ from .segtrackv2 import SegTrack_v2_Dataset
 __all__ = [
     'CustomDataset', 'XMLDataset', 'CocoDataset', 'VOCDataset',
     'CityscapesDataset', 'GroupSampler', 'DistributedGroupSampler',
-    'build_dataloader', 'to_tensor', 'random_scale', 'show_ann',
+    'DistributedVideoSampler', 'VideoGroupSampler',
+    'DistributedVideoGroupSampler',
+    'build_dataloader', 'get_videos', 'to_tensor', 'random_scale', 'show_ann',
     'ConcatDataset', 'RepeatDataset', 'ExtraAugmentation', 'WIDERFaceDataset',
     'DATASETS', 'build_dataset', 'Coco_Seg_Dataset', 
     'DAVIS_Seg_Dataset', 'TSD_MAX_Seg_Dataset', 'SegTrack_Dataset', 'SegTrack_v2_Dataset'
@@ -15,6 +15,8 @@ from mmcv.parallel import DataContainer as DC
 import torch
 
 from .registry import DATASETS
+from .polar_utils import get_polar_distances
+from .refer_cache import ReferCache
 from .utils import random_scale, to_tensor
 
 INF = 1e8
@@ -405,12 +407,11 @@ class Coco_Seg_Dataset(CustomDataset):
         mask_targets = torch.zeros(num_points, 36).float()
 
         pos_mask_ids = min_area_inds[pos_inds]
-        for p,id in zip(pos_inds, pos_mask_ids):
-            x, y = points[p]
-            pos_mask_contour = mask_contours[id]
-
-            dists, coords = self.get_36_coordinates(x, y, pos_mask_contour)
-            mask_targets[p] = dists
+        for id in pos_mask_ids.unique():
+            # all positive points of a gt share one contour
+            inds = pos_inds[pos_mask_ids == id]
+            mask_targets[inds] = get_polar_distances(
+                points[inds], mask_contours[id], 36, max_offset=3)
 
         return labels, bbox_targets, mask_targets
 
@@ -519,55 +520,6 @@ class Coco_Seg_Dataset(CustomDataset):
         #     contour[0] = contour[0][::compress_rate, ...]
         return center, contour
 
-    def get_36_coordinates(self, c_x, c_y, pos_mask_contour):
-        ct = pos_mask_contour[:, 0, :]
-        x = ct[:, 0] - c_x
-        y = ct[:, 1] - c_y
-        # angle = np.arctan2(x, y)*180/np.pi
-        angle = torch.atan2(x, y) * 180 / np.pi
-        angle[angle < 0] += 360
-        angle = angle.int()
-        # dist = np.sqrt(x ** 2 + y ** 2)
-        dist = torch.sqrt(x ** 2 + y ** 2)
-        angle, idx = torch.sort(angle)
-        dist = dist[idx]
-
-        # generate 36 angles
-        new_coordinate = {}
-        for i in range(0, 360, 10):
-            if i in angle:
-                d = dist[angle==i].max()
-                new_coordinate[i] = d
-            elif i + 1 in angle:
-                d = dist[angle == i+1].max()
-                new_coordinate[i] = d
-            elif i - 1 in angle:
-                d = dist[angle == i-1].max()
-                new_coordinate[i] = d
-            elif i + 2 in angle:
-                d = dist[angle == i+2].max()
-                new_coordinate[i] = d
-            elif i - 2 in angle:
-                d = dist[angle == i-2].max()
-                new_coordinate[i] = d
-            elif i + 3 in angle:
-                d = dist[angle == i+3].max()
-                new_coordinate[i] = d
-            elif i - 3 in angle:
-                d = dist[angle == i-3].max()
-                new_coordinate[i] = d
-
-        distances = torch.zeros(36)
-
-        for a in range(0, 360, 10):
-            if not a in new_coordinate.keys():
-                new_coordinate[a] = torch.tensor(1e-6)
-                distances[a//10] = 1e-6
-            else:
-                distances[a//10] = new_coordinate[a]
-
-        return distances, new_coordinate
-
     def __getitem__(self, idx):
         if self.test_mode:
             return self.prepare_test_img(idx)
@@ -578,3 +530,58 @@ class Coco_Seg_Dataset(CustomDataset):
                 idx = self._rand_another(idx)
                 continue
             return data
+
+
+class ReferMixin(object):
+    """Reference templates of the VOS datasets (DAVIS, SegTrack, SegTrack
+    v2 and TSD-max).
+
+    Every frame of a video is matched against the template cropped from the
+    first frame of the video, ``img_infos[idx]['first_frame']``, and resized
+    to ``refer_scale``. The dataset sets ``refer_scale`` and then calls
+    :meth:`init_refer_cache`, and may override :meth:`refer_img_path` if
+    its first frames are not under ``img_prefix``.
+    """
+
+    def init_refer_cache(self, refer_cache):
+        """Set up the cache of the cropped templates, see ReferCache, or
+        no cache if ``refer_cache`` is None."""
+        if refer_cache is None:
+            self.refer_cache = None
+            return
+        refer_cache = refer_cache.copy()
+        if refer_cache.get('shared', False):
+            refer_cache['keys'] = [
+                info['first_frame'] for info in self.img_infos]
+            refer_cache['shape'] = (3, self.refer_scale[1],
+                                    self.refer_scale[0])
+        self.refer_cache = ReferCache(**refer_cache)
+
+    def refer_img_path(self, refer_info):
+        return osp.join(self.img_prefix, refer_info['filename'])
+
+    def get_img_refer(self, first_frame_idx):
+        """Get the template of a video, cropped from its first frame."""
+        if self.refer_cache is None:
+            return self.load_img_refer(first_frame_idx)
+        return self.refer_cache.get(first_frame_idx, self.load_img_refer)
+
+    def get_refer_label(self, first_frame_idx):
+        """Get the 0-based label of the object tracked in a video, -1 if
+        its first frame has no annotation.
+        """
+        img_id = self.img_infos[first_frame_idx]['id']
+        ann_info = self.coco.loadAnns(self.coco.getAnnIds(imgIds=[img_id]))
+        if len(ann_info) == 0:
+            return -1
+        return self.cat2label[ann_info[0]['category_id']] - 1
+
+    def load_img_refer(self, first_frame_idx):
+        refer_info = self.img_infos[first_frame_idx]
+        refer_ann = self.get_ann_info(first_frame_idx)
+        img_refer = mmcv.imread(self.refer_img_path(refer_info))
+        # crop the bbox
+        img_refer = torch.squeeze(torch.Tensor(mmcv.imcrop(img_refer, refer_ann["bboxes"])))
+        # resize to refer_scale
+        img_refer = torch.Tensor(mmcv.imresize(np.float32(img_refer), self.refer_scale, return_scale=False)).permute(2, 0, 1)
+        return img_refer
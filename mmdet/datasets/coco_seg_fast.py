@@ -410,36 +410,27 @@ class Coco_SegFast_Dataset(CustomDataset):
 
         pos_inds = labels.nonzero().reshape(-1)
 
-        m = []
-        for p in range(num_points):
+        # negative points keep zero targets, only the positive ones are
+        # visited
+        mask_targets = torch.zeros(num_points, 36).float()
+        for p in pos_inds.tolist():
+            pos_mask_id = min_area_inds[p]
+            pos_mask = gt_masks[pos_mask_id]
+            pos_mask_contour = mask_contours[pos_mask_id]
+            x,y = points[p]
+            #计算36射线距离
+            dists, coords = self.get_36_coordinates(x,y,pos_mask_contour)
+            mask_targets[p] = dists
+
+            # debug visual code
             if self.debug:
-                vis = torch.zeros(gt_masks[0].shape).int().data.numpy()
-            #不是pos就随便加
-            if p not in pos_inds:
-                tmp = torch.zeros(36)
-                m.append(tmp)
-            #是pos的话  算重心
-            else:
-                pos_mask_id = min_area_inds[p]
-                pos_mask = gt_masks[pos_mask_id]
-                pos_mask_contour = mask_contours[pos_mask_id]
-                x,y = points[p]
-                #计算36射线距离
-                dists, coords = self.get_36_coordinates(x,y,pos_mask_contour)
-                m.append(dists)
-
-                # debug visual code
-                if self.debug:
-                    print('debug visual'*10)
-                    for j in coords.keys():
-                        vis = pos_mask
-                        vis = cv2.circle(vis, (x, y), 3, 2, -1)
-                        x1, y1 = coords[j]
-                        vis = cv2.line(vis, (x, y), (x1, y1), 2, 1)
-                    cv2.imwrite('./trash/{}.jpg'.format(pos_mask_id),vis*127)
-
-
-        mask_targets = torch.stack(m, 0).float()
+                print('debug visual'*10)
+                for j in coords.keys():
+                    vis = pos_mask
+                    vis = cv2.circle(vis, (x, y), 3, 2, -1)
+                    x1, y1 = coords[j]
+                    vis = cv2.line(vis, (x, y), (x1, y1), 2, 1)
+                cv2.imwrite('./trash/{}.jpg'.format(pos_mask_id),vis*127)
 
 
         return labels, bbox_targets, mask_targets
@@ -17,10 +17,12 @@ import torch
 
 from .utils import random_scale, to_tensor
 from .registry import DATASETS
-from .coco_seg import Coco_Seg_Dataset, INF
+from .coco_seg import Coco_Seg_Dataset, ReferMixin, INF
+from .polar_utils import (PolarTargetMixin, get_polar_distances,
+                          interpolate_contour)
 
 @DATASETS.register_module
-class DAVIS_Seg_Dataset(Coco_Seg_Dataset):
+class DAVIS_Seg_Dataset(ReferMixin, PolarTargetMixin, Coco_Seg_Dataset):
 
     # davis 2016
     # CLASSES = ('aerobatics', 'bear', 'bike-packing', 'blackswan', 'bmx-bumps', 
@@ -99,7 +101,11 @@ class DAVIS_Seg_Dataset(Coco_Seg_Dataset):
                  test_mode=False,
                  strides=[8, 16, 32, 64, 128],
                  regress_ranges=[(-1, 64), (64, 128), 
-                            (128, 256), (256, 512), (512, 1e8)]):
+                            (128, 256), (256, 512), (512, 1e8)],
+                 target_store=None,
+                 with_contours=False,
+                 sparse_targets=False,
+                 refer_cache=dict(max_size=64)):
         super(DAVIS_Seg_Dataset, self).__init__(ann_file,
                                                 img_prefix,
                                                 img_scale,
@@ -127,7 +133,10 @@ class DAVIS_Seg_Dataset(Coco_Seg_Dataset):
         self.regress_ranges = regress_ranges
         assert num_polar in [36, 72, 180]
         self.num_polar = num_polar
-    
+        self.init_polar_targets(target_store, with_contours, sparse_targets)
+        # cropped templates of the first frames
+        self.init_refer_cache(refer_cache)
+
     def prepare_train_img(self, idx):
         img_info = self.img_infos[idx]
         img = mmcv.imread(osp.join(self.img_prefix, img_info['filename']))
@@ -178,13 +187,7 @@ class DAVIS_Seg_Dataset(Coco_Seg_Dataset):
 
         # get img_refer from first frame
         first_frame_idx = img_info["first_frame"]
-        refer_info = self.img_infos[first_frame_idx]
-        refer_ann = self.get_ann_info(first_frame_idx)
-        img_refer = mmcv.imread(osp.join(self.img_prefix, refer_info['filename']))
-        # crop the bbox
-        img_refer = torch.squeeze(torch.Tensor(mmcv.imcrop(img_refer, refer_ann["bboxes"])))
-        # resize to refer_scale
-        img_refer = torch.Tensor(mmcv.imresize(np.float32(img_refer), self.refer_scale, return_scale=False)).permute(2, 0, 1)
+        img_refer = self.get_img_refer(first_frame_idx)
 
         if self.with_seg:
             gt_seg = mmcv.imread(
@@ -215,7 +218,10 @@ class DAVIS_Seg_Dataset(Coco_Seg_Dataset):
             img_shape=img_shape,
             pad_shape=pad_shape,
             scale_factor=scale_factor,
-            flip=flip)
+            flip=flip,
+            # frames of a video share the template, see
+            # SiamPolar.extract_template_feat
+            refer_key=self.img_infos[first_frame_idx]['filename'])
 
         data = dict(
             img=DC(to_tensor(img), stack=True),
@@ -231,6 +237,13 @@ class DAVIS_Seg_Dataset(Coco_Seg_Dataset):
             data['gt_masks'] = DC(gt_masks, cpu_only=True)
 
         #--------------------offline ray label generation-----------------------------
+        return self.add_polar_targets(data, idx, flip, gt_bboxes, gt_masks,
+                                      gt_labels, pad_shape)
+
+    def get_polar_targets(self, gt_bboxes, gt_masks, gt_labels, pad_shape):
+        """Compute the label, bbox and ray targets of every feature map point
+        of a transformed image.
+        """
         self.center_sample = True
         self.use_mask_center = True
         self.radius = 1.5
@@ -257,15 +270,8 @@ class DAVIS_Seg_Dataset(Coco_Seg_Dataset):
         gt_bboxes = torch.Tensor(gt_bboxes)
         gt_labels = torch.Tensor(gt_labels)
 
-        _labels, _bbox_targets, _mask_targets = self.polar_target_single(
+        return self.polar_target_single(
             gt_bboxes,gt_masks,gt_labels,concat_points, concat_regress_ranges, self.num_polar)
-        
-        data['_gt_labels'] = DC(_labels)
-        data['_gt_bboxes'] = DC(_bbox_targets)
-        data['_gt_masks'] = DC(_mask_targets)
-        #--------------------offline ray label generation-----------------------------
-
-        return data
 
     def get_featmap_size(self, shape):
         h,w = shape[:2]
@@ -297,12 +303,8 @@ class DAVIS_Seg_Dataset(Coco_Seg_Dataset):
         # get img_refer from first frame
         first_frame_idx = img_info["first_frame"]
         refer_info = self.img_infos[first_frame_idx]
-        refer_ann = self.get_ann_info(first_frame_idx)
-        img_refer = mmcv.imread(osp.join(self.img_prefix, refer_info['filename']))
-        # crop the bbox
-        img_refer = torch.squeeze(torch.Tensor(mmcv.imcrop(img_refer, refer_ann["bboxes"])))
-        # resize to refer_scale
-        img_refer = torch.Tensor(mmcv.imresize(np.float32(img_refer), self.refer_scale, return_scale=False)).permute(2, 0, 1)
+        img_refer = self.get_img_refer(first_frame_idx)
+        refer_label = self.get_refer_label(first_frame_idx)
 
         def prepare_single(img, scale, flip, proposal=None):
             _img, img_shape, pad_shape, scale_factor = self.img_transform(
@@ -313,7 +315,9 @@ class DAVIS_Seg_Dataset(Coco_Seg_Dataset):
                 img_shape=img_shape,
                 pad_shape=pad_shape,
                 scale_factor=scale_factor,
-                flip=flip)
+                flip=flip,
+                refer_key=refer_info['filename'],
+                refer_label=refer_label)
             if proposal is not None:
                 if proposal.shape[1] == 5:
                     score = proposal[:, 4, None]
@@ -436,92 +440,17 @@ class DAVIS_Seg_Dataset(Coco_Seg_Dataset):
         pos_inds = labels.nonzero().reshape(-1)
 
         mask_targets = torch.zeros(num_points, num_polar).float()
-        
+
         pos_mask_ids = min_area_inds[pos_inds]
-        for p,id in zip(pos_inds, pos_mask_ids):
-            x, y = points[p]
-            pos_mask_contour = mask_contours[id]
+        for id in pos_mask_ids.unique():
+            # all positive points of a gt share one contour
+            inds = pos_inds[pos_mask_ids == id]
             # SiamPolar: interpolate
-            new_contour = []
-            contour_length = len(pos_mask_contour)
-            for i in range(contour_length):
-                new_contour.append(pos_mask_contour[i])
-                # new_contour.append((3*pos_mask_contour[i]+pos_mask_contour[(i+1)%contour_length])/4)
-                new_contour.append((pos_mask_contour[i]+pos_mask_contour[(i+1)%contour_length])/2)
-                # new_contour.append((pos_mask_contour[i]+3*pos_mask_contour[(i+1)%contour_length])/4)
-            new_pos_mask_contour = torch.cat(new_contour, dim=0).unsqueeze(1)
-            # print(pos_mask_contour.size())
-            # print(new_pos_mask_contour.size())
-            # print(new_pos_mask_contour)
-            # exit()
-
-            dists, coords = self.get_coordinates(x, y, new_pos_mask_contour, num_polar)
-            mask_targets[p] = dists
-        
-        return labels, bbox_targets, mask_targets
+            new_pos_mask_contour = interpolate_contour(mask_contours[id])
+            mask_targets[inds] = get_polar_distances(
+                points[inds], new_pos_mask_contour, num_polar, max_offset=5)
 
-    def get_coordinates(self, c_x, c_y, pos_mask_contour, num_polar):
-        ct = pos_mask_contour[:, 0, :]
-        x = ct[:, 0] - c_x
-        y = ct[:, 1] - c_y
-        # angle = np.arctan2(x, y)*180/np.pi
-        angle = torch.atan2(x, y) * 180 / np.pi
-        angle[angle < 0] += 360
-        angle = angle.int()
-        # dist = np.sqrt(x ** 2 + y ** 2)
-        dist = torch.sqrt(x ** 2 + y ** 2)
-        angle, idx = torch.sort(angle)
-        dist = dist[idx]
-
-        # generate num_polar angles
-        new_coordinate = {}
-        step_size = int(360/num_polar)
-        for i in range(0, 360, step_size):
-            if i in angle:
-                d = dist[angle==i].max()
-                new_coordinate[i] = d
-            elif i + 1 in angle:
-                d = dist[angle == i+1].max()
-                new_coordinate[i] = d
-            elif i - 1 in angle:
-                d = dist[angle == i-1].max()
-                new_coordinate[i] = d
-            elif i + 2 in angle:
-                d = dist[angle == i+2].max()
-                new_coordinate[i] = d
-            elif i - 2 in angle:
-                d = dist[angle == i-2].max()
-                new_coordinate[i] = d
-            elif i + 3 in angle:
-                d = dist[angle == i+3].max()
-                new_coordinate[i] = d
-            elif i - 3 in angle:
-                d = dist[angle == i-3].max()
-                new_coordinate[i] = d
-            # josie.add
-            elif i + 4 in angle:
-                d = dist[angle == i+4].max()
-                new_coordinate[i] = d
-            elif i - 4 in angle:
-                d = dist[angle == i-4].max()
-                new_coordinate[i] = d
-            elif i + 5 in angle:
-                d = dist[angle == i+5].max()
-                new_coordinate[i] = d
-            elif i - 5 in angle:
-                d = dist[angle == i-5].max()
-                new_coordinate[i] = d
-
-        distances = torch.zeros(num_polar)
-
-        for a in range(0, 360, step_size):
-            if not a in new_coordinate.keys():
-                new_coordinate[a] = torch.tensor(1e-6)
-                distances[a//step_size] = 1e-6
-            else:
-                distances[a//step_size] = new_coordinate[a]
-
-        return distances, new_coordinate
+        return labels, bbox_targets, mask_targets
 
     def __getitem__(self, idx):
         if self.test_mode:
@@ -1,4 +1,10 @@
 from .build_loader import build_dataloader
-from .sampler import DistributedGroupSampler, GroupSampler
+from .sampler import (DistributedGroupSampler, DistributedVideoGroupSampler,
+                      DistributedVideoSampler, GroupSampler,
+                      VideoGroupSampler, get_videos)
 
-__all__ = ['GroupSampler', 'DistributedGroupSampler', 'build_dataloader']
+__all__ = [
+    'GroupSampler', 'DistributedGroupSampler', 'DistributedVideoSampler',
+    'VideoGroupSampler', 'DistributedVideoGroupSampler', 'build_dataloader',
+    'get_videos'
+]
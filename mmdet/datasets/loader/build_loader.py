@@ -5,7 +5,9 @@ from mmcv.parallel import collate
 from mmcv.runner import get_dist_info
 from torch.utils.data import DataLoader
 
-from .sampler import DistributedGroupSampler, DistributedSampler, GroupSampler
+from .sampler import (DistributedGroupSampler, DistributedSampler,
+                      DistributedVideoGroupSampler, DistributedVideoSampler,
+                      GroupSampler, VideoGroupSampler)
 
 if platform.system() != 'Windows':
     # https://github.com/pytorch/pytorch/issues/973
@@ -19,20 +21,35 @@ def build_dataloader(dataset,
                      workers_per_gpu,
                      num_gpus=1,
                      dist=True,
+                     video_shards=False,
+                     frames_per_video=None,
                      **kwargs):
     shuffle = kwargs.get('shuffle', True)
     if dist:
         rank, world_size = get_dist_info()
-        if shuffle:
+        if shuffle and frames_per_video:
+            # batches of frames_per_video frames of the same videos
+            sampler = DistributedVideoGroupSampler(dataset, imgs_per_gpu,
+                                                   frames_per_video,
+                                                   world_size, rank)
+        elif shuffle:
             sampler = DistributedGroupSampler(dataset, imgs_per_gpu,
                                               world_size, rank)
+        elif video_shards:
+            # every rank tests whole videos
+            sampler = DistributedVideoSampler(dataset, world_size, rank)
         else:
             sampler = DistributedSampler(
                 dataset, world_size, rank, shuffle=False)
         batch_size = imgs_per_gpu
         num_workers = workers_per_gpu
     else:
-        sampler = GroupSampler(dataset, imgs_per_gpu) if shuffle else None
+        if shuffle and frames_per_video:
+            sampler = VideoGroupSampler(dataset, imgs_per_gpu,
+                                        frames_per_video)
+        else:
+            sampler = GroupSampler(dataset,
+                                   imgs_per_gpu) if shuffle else None
         batch_size = num_gpus * imgs_per_gpu
         num_workers = num_gpus * workers_per_gpu
 
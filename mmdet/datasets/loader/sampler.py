@@ -34,6 +34,55 @@ class DistributedSampler(_DistributedSampler):
         return iter(indices)
 
 
+def get_videos(dataset):
+    """Get the (start, end) index ranges of the videos of a dataset.
+
+    A video is a run of consecutive frames with the same ``first_frame`` in
+    the img_infos of the dataset, every frame is a video of its own if there
+    is no such key.
+    """
+    img_infos = getattr(dataset, 'img_infos', None)
+    if img_infos is None or (len(img_infos) > 0
+                             and 'first_frame' not in img_infos[0]):
+        return [(i, i + 1) for i in range(len(dataset))]
+    videos = []
+    for i, img_info in enumerate(img_infos):
+        first_frame = img_info['first_frame']
+        if i > 0 and first_frame == img_infos[i - 1]['first_frame']:
+            videos[-1][1] = i + 1
+        else:
+            videos.append([i, i + 1])
+    return [tuple(video) for video in videos]
+
+
+def video_chunks(videos, frames_per_video, randperm):
+    """Split shuffled videos into chunks of ``frames_per_video`` frames.
+
+    The last chunk of a video is filled up with other frames of the same
+    video, so every chunk has frames of a single video.
+
+    Args:
+        videos (list[tuple]): (start, end) index ranges of the videos.
+        frames_per_video (int): Number of frames of a chunk.
+        randperm (callable): ``randperm(n)`` returns a permutation of n.
+
+    Returns:
+        list[list[int]]: The chunks, in the order of the videos.
+    """
+    chunks = []
+    for start, end in videos:
+        size = end - start
+        frames = [start + int(i) for i in randperm(size)]
+        num_chunks = int(math.ceil(size / frames_per_video))
+        extra = num_chunks * frames_per_video - size
+        frames += [frames[i % size] for i in range(extra)]
+        chunks += [
+            frames[i * frames_per_video:(i + 1) * frames_per_video]
+            for i in range(num_chunks)
+        ]
+    return chunks
+
+
 class GroupSampler(Sampler):
 
     def __init__(self, dataset, samples_per_gpu=1):
@@ -157,3 +206,209 @@ class DistributedGroupSampler(Sampler):
 
     def set_epoch(self, epoch):
         self.epoch = epoch
+
+
+class DistributedVideoSampler(Sampler):
+    """Sampler that gives every rank whole videos, for distributed testing.
+
+    The videos (see :func:`get_videos`) are assigned longest first to the rank with
+    the fewest frames so far, so that all ranks get about as many frames,
+    and the frames of a video keep their order, so that per-video state such
+    as the template features is computed once by a single rank.
+
+    All ranks are padded to the same number of samples by repeating their
+    last frame, the duplicated results must be dropped when collecting them.
+
+    Arguments:
+        dataset: Dataset used for sampling.
+        num_replicas (optional): Number of processes participating in
+            distributed testing.
+        rank (optional): Rank of the current process within num_replicas.
+    """
+
+    def __init__(self, dataset, num_replicas=None, rank=None):
+        _rank, _num_replicas = get_dist_info()
+        if num_replicas is None:
+            num_replicas = _num_replicas
+        if rank is None:
+            rank = _rank
+        self.dataset = dataset
+        self.num_replicas = num_replicas
+        self.rank = rank
+
+        videos = get_videos(dataset)
+        loads = [0] * num_replicas
+        rank_videos = [[] for _ in range(num_replicas)]
+        for start, end in sorted(videos, key=lambda v: v[0] - v[1]):
+            i = loads.index(min(loads))
+            rank_videos[i].append((start, end))
+            loads[i] += end - start
+        self.rank_indices = [[
+            idx for start, end in sorted(rank_videos[i])
+            for idx in range(start, end)
+        ] for i in range(num_replicas)]
+        self.num_samples = max(loads)
+        self.total_size = self.num_samples * self.num_replicas
+
+    def __iter__(self):
+        indices = list(self.rank_indices[self.rank])
+        # add extra samples to make it evenly divisible
+        pad = indices[-1] if len(indices) > 0 else 0
+        indices += [pad] * (self.num_samples - len(indices))
+        assert len(indices) == self.num_samples
+        return iter(indices)
+
+    def __len__(self):
+        return self.num_samples
+
+
+class VideoGroupSampler(Sampler):
+    """GroupSampler whose batches are made of frames of the same videos.
+
+    Every batch is made of ``samples_per_gpu // frames_per_video`` chunks of
+    ``frames_per_video`` frames of one video, so that the detector only runs
+    the template backbone once per chunk. Videos are shuffled and split into
+    chunks, and the chunks of videos of the same aspect ratio flag are
+    shuffled into batches.
+
+    Arguments:
+        dataset: Dataset used for sampling.
+        samples_per_gpu (int): Batch size, a multiple of frames_per_video.
+        frames_per_video (int): Number of frames of a video in a chunk.
+    """
+
+    def __init__(self, dataset, samples_per_gpu=1, frames_per_video=1):
+        assert hasattr(dataset, 'flag')
+        assert samples_per_gpu % frames_per_video == 0, \
+            'samples_per_gpu must be a multiple of frames_per_video'
+        self.dataset = dataset
+        self.samples_per_gpu = samples_per_gpu
+        self.frames_per_video = frames_per_video
+        self.chunks_per_gpu = samples_per_gpu // frames_per_video
+        self.flag = dataset.flag.astype(np.int64)
+        self.group_videos = [[] for _ in range(self.flag.max() + 1)]
+        for start, end in get_videos(dataset):
+            self.group_videos[self.flag[start]].append((start, end))
+        self.num_samples = 0
+        for videos in self.group_videos:
+            num_chunks = sum(
+                int(math.ceil((end - start) / frames_per_video))
+                for start, end in videos)
+            self.num_samples += int(np.ceil(
+                num_chunks / self.chunks_per_gpu)) * self.samples_per_gpu
+
+    def __iter__(self):
+        batches = []
+        for videos in self.group_videos:
+            if len(videos) == 0:
+                continue
+            videos = [videos[i] for i in np.random.permutation(len(videos))]
+            chunks = video_chunks(videos, self.frames_per_video,
+                                  np.random.permutation)
+            chunks = [chunks[i] for i in np.random.permutation(len(chunks))]
+            num_extra = int(np.ceil(len(chunks) / self.chunks_per_gpu)
+                            ) * self.chunks_per_gpu - len(chunks)
+            chunks += [chunks[i % len(chunks)] for i in range(num_extra)]
+            batches += [
+                sum(chunks[i:i + self.chunks_per_gpu], [])
+                for i in range(0, len(chunks), self.chunks_per_gpu)
+            ]
+        indices = [
+            idx for i in np.random.permutation(len(batches))
+            for idx in batches[i]
+        ]
+        assert len(indices) == self.num_samples
+        return iter(indices)
+
+    def __len__(self):
+        return self.num_samples
+
+
+class DistributedVideoGroupSampler(Sampler):
+    """DistributedGroupSampler whose batches are made of frames of the same
+    videos, see :class:`VideoGroupSampler`.
+
+    Arguments:
+        dataset: Dataset used for sampling.
+        samples_per_gpu (int): Batch size, a multiple of frames_per_video.
+        frames_per_video (int): Number of frames of a video in a chunk.
+        num_replicas (optional): Number of processes participating in
+            distributed training.
+        rank (optional): Rank of the current process within num_replicas.
+    """
+
+    def __init__(self,
+                 dataset,
+                 samples_per_gpu=1,
+                 frames_per_video=1,
+                 num_replicas=None,
+                 rank=None):
+        _rank, _num_replicas = get_dist_info()
+        if num_replicas is None:
+            num_replicas = _num_replicas
+        if rank is None:
+            rank = _rank
+        assert hasattr(dataset, 'flag')
+        assert samples_per_gpu % frames_per_video == 0, \
+            'samples_per_gpu must be a multiple of frames_per_video'
+        self.dataset = dataset
+        self.samples_per_gpu = samples_per_gpu
+        self.frames_per_video = frames_per_video
+        self.chunks_per_gpu = samples_per_gpu // frames_per_video
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+
+        self.flag = dataset.flag.astype(np.int64)
+        self.group_videos = [[] for _ in range(self.flag.max() + 1)]
+        for start, end in get_videos(dataset):
+            self.group_videos[self.flag[start]].append((start, end))
+        self.num_samples = 0
+        for videos in self.group_videos:
+            num_chunks = sum(
+                int(math.ceil((end - start) / frames_per_video))
+                for start, end in videos)
+            self.num_samples += int(
+                math.ceil(num_chunks / self.chunks_per_gpu /
+                          self.num_replicas)) * self.samples_per_gpu
+        self.total_size = self.num_samples * self.num_replicas
+
+    def __iter__(self):
+        # deterministically shuffle based on epoch
+        g = torch.Generator()
+        g.manual_seed(self.epoch)
+
+        def randperm(n):
+            return torch.randperm(int(n), generator=g).tolist()
+
+        batches = []
+        for videos in self.group_videos:
+            if len(videos) == 0:
+                continue
+            videos = [videos[i] for i in randperm(len(videos))]
+            chunks = video_chunks(videos, self.frames_per_video, randperm)
+            chunks = [chunks[i] for i in randperm(len(chunks))]
+            extra = int(
+                math.ceil(len(chunks) / self.chunks_per_gpu /
+                          self.num_replicas)
+            ) * self.chunks_per_gpu * self.num_replicas - len(chunks)
+            chunks += [chunks[i % len(chunks)] for i in range(extra)]
+            batches += [
+                sum(chunks[i:i + self.chunks_per_gpu], [])
+                for i in range(0, len(chunks), self.chunks_per_gpu)
+            ]
+        indices = [idx for i in randperm(len(batches)) for idx in batches[i]]
+        assert len(indices) == self.total_size
+
+        # subsample
+        offset = self.num_samples * self.rank
+        indices = indices[offset:offset + self.num_samples]
+        assert len(indices) == self.num_samples
+
+        return iter(indices)
+
+    def __len__(self):
+        return self.num_samples
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
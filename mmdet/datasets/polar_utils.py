@@ -0,0 +1,234 @@
+import os.path as osp
+
+import mmcv
+import numpy as np
+import torch
+from mmcv.parallel import DataContainer as DC
+
+from mmdet.core.mask.polar_target import polar_distances
+
+
+def interpolate_contour(contour):
+    """Insert the midpoint of every edge of a closed contour.
+
+    Args:
+        contour (Tensor): Contour points of shape [K, 1, 2].
+
+    Returns:
+        Tensor: Contour of shape [2K, 1, 2], ordered as
+            p0, (p0 + p1) / 2, p1, (p1 + p2) / 2, ..., (pK-1 + p0) / 2.
+    """
+    next_contour = torch.cat([contour[1:], contour[:1]])
+    midpoints = (contour + next_contour) / 2
+    return torch.stack([contour, midpoints], dim=1).reshape(-1, 1, 2)
+
+
+def get_polar_distances(points, contour, num_polar=36, max_offset=5):
+    """Compute the ray distances from many centers to one contour at once,
+    see :func:`mmdet.core.polar_distances`.
+
+    Args:
+        points (Tensor): Centers of shape [P, 2], (x, y).
+        contour (Tensor): Contour points of shape [K, 1, 2], (x, y).
+
+    Returns:
+        Tensor: Distances of shape [P, num_polar].
+    """
+    contours = contour[None, :, 0].expand(points.size(0), contour.size(0), 2)
+    return polar_distances(points.float(), contours.float(), num_polar,
+                           max_offset)
+
+
+def get_polar_contours(gt_masks, get_single_centerpoint):
+    """Get the mass center and the interpolated contour of every gt mask.
+
+    They are what the polar targets are computed from, so that the targets
+    can be assigned in the head (see ``with_contours`` of the datasets and
+    ``polar_target_from_contours``) instead of in the data workers.
+
+    Args:
+        gt_masks (list[ndarray]): Binary masks of the gts.
+        get_single_centerpoint (callable): Returns the (x, y) center and the
+            contours of a mask, the first contour is used.
+
+    Returns:
+        tuple[Tensor]: Centers of shape [k, 2] and contours of shape
+            [k, m, 2], both (x, y). The contours are padded to the same
+            length by repeating their last point.
+    """
+    centers, contours = [], []
+    for mask in gt_masks:
+        center, contour = get_single_centerpoint(mask)
+        centers.append(center)
+        contours.append(
+            interpolate_contour(torch.Tensor(contour[0]).float())[:, 0])
+    if len(contours) == 0:
+        return torch.zeros(0, 2), torch.zeros(0, 0, 2)
+    max_len = max(len(contour) for contour in contours)
+    contours = [
+        torch.cat([contour, contour[-1:].expand(max_len - len(contour), 2)])
+        for contour in contours
+    ]
+    return torch.Tensor(centers).float(), torch.stack(contours)
+
+
+def sparse_polar_targets(labels, bbox_targets, mask_targets):
+    """Keep the targets of the positive points only.
+
+    Negative points only need their zero label, so the dense targets are
+    shipped to the head as (pos_inds, labels, bbox_targets, mask_targets) of
+    the positive points, see ``sparse_targets`` of the datasets.
+    """
+    pos_inds = labels.nonzero().reshape(-1)
+    return (pos_inds, labels[pos_inds], bbox_targets[pos_inds],
+            mask_targets[pos_inds])
+
+
+class PolarTargetStore(object):
+    """Read-only store of precomputed polar targets.
+
+    The store is a directory written by tools/precompute_polar_targets.py.
+    Only the positive points of every (image, flip) pair are saved; the
+    arrays are memory-mapped and densified again when a sample is loaded.
+    Bbox targets of negative points are not used by the loss and are
+    restored as zeros.
+
+    Layout of the directory:
+        index.json: settings the targets were computed with.
+        offsets.npy: int64 [num_imgs, 2, 3], (start, end, num_points) of
+            every image without / with flip, start = -1 if not computed.
+        pos_inds.npy: int32 [M], indices of the positive points.
+        labels.npy, bbox_targets.npy, mask_targets.npy: float32 [M],
+            [M, 4] and [M, num_polar] targets of the positive points.
+    """
+
+    ARRAYS = ('pos_inds', 'labels', 'bbox_targets', 'mask_targets')
+
+    def __init__(self, root):
+        self.root = root
+        self.meta = mmcv.load(osp.join(root, 'index.json'))
+        self.offsets = np.load(osp.join(root, 'offsets.npy'))
+        self._arrays = None
+
+    @staticmethod
+    def get_meta(dataset):
+        """Settings of a dataset that the targets depend on."""
+        return dict(
+            filenames=[info['filename'] for info in dataset.img_infos],
+            img_scales=[list(scale) for scale in dataset.img_scales],
+            resize_keep_ratio=dataset.resize_keep_ratio,
+            size_divisor=dataset.size_divisor,
+            strides=list(dataset.strides),
+            regress_ranges=[list(rr) for rr in dataset.regress_ranges],
+            num_polar=dataset.num_polar)
+
+    def check(self, dataset):
+        meta = self.get_meta(dataset)
+        for key, value in meta.items():
+            if self.meta.get(key) != value:
+                raise ValueError(
+                    'polar target store {} does not match the dataset: '
+                    '"{}" differs, please regenerate it'.format(
+                        self.root, key))
+
+    def _load(self):
+        # opened lazily so that every dataloader worker maps its own files
+        self._arrays = {
+            name: np.load(osp.join(self.root, name + '.npy'), mmap_mode='r')
+            for name in self.ARRAYS
+        }
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_arrays'] = None
+        return state
+
+    def get(self, idx, flip, sparse=False):
+        """Get the dense (labels, bbox_targets, mask_targets) of an image, or
+        the sparse (pos_inds, labels, bbox_targets, mask_targets) of its
+        positive points."""
+        start, end, num_points = self.offsets[idx, int(flip)]
+        if start < 0:
+            raise KeyError(
+                'targets of image {} (flip={}) are not in {}'.format(
+                    idx, flip, self.root))
+        if self._arrays is None:
+            self._load()
+        pos_inds = torch.from_numpy(
+            self._arrays['pos_inds'][start:end].astype(np.int64))
+        pos_targets = [
+            torch.from_numpy(np.array(self._arrays[name][start:end]))
+            for name in self.ARRAYS[1:]
+        ]
+        if sparse:
+            return (pos_inds, ) + tuple(pos_targets)
+        labels = torch.zeros(num_points)
+        bbox_targets = torch.zeros(num_points, 4)
+        mask_targets = torch.zeros(num_points, self.meta['num_polar'])
+        labels[pos_inds] = pos_targets[0]
+        bbox_targets[pos_inds] = pos_targets[1]
+        mask_targets[pos_inds] = pos_targets[2]
+        return labels, bbox_targets, mask_targets
+
+
+class PolarTargetMixin(object):
+    """How the VOS datasets (DAVIS, SegTrack, SegTrack v2 and TSD-max) ship
+    the polar targets of a training sample.
+
+    Depending on the options of :meth:`init_polar_targets`, a sample carries
+    the gt contours (the targets are assigned in the head), or the targets
+    of every point as ``_gt_labels``, ``_gt_bboxes`` and ``_gt_masks``, read
+    from a PolarTargetStore or computed by ``get_polar_targets`` of the
+    dataset.
+    """
+
+    def init_polar_targets(self,
+                           target_store=None,
+                           with_contours=False,
+                           sparse_targets=False):
+        """
+        Args:
+            target_store (str, optional): Directory of the targets
+                precomputed by tools/precompute_polar_targets.py.
+            with_contours (bool): Ship the gt centers and contours instead of
+                the targets, see ``polar_target_from_contours``.
+            sparse_targets (bool): Ship the targets of the positive points
+                only, with their indices as ``_gt_pos_inds``.
+        """
+        if target_store is not None:
+            self.target_store = PolarTargetStore(target_store)
+            self.target_store.check(self)
+        else:
+            self.target_store = None
+        self.with_contours = with_contours
+        self.sparse_targets = sparse_targets
+
+    def add_polar_targets(self, data, idx, flip, gt_bboxes, gt_masks,
+                          gt_labels, pad_shape):
+        """Add the polar targets of a transformed training image to its
+        data dict."""
+        if self.with_contours:
+            gt_centers, gt_contours = get_polar_contours(
+                gt_masks[:len(gt_bboxes)], self.get_single_centerpoint)
+            data['gt_centers'] = DC(gt_centers)
+            data['gt_contours'] = DC(gt_contours)
+            return data
+
+        if self.target_store is not None:
+            targets = self.target_store.get(
+                idx, flip, sparse=self.sparse_targets)
+        else:
+            targets = self.get_polar_targets(
+                gt_bboxes, gt_masks, gt_labels, pad_shape)
+            if self.sparse_targets:
+                targets = sparse_polar_targets(*targets)
+
+        if self.sparse_targets:
+            # densified in the head, see SiamPolar_Head.polar_target
+            data['_gt_pos_inds'] = DC(targets[0])
+            targets = targets[1:]
+        _labels, _bbox_targets, _mask_targets = targets
+        data['_gt_labels'] = DC(_labels)
+        data['_gt_bboxes'] = DC(_bbox_targets)
+        data['_gt_masks'] = DC(_mask_targets)
+        return data
@@ -0,0 +1,68 @@
+from collections import OrderedDict
+
+import torch
+
+
+class ReferCache(object):
+    """Cache of the reference templates of the VOS datasets.
+
+    Every frame of a video uses the same template, cropped from the first
+    frame and resized to ``refer_scale``, so it only needs to be decoded once
+    per video. Templates are keyed by the index of the first frame.
+
+    Every DataLoader worker keeps its own LRU cache of at most ``max_size``
+    templates. With ``shared=True`` the templates are stored in a shared
+    memory slab instead, allocated once in the main process with one slot per
+    video, so a template decoded by one worker is reused by all the others.
+
+    Args:
+        max_size (int): Maximum number of templates of the per-worker cache.
+        shared (bool): Whether to store the templates in shared memory.
+        keys (list[int]): All first frame indices, required if shared.
+        shape (tuple[int]): Template shape (3, h, w), required if shared.
+    """
+
+    def __init__(self, max_size=64, shared=False, keys=None, shape=None):
+        assert max_size > 0
+        self.max_size = max_size
+        self.shared = shared
+        self._cache = OrderedDict()
+        if shared:
+            assert keys is not None and shape is not None
+            self._slots = {key: i for i, key in enumerate(sorted(set(keys)))}
+            num_slots = len(self._slots)
+            self._data = torch.zeros((num_slots, ) + tuple(shape))
+            self._data.share_memory_()
+            self._filled = torch.zeros(num_slots, dtype=torch.uint8)
+            self._filled.share_memory_()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def get(self, key, load_fn):
+        """Get the template of ``key``, calling ``load_fn(key)`` on a miss."""
+        if self.shared:
+            slot = self._slots[key]
+            if self._filled[slot]:
+                return self._data[slot]
+            img_refer = load_fn(key)
+            if img_refer.shape != self._data.shape[1:]:
+                return img_refer
+            # concurrent writers store the same template, so no lock needed
+            self._data[slot].copy_(img_refer)
+            self._filled[slot] = 1
+            return self._data[slot]
+
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        img_refer = load_fn(key)
+        self._cache[key] = img_refer
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+        return img_refer
+
+    def clear(self):
+        self._cache.clear()
+        if self.shared:
+            self._filled.zero_()
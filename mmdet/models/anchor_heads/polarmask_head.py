@@ -2,7 +2,8 @@ import torch
 import torch.nn as nn
 from mmcv.cnn import normal_init
 
-from mmdet.core import distance2bbox, force_fp32, multi_apply, multiclass_nms, multiclass_nms_with_mask
+from mmdet.core import (distance2bbox, force_fp32, multi_apply, multiclass_nms,
+                        multiclass_nms_with_mask, polar_target_from_contours)
 from mmdet.ops import ModulatedDeformConvPack
 
 from ..builder import build_loss
@@ -69,7 +70,12 @@ class PolarMask_Head(nn.Module):
         self.count = 0
 
         # test
-        self.angles = torch.range(0, 350, 10).cuda() / 180 * math.pi
+        angles = torch.arange(0, 360, 10).float() / 180 * math.pi
+        # follows the device and dtype of the head, not saved in checkpoints
+        try:
+            self.register_buffer('angles', angles, persistent=False)
+        except TypeError:
+            self.register_buffer('angles', angles)
 
         self._init_layers()
 
@@ -230,7 +236,8 @@ class PolarMask_Head(nn.Module):
         all_level_points = self.get_points(featmap_sizes, bbox_preds[0].dtype,
                                            bbox_preds[0].device)
 
-        labels, bbox_targets, mask_targets = self.polar_target(all_level_points, extra_data)
+        labels, bbox_targets, mask_targets = self.polar_target(
+            all_level_points, extra_data, gt_bboxes, gt_labels)
 
         num_imgs = cls_scores[0].size(0)
         # flatten cls_scores, bbox_preds and centerness
@@ -332,12 +339,22 @@ class PolarMask_Head(nn.Module):
             (x.reshape(-1), y.reshape(-1)), dim=-1) + stride // 2
         return points
 
-    def polar_target(self, points, extra_data):
+    def polar_target(self, points, extra_data, gt_bboxes=None, gt_labels=None):
         assert len(points) == len(self.regress_ranges)
 
         num_levels = len(points)
 
-        labels_list, bbox_targets_list, mask_targets_list = extra_data.values()
+        if 'gt_contours' in extra_data:
+            # assigned here from the gt contours of the batch, instead of
+            # dense targets from the data workers
+            labels_list, bbox_targets_list, mask_targets_list = \
+                polar_target_from_contours(
+                    points, self.regress_ranges, self.strides, gt_bboxes,
+                    gt_labels, extra_data['gt_centers'],
+                    extra_data['gt_contours'], 36)
+        else:
+            labels_list, bbox_targets_list, mask_targets_list = \
+                extra_data.values()
 
         # split to per img, per level
         num_points = [center.size(0) for center in points]
@@ -459,11 +476,11 @@ class PolarMask_Head(nn.Module):
         _mlvl_bboxes = mlvl_bboxes; _mlvl_masks = mlvl_masks
         if rescale:
             _mlvl_bboxes = mlvl_bboxes / mlvl_bboxes.new_tensor(scale_factor)
-            try:
-                scale_factor = torch.Tensor(scale_factor)[:2].cuda().unsqueeze(1).repeat(1, 36)
-                _mlvl_masks = mlvl_masks / scale_factor
-            except:
-                _mlvl_masks = mlvl_masks / mlvl_masks.new_tensor(scale_factor)
+            scale_factor = mlvl_masks.new_tensor(scale_factor)
+            if scale_factor.numel() > 1:
+                # (w, h, w, h) scales, masks are (n, 2, 36) of (x, y)
+                scale_factor = scale_factor[:2, None]
+            _mlvl_masks = mlvl_masks / scale_factor
 
         mlvl_scores = torch.cat(mlvl_scores)
         padding = mlvl_scores.new_zeros(mlvl_scores.shape[0], 1)
@@ -2,7 +2,9 @@ import torch
 import torch.nn as nn
 from mmcv.cnn import normal_init
 
-from mmdet.core import distance2bbox, force_fp32, multi_apply, multiclass_nms_with_mask
+from mmdet.core import (agnostic_nms_with_mask, distance2bbox, force_fp32,
+                        multi_apply, multiclass_nms_with_mask,
+                        polar_target_from_contours)
 from mmdet.ops import ModulatedDeformConvPack
 
 from ..builder import build_loss
@@ -68,12 +70,22 @@ class SiamPolar_Head(nn.Module):
         self.vis_num = 1000
         self.count = 0
 
-        # test
+        # test, the ray tables follow the device and dtype of the head
         step_size = int(360/self.num_polar)
-        self.angles = torch.range(0, 359, step_size).cuda() / 180 * math.pi
+        angles = torch.arange(0, 360, step_size).float() / 180 * math.pi
+        self._register_table('angles', angles)
+        self._register_table('angles_sin', torch.sin(angles))
+        self._register_table('angles_cos', torch.cos(angles))
 
         self._init_layers()
 
+    def _register_table(self, name, tensor):
+        # constant tables are not saved in (or expected from) checkpoints
+        try:
+            self.register_buffer(name, tensor, persistent=False)
+        except TypeError:
+            self.register_buffer(name, tensor)
+
     def _init_layers(self):
         self.cls_convs = nn.ModuleList()
         self.reg_convs = nn.ModuleList()
@@ -230,7 +242,8 @@ class SiamPolar_Head(nn.Module):
         all_level_points = self.get_points(featmap_sizes, bbox_preds[0].dtype,
                                            bbox_preds[0].device)
 
-        labels, bbox_targets, mask_targets = self.polar_target(all_level_points, extra_data)
+        labels, bbox_targets, mask_targets = self.polar_target(
+            all_level_points, extra_data, gt_bboxes, gt_labels)
 
         num_imgs = cls_scores[0].size(0)
         # flatten cls_scores, bbox_preds and centerness
@@ -334,15 +347,28 @@ class SiamPolar_Head(nn.Module):
         # print("points: ", len(points))
         return points
 
-    def polar_target(self, points, extra_data):
+    def polar_target(self, points, extra_data, gt_bboxes=None, gt_labels=None):
         assert len(points) == len(self.regress_ranges)
 
         num_levels = len(points)
 
-        labels_list, bbox_targets_list, mask_targets_list = extra_data.values()
-
         # split to per img, per level
         num_points = [center.size(0) for center in points]
+
+        if 'gt_contours' in extra_data:
+            # assigned here from the gt contours of the batch, instead of
+            # dense targets from the data workers
+            labels_list, bbox_targets_list, mask_targets_list = \
+                polar_target_from_contours(
+                    points, self.regress_ranges, self.strides, gt_bboxes,
+                    gt_labels, extra_data['gt_centers'],
+                    extra_data['gt_contours'], self.num_polar)
+        elif '_gt_pos_inds' in extra_data:
+            labels_list, bbox_targets_list, mask_targets_list = \
+                self.densify_targets(sum(num_points), extra_data)
+        else:
+            labels_list, bbox_targets_list, mask_targets_list = \
+                extra_data.values()
         
         labels_list = [labels.split(num_points, 0) for labels in labels_list]
         bbox_targets_list = [
@@ -370,6 +396,26 @@ class SiamPolar_Head(nn.Module):
 
         return concat_lvl_labels, concat_lvl_bbox_targets, concat_lvl_mask_targets
 
+    def densify_targets(self, num_points, extra_data):
+        """Scatter the targets of the positive points of every image, see
+        ``sparse_targets`` of the datasets, into the targets of all points.
+        """
+        labels_list, bbox_targets_list, mask_targets_list = [], [], []
+        for pos_inds, pos_labels, pos_bbox_targets, pos_mask_targets in zip(
+                extra_data['_gt_pos_inds'], extra_data['_gt_labels'],
+                extra_data['_gt_bboxes'], extra_data['_gt_masks']):
+            labels = pos_labels.new_zeros(num_points)
+            bbox_targets = pos_bbox_targets.new_zeros(num_points, 4)
+            mask_targets = pos_mask_targets.new_zeros(num_points,
+                                                      self.num_polar)
+            labels[pos_inds] = pos_labels
+            bbox_targets[pos_inds] = pos_bbox_targets
+            mask_targets[pos_inds] = pos_mask_targets
+            labels_list.append(labels)
+            bbox_targets_list.append(bbox_targets)
+            mask_targets_list.append(mask_targets)
+        return labels_list, bbox_targets_list, mask_targets_list
+
     def polar_centerness_target(self, pos_mask_targets):
         # only calculate pos centerness targets, otherwise there may be nan
         # centerness_targets = (pos_mask_targets.min(dim=-1)[0] / pos_mask_targets.max(dim=-1)[0])
@@ -412,15 +458,41 @@ class SiamPolar_Head(nn.Module):
             ]
             img_shape = img_metas[img_id]['img_shape']
             scale_factor = img_metas[img_id]['scale_factor']
+            # 0-based label of the tracked object, -1 if unknown
+            target_label = img_metas[img_id].get('refer_label', -1)
             det_bboxes = self.get_bboxes_single(cls_score_list,
                                                 bbox_pred_list,
                                                 mask_pred_list,
                                                 centerness_pred_list,
                                                 mlvl_points, img_shape,
-                                                scale_factor, cfg, rescale)
+                                                scale_factor, cfg, rescale,
+                                                target_label)
             result_list.append(det_bboxes)
         return result_list
 
+    def get_target_scores(self, cls_score, target_label=-1):
+        """Score every point of a level for the tracked object only.
+
+        With a known target label only that class is scored, otherwise the
+        best class of every point is used as a class-agnostic objectness.
+        Only one channel goes through the sigmoid either way.
+
+        Args:
+            cls_score (Tensor): Class logits of shape (num_classes - 1, H, W).
+            target_label (int): 0-based label of the tracked object, or -1.
+
+        Returns:
+            tuple[Tensor]: Scores of shape (H * W, 1) and labels (H * W, ).
+        """
+        if target_label >= 0:
+            logits = cls_score[target_label].reshape(-1)
+            labels = logits.new_full(
+                logits.shape, target_label, dtype=torch.long)
+        else:
+            logits, labels = cls_score.max(dim=0)
+            logits, labels = logits.reshape(-1), labels.reshape(-1)
+        return logits.sigmoid()[:, None], labels
+
     def get_bboxes_single(self,
                           cls_scores,
                           bbox_preds,
@@ -430,17 +502,31 @@ class SiamPolar_Head(nn.Module):
                           img_shape,
                           scale_factor,
                           cfg,
-                          rescale=False):
+                          rescale=False,
+                          target_label=-1):
         assert len(cls_scores) == len(bbox_preds) == len(mlvl_points)
+        if cfg.get('top1', False):
+            return self.get_top1_single(cls_scores, bbox_preds, mask_preds,
+                                        centernesses, mlvl_points, img_shape,
+                                        scale_factor, cfg, rescale,
+                                        target_label)
+        # only score the tracked object, see get_target_scores
+        target_only = cfg.get('target_only', False)
         mlvl_bboxes = []
         mlvl_scores = []
-        mlvl_masks = []
+        mlvl_labels = []
+        mlvl_centers = []
+        mlvl_mask_preds = []
         mlvl_centerness = []
         for cls_score, bbox_pred, mask_pred, centerness, points in zip(
                 cls_scores, bbox_preds, mask_preds, centernesses, mlvl_points):
             assert cls_score.size()[-2:] == bbox_pred.size()[-2:]
-            scores = cls_score.permute(1, 2, 0).reshape(
-                -1, self.cls_out_channels).sigmoid()
+            if target_only:
+                scores, labels = self.get_target_scores(
+                    cls_score, target_label)
+            else:
+                scores = cls_score.permute(1, 2, 0).reshape(
+                    -1, self.cls_out_channels).sigmoid()
 
             centerness = centerness.permute(1, 2, 0).reshape(-1).sigmoid()
             bbox_pred = bbox_pred.permute(1, 2, 0).reshape(-1, 4)
@@ -454,29 +540,33 @@ class SiamPolar_Head(nn.Module):
                 mask_pred = mask_pred[topk_inds, :]
                 scores = scores[topk_inds, :]
                 centerness = centerness[topk_inds]
+                if target_only:
+                    labels = labels[topk_inds]
             bboxes = distance2bbox(points, bbox_pred, max_shape=img_shape)
-            masks = distance2mask(points, mask_pred, self.angles, self.num_polar, max_shape=img_shape)
 
             mlvl_bboxes.append(bboxes)
             mlvl_scores.append(scores)
             mlvl_centerness.append(centerness)
-            mlvl_masks.append(masks)
+            mlvl_centers.append(points)
+            mlvl_mask_preds.append(mask_pred)
+            if target_only:
+                mlvl_labels.append(labels)
 
         mlvl_bboxes = torch.cat(mlvl_bboxes)
-        mlvl_masks = torch.cat(mlvl_masks)
+        # decode the masks of all levels at once, after the top-k selection
+        _mlvl_masks = distance2mask(
+            torch.cat(mlvl_centers),
+            torch.cat(mlvl_mask_preds),
+            self.angles_sin,
+            self.angles_cos,
+            max_shape=img_shape,
+            scale_factor=scale_factor if rescale else None)
         # solve UnboundLocalError: local variable '_mlvl_bboxes' referenced before assignment
-        _mlvl_bboxes = mlvl_bboxes; _mlvl_masks = mlvl_masks
+        _mlvl_bboxes = mlvl_bboxes
         if rescale:
             _mlvl_bboxes = mlvl_bboxes / mlvl_bboxes.new_tensor(scale_factor)
-            try:
-                scale_factor = torch.Tensor(scale_factor)[:2].cuda().unsqueeze(1).repeat(1, self.num_polar)
-                _mlvl_masks = mlvl_masks / scale_factor
-            except:
-                _mlvl_masks = mlvl_masks / mlvl_masks.new_tensor(scale_factor)
 
         mlvl_scores = torch.cat(mlvl_scores)
-        padding = mlvl_scores.new_zeros(mlvl_scores.shape[0], 1)
-        mlvl_scores = torch.cat([padding, mlvl_scores], dim=1)
         mlvl_centerness = torch.cat(mlvl_centerness)
 
         centerness_factor = 0.5  # mask centerness is smaller than origin centerness, so add a constant is important or the score will be too low.
@@ -484,17 +574,22 @@ class SiamPolar_Head(nn.Module):
             '''1 mask->min_bbox->nms, performance same to origin box'''
             a = _mlvl_masks
             _mlvl_bboxes = torch.stack([a[:, 0].min(1)[0],a[:, 1].min(1)[0],a[:, 0].max(1)[0],a[:, 1].max(1)[0]],-1)
-            det_bboxes, det_labels, det_masks = multiclass_nms_with_mask(
+        # else: '''2 origin bbox->nms, performance same to mask->min_bbox'''
+
+        if target_only:
+            # a single score per point, one class-agnostic NMS pass
+            det_bboxes, det_labels, det_masks = agnostic_nms_with_mask(
                 _mlvl_bboxes,
-                mlvl_scores,
+                mlvl_scores[:, 0],
                 _mlvl_masks,
+                torch.cat(mlvl_labels),
                 cfg.score_thr,
                 cfg.nms,
                 cfg.max_per_img,
                 score_factors=mlvl_centerness + centerness_factor)
-
         else:
-            '''2 origin bbox->nms, performance same to mask->min_bbox'''
+            padding = mlvl_scores.new_zeros(mlvl_scores.shape[0], 1)
+            mlvl_scores = torch.cat([padding, mlvl_scores], dim=1)
             det_bboxes, det_labels, det_masks = multiclass_nms_with_mask(
                 _mlvl_bboxes,
                 mlvl_scores,
@@ -507,33 +602,108 @@ class SiamPolar_Head(nn.Module):
         return det_bboxes, det_labels, det_masks
 
 
+    def get_top1_single(self,
+                        cls_scores,
+                        bbox_preds,
+                        mask_preds,
+                        centernesses,
+                        mlvl_points,
+                        img_shape,
+                        scale_factor,
+                        cfg,
+                        rescale=False,
+                        target_label=-1):
+        """Only keep the best detection of an image.
+
+        The best detection of the NMS path is the point with the highest
+        score * (centerness + 0.5) above ``cfg.score_thr``, as NMS never
+        suppresses it. It is found directly among the same ``cfg.nms_pre``
+        candidates of every level as in :meth:`get_bboxes_single`, and only
+        its bbox and mask are decoded, so NMS is skipped altogether.
+        """
+        centerness_factor = 0.5
+        nms_pre = cfg.get('nms_pre', -1)
+        best_score, best = None, None
+        for lvl, (cls_score, centerness) in enumerate(
+                zip(cls_scores, centernesses)):
+            # the sigmoid is monotonic, so the best class of every point
+            # is that of its largest logit
+            scores, labels = self.get_target_scores(cls_score, target_label)
+            scores = scores[:, 0]
+            centerness = centerness.reshape(-1).sigmoid()
+            weighted = scores * (centerness + centerness_factor)
+            weighted[scores <= cfg.score_thr] = -1
+            if nms_pre > 0 and scores.shape[0] > nms_pre:
+                # the candidates of get_bboxes_single
+                _, topk_inds = (scores * centerness).topk(nms_pre)
+                score, ind = weighted[topk_inds].max(dim=0)
+                ind = topk_inds[ind]
+            else:
+                score, ind = weighted.max(dim=0)
+            if score > 0 and (best_score is None or score > best_score):
+                best_score, best = score, (lvl, ind, labels[ind])
+
+        if best is None:
+            return (mlvl_points[0].new_zeros((0, 5)),
+                    mlvl_points[0].new_zeros((0, ), dtype=torch.long),
+                    mlvl_points[0].new_zeros((0, 2, self.num_polar)))
+
+        lvl, ind, label = best
+        points = mlvl_points[lvl][ind][None]
+        bbox_pred = bbox_preds[lvl].reshape(4, -1)[:, ind][None]
+        mask_pred = mask_preds[lvl].reshape(self.num_polar, -1)[:, ind][None]
+        masks = distance2mask(
+            points,
+            mask_pred,
+            self.angles_sin,
+            self.angles_cos,
+            max_shape=img_shape,
+            scale_factor=scale_factor if rescale else None)
+        if self.mask_nms:
+            bboxes = torch.cat([masks.min(dim=2)[0], masks.max(dim=2)[0]], 1)
+        else:
+            bboxes = distance2bbox(points, bbox_pred, max_shape=img_shape)
+            if rescale:
+                bboxes /= bboxes.new_tensor(scale_factor)
+        det_bboxes = torch.cat([bboxes, best_score.reshape(1, 1)], dim=1)
+        return det_bboxes, label.reshape(1), masks
+
+
 # test
-def distance2mask(points, distances, angles, num_polar, max_shape=None):
-    '''Decode distance prediction to 36 mask points
+def distance2mask(points, distances, sin, cos, max_shape=None,
+                  scale_factor=None):
+    '''Decode distance prediction to num_polar mask points
     Args:
         points (Tensor): Shape (n, 2), [x, y].
-        distance (Tensor): Distance from the given point to 36,from angle 0 to 350.
-        angles (Tensor):
+        distance (Tensor): Distance from the given point to num_polar rays,
+            from angle 0 to 360 - 360 / num_polar.
+        sin (Tensor): Sine of the ray angles, shape (num_polar, ).
+        cos (Tensor): Cosine of the ray angles, shape (num_polar, ).
         max_shape (tuple): Shape of the image.
+        scale_factor (float | ndarray): If given, the clamped points are
+            divided by it, a (w, h, w, h) array scales x and y separately.
 
     Returns:
-        Tensor: Decoded masks.
+        Tensor: Decoded masks, shape (n, 2, num_polar). The decode writes
+            into the output in place, so it does not support autograd.
     '''
-    num_points = points.shape[0]
-    points = points[:, :, None].repeat(1, 1, num_polar)
-    c_x, c_y = points[:, 0], points[:, 1]
-    
-    sin = torch.sin(angles)
-    cos = torch.cos(angles)
-    sin = sin[None, :].repeat(num_points, 1)
-    cos = cos[None, :].repeat(num_points, 1)
-
-    x = distances * sin + c_x
-    y = distances * cos + c_y
+    res = distances.new_empty((distances.shape[0], 2, distances.shape[1]))
+    x, y = res[:, 0], res[:, 1]
 
-    if max_shape is not None:
-        x = x.clamp(min=0, max=max_shape[1] - 1)
-        y = y.clamp(min=0, max=max_shape[0] - 1)
+    torch.mul(distances, sin[None, :], out=x)
+    torch.mul(distances, cos[None, :], out=y)
+    x += points[:, 0, None]
+    y += points[:, 1, None]
 
-    res = torch.cat([x[:, None, :], y[:, None, :]], dim=1)
+    if max_shape is not None:
+        x.clamp_(min=0, max=max_shape[1] - 1)
+        y.clamp_(min=0, max=max_shape[0] - 1)
+
+    if scale_factor is not None:
+        scale_factor = res.new_tensor(scale_factor)
+        if scale_factor.numel() > 1:
+            x /= scale_factor[0]
+            y /= scale_factor[1]
+        else:
+            res /= scale_factor
     return res
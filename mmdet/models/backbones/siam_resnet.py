@@ -10,6 +10,7 @@ import torch.nn.functional as F
 
 from ..registry import BACKBONES
 from mmcv.cnn import constant_init, kaiming_init
+from ..utils import CrossCorrelation, correlation_residual
 from .resnet import ResNet
 
 
@@ -40,7 +41,9 @@ class SiamResNet(nn.Module):
                  with_cp=False,
                  zero_init_residual=True,
                  correlation_blocks=[3, 4, 5],
-                 attention_blocks=None):
+                 attention_blocks=None,
+                 corr_fft_threshold=None,
+                 freeze_template=False):
         super(SiamResNet, self).__init__()
         self.template_backbone = ResNet(template_depth, 
                                         num_stages,
@@ -61,6 +64,12 @@ class SiamResNet(nn.Module):
                                         with_cp,
                                         zero_init_residual)
         self.template_pretrained = template_pretrained
+        # the template branch keeps its pretrained weights and runs without
+        # autograd, so that its features can be cached across epochs
+        self.freeze_template = freeze_template
+        if freeze_template:
+            for param in self.template_backbone.parameters():
+                param.requires_grad = False
         self.search_backbone = ResNet(depth,
                                         num_stages,
                                         strides,
@@ -82,17 +91,36 @@ class SiamResNet(nn.Module):
         # Cross Correlation
         self.correlation_blocks = [correlation_block-2 
                                     for correlation_block in correlation_blocks] # start from block2
+        self.xcorr = CrossCorrelation(fft_threshold=corr_fft_threshold)
         self.match_batchnorm = nn.BatchNorm2d(1)
-        self.softmax = nn.Softmax(dim=1)
         self.gama = nn.Parameter(torch.zeros(1))
         
-    def forward(self, x1, x2): 
+    def forward_template(self, x2):
+        """Extract the template features, which can be computed once per
+        video and passed to :meth:`forward` as ``template_blocks``.
+        """
+        if self.freeze_template:
+            with torch.no_grad():
+                return self.template_backbone(x2)
+        return self.template_backbone(x2)
+
+    def train(self, mode=True):
+        super(SiamResNet, self).train(mode)
+        if self.freeze_template:
+            self.template_backbone.eval()
+        return self
+
+    def forward(self, x1, x2=None, template_blocks=None): 
         """
         Args:
             x1 (torch.Tensor): The search region image of dimensions
                 [B, C, H', W']. Usually the shape is [4, 3, 255, 255].
             x2 (torch.Tensor): The reference patch of dimensions [B, C, H, W].
                 Usually the shape is [4, 3, 127, 127].
+            template_blocks (tuple[torch.Tensor], optional): Precomputed
+                template features from :meth:`forward_template`. If given,
+                x2 is ignored. With a single search image (B = 1), there
+                may be K templates, e.g. of the objects of the frame.
         Returns:
             block2, block3, block4, block5: The outputs of each block, 
                 some are fused with response maps. 
@@ -100,7 +128,8 @@ class SiamResNet(nn.Module):
 
         # extract features
         search_blocks = self.search_backbone(x1)
-        template_blocks = self.template_backbone(x2)
+        if template_blocks is None:
+            template_blocks = self.forward_template(x2)
         # init outs
         outs = [search_block for search_block in search_blocks]
 
@@ -109,15 +138,23 @@ class SiamResNet(nn.Module):
             embedding_search = search_blocks[correlation_block]
             embedding_template = template_blocks[correlation_block]
 
-            # re-correlation
-            match_map = self.match_corr(embedding_search, 
-                                        embedding_template, 
-                                        embedding_search.shape[2:])
-            match_map = match_map.repeat(1, embedding_template.size()[1], 1, 1)
-            corr_value = self.softmax(match_map)*embedding_search
-            outs[correlation_block] =  self.gama*corr_value + embedding_search
-        
-        return tuple(outs)
+            # re-correlation, the response map only matters for training
+            # (BatchNorm statistics and gradients), see correlation_residual
+            if self.training or torch.is_grad_enabled():
+                match_map = self.match_corr(embedding_search, 
+                                            embedding_template, 
+                                            embedding_search.shape[2:])
+            else:
+                match_map = None
+            outs[correlation_block] = correlation_residual(
+                embedding_search, match_map, self.gama)
+
+        # a single search image with K templates gives K correlated
+        # pyramids, which only differ where the response maps are used
+        num_outs = max(out.size(0) for out in outs)
+        return tuple(
+            out.expand(num_outs, *out.shape[1:])
+            if out.size(0) != num_outs else out for out in outs)
     
     def init_weights(self, pretrained=None):
         for m in self.modules():
@@ -140,18 +177,8 @@ class SiamResNet(nn.Module):
         Returns:
             match_map: (torch.Tensor) The correlation between
         """
-        # print('embed_srch: ', embed_srch.size(), "embed_ref: ", embed_ref.size())
-        b, c, h, w = embed_srch.shape
-        # Here the correlation layer is implemented using a trick with the
-        # conv2d function using groups in order to do the correlation with
-        # batch dimension. Basically we concatenate each element of the batch
-        # in the channel dimension for the search image (making it
-        # [1 x (B.C) x H' x W']) and setting the number of groups to the size of
-        # the batch. This grouped convolution/correlation is equivalent to a
-        # correlation between the two images, though it is not obvious.
-        match_map = F.conv2d(embed_srch.view(1, b * c, h, w), embed_ref, groups=b)
-        # Here we reorder the dimensions to get back the batch dimension.
-        match_map = match_map.permute(1, 0, 2, 3)
+        # correlate each sample with its own template, [B, 1, H-h+1, W-w+1]
+        match_map = self.xcorr(embed_srch, embed_ref)
         match_map = self.match_batchnorm(match_map)
         match_map = F.interpolate(match_map, upsc_size, mode='bilinear', align_corners=False)
         
@@ -33,13 +33,19 @@ class PolarMask(SingleStageDetector):
                       gt_bboxes_ignore=None,
                       _gt_labels=None,
                       _gt_bboxes=None,
-                      _gt_masks=None
+                      _gt_masks=None,
+                      gt_centers=None,
+                      gt_contours=None
                       ):
 
         if _gt_labels is not None:
             extra_data = dict(_gt_labels=_gt_labels,
                               _gt_bboxes=_gt_bboxes,
                               _gt_masks=_gt_masks)
+        elif gt_contours is not None:
+            # the head assigns the targets, see polar_target_from_contours
+            extra_data = dict(gt_centers=gt_centers,
+                              gt_contours=gt_contours)
         else:
             extra_data = None
 
@@ -64,8 +70,10 @@ class PolarMask(SingleStageDetector):
         bbox_inputs = outs + (img_meta, self.test_cfg, rescale)
         bbox_list = self.bbox_head.get_bboxes(*bbox_inputs)
 
+        # only rasterize the masks of the top detections if set
+        max_num = self.test_cfg.get('max_per_mask', -1)
         results = [
-            bbox_mask2result(det_bboxes, det_masks, det_labels, self.bbox_head.num_classes, img_meta[0])
+            bbox_mask2result(det_bboxes, det_masks, det_labels, self.bbox_head.num_classes, img_meta[0], max_num)
             for det_bboxes, det_labels, det_masks in bbox_list]
 
         bbox_results = results[0][0]
@@ -4,10 +4,19 @@
 @LastEditAuthor: JosieHong
 LastEditTime: 2021-01-12 17:43:17
 '''
+import hashlib
+import os.path as osp
+from collections import OrderedDict
+
+import torch
+import torch.nn.functional as F
+
 from ..registry import DETECTORS
+from ..utils import TemplateCache
 from .single_stage import SingleStageDetector
 
-from mmdet.core import auto_fp16, bbox_mask2result
+from mmdet.core import (auto_fp16, bbox_mapping, bbox_mask2result,
+                        mask_mapping, merge_aug_polygons)
 
 
 @DETECTORS.register_module
@@ -22,9 +31,160 @@ class SiamPolar(SingleStageDetector):
                  pretrained=None):
         super(SiamPolar, self).__init__(backbone, neck, bbox_head, train_cfg,
                                    test_cfg, pretrained)
+        # template features of the videos being tracked, keyed by the
+        # 'refer_key' in img_meta
+        cache_size = 8 if test_cfg is None else test_cfg.get(
+            'template_cache_size', 8)
+        self.template_cache = TemplateCache(cache_size)
+        # template features of the training videos, only used with a frozen
+        # template branch, see build_train_template_cache
+        self.train_template_cache = None
+
+    def train(self, mode=True):
+        # cached template features are stale once the weights are updated
+        self.template_cache.clear()
+        if mode and self.train_template_cache is None:
+            self.train_template_cache = self.build_train_template_cache()
+        return super(SiamPolar, self).train(mode)
+
+    def init_template(self, img_refer, key=None):
+        """Compute the template features of a video.
+
+        Args:
+            img_refer (Tensor): The reference patch of shape [1, C, H, W].
+            key (hashable, optional): If given, the features are cached and
+                reused by every later frame whose img_meta has the same
+                'refer_key'.
+
+        Returns:
+            tuple[Tensor]: Multi-level template features.
+        """
+        template_feats = self.backbone.forward_template(img_refer)
+        if key is not None:
+            self.template_cache.put(key,
+                                    self.correlated_levels(template_feats))
+        return template_feats
+
+    def correlated_levels(self, template_feats):
+        """Keep the template levels that are correlated with the search
+        features, see ``correlation_blocks`` of the backbone, the others
+        are None."""
+        return tuple(
+            feat if i in self.backbone.correlation_blocks else None
+            for i, feat in enumerate(template_feats))
+
+    def build_train_template_cache(self):
+        """Build the cache of the template features used in training.
+
+        The features of a frozen template branch (``freeze_template=True``
+        in the backbone) never change, so they are cached across iterations
+        and epochs. The cache is set by ``template_cache`` in train_cfg,
+        e.g. ``dict(max_size=1024, cache_dir='work_dirs/templates')``. On
+        disk the templates are kept per template weights, and per
+        'refer_key' and input size.
+
+        It is built by the first ``train()``, once the weights are loaded,
+        and not in forward_train: MMDataParallel runs forward on replicas
+        of the model, which would drop the attribute after every iteration.
+        The replicas share the cache object itself.
+
+        Returns:
+            TemplateCache | None: None if the template branch is trained.
+        """
+        if not getattr(self.backbone, 'freeze_template', False):
+            return None
+        cache_cfg = dict(max_size=1024)
+        if self.train_cfg is not None:
+            cache_cfg.update(self.train_cfg.get('template_cache', {}))
+        if cache_cfg.get('cache_dir') is not None:
+            md5 = hashlib.md5()
+            state_dict = self.backbone.template_backbone.state_dict()
+            for name in sorted(state_dict):
+                md5.update(state_dict[name].cpu().numpy().tobytes())
+            cache_cfg['cache_dir'] = osp.join(cache_cfg['cache_dir'],
+                                              md5.hexdigest())
+        return TemplateCache(**cache_cfg)
+
+    def extract_template_feat(self, img_refer, img_meta, use_cache=True):
+        """Get the template features for a batch of search frames.
+
+        Every distinct 'refer_key' of the batch is looked up in the template
+        cache, and the missing templates go through the template backbone
+        together. A reference batch of size 1 is shared by all frames.
+
+        Args:
+            use_cache (bool): Whether to use the template cache, which is
+                the training one in training mode. Without cache the
+                templates of a batch are still only computed once per
+                distinct 'refer_key'.
+
+        Returns:
+            tuple[Tensor]: Multi-level template features with one entry per
+                search frame, None for the levels that are not correlated.
+        """
+        num_imgs = len(img_meta)
+        keys = [meta.get('refer_key') for meta in img_meta]
+        if img_refer.size(0) == 1:
+            keys = keys[:1]
+        assert len(keys) == img_refer.size(0)
+        if self.training:
+            # the training templates on disk outlive the input size
+            keys = [
+                None if key is None else (key, tuple(img_refer.shape[2:]))
+                for key in keys
+            ]
+
+        # the distinct templates and the one used by each search frame
+        uniq_inds, refer_inds, key2uniq = [], [], {}
+        for i, key in enumerate(keys):
+            if key is not None and key in key2uniq:
+                refer_inds.append(key2uniq[key])
+                continue
+            if key is not None:
+                key2uniq[key] = len(uniq_inds)
+            refer_inds.append(len(uniq_inds))
+            uniq_inds.append(i)
+
+        if not use_cache and len(uniq_inds) == num_imgs:
+            # no template is shared
+            return self.correlated_levels(
+                self.backbone.forward_template(img_refer))
+        cache = self.train_template_cache if self.training else \
+            self.template_cache
+        if use_cache:
+            uniq_feats = [
+                cache.get(keys[i], img_refer.device) for i in uniq_inds
+            ]
+        else:
+            uniq_feats = [None] * len(uniq_inds)
+        missing = [j for j, feats in enumerate(uniq_feats) if feats is None]
+        if missing:
+            new_feats = self.correlated_levels(
+                self.backbone.forward_template(
+                    img_refer[[uniq_inds[j] for j in missing]]))
+            for k, j in enumerate(missing):
+                uniq_feats[j] = tuple(
+                    None if feat is None else feat[k:k + 1]
+                    for feat in new_feats)
+                key = keys[uniq_inds[j]]
+                if use_cache and key is not None:
+                    cache.put(key, uniq_feats[j])
 
-    def extract_feat(self, img, img_refer):
-        x = self.backbone(img, img_refer)
+        refer_inds = img_refer.new_tensor(refer_inds, dtype=torch.long)
+        template_feats = []
+        for lvl_feats in zip(*uniq_feats):
+            if lvl_feats[0] is None:
+                template_feats.append(None)
+            elif len(lvl_feats) == 1:
+                template_feats.append(lvl_feats[0].expand(
+                    num_imgs, *lvl_feats[0].shape[1:]))
+            else:
+                template_feats.append(
+                    torch.cat(lvl_feats).index_select(0, refer_inds))
+        return tuple(template_feats)
+
+    def extract_feat(self, img, img_refer, template_feats=None):
+        x = self.backbone(img, img_refer, template_blocks=template_feats)
         if self.with_neck:
             x = self.neck(x)
         return x
@@ -39,17 +199,33 @@ class SiamPolar(SingleStageDetector):
                       gt_bboxes_ignore=None,
                       _gt_labels=None,
                       _gt_bboxes=None,
-                      _gt_masks=None
+                      _gt_masks=None,
+                      gt_centers=None,
+                      gt_contours=None,
+                      _gt_pos_inds=None
                       ):
 
         if _gt_labels is not None:
             extra_data = dict(_gt_labels=_gt_labels,
                               _gt_bboxes=_gt_bboxes,
                               _gt_masks=_gt_masks)
+            if _gt_pos_inds is not None:
+                # targets of the positive points only
+                extra_data['_gt_pos_inds'] = _gt_pos_inds
+        elif gt_contours is not None:
+            # the head assigns the targets, see polar_target_from_contours
+            extra_data = dict(gt_centers=gt_centers,
+                              gt_contours=gt_contours)
         else:
             extra_data = None
 
-        x = self.extract_feat(img, img_refer)
+        # frames of the same video (see VideoGroupSampler) share a template,
+        # which is also cached across iterations if it is frozen
+        template_feats = self.extract_template_feat(
+            img_refer,
+            img_metas,
+            use_cache=self.train_template_cache is not None)
+        x = self.extract_feat(img, img_refer, template_feats)
         outs = self.bbox_head(x)
         loss_inputs = outs + (gt_bboxes, gt_labels, img_metas, self.train_cfg)
         
@@ -62,6 +238,13 @@ class SiamPolar(SingleStageDetector):
         return losses
 
     def forward_test(self, imgs, img_metas, img_refers, rescale):
+        """Test a batch of frames.
+
+        :meth:`simple_test` and :meth:`aug_test` return a list with the
+        (bbox_results, mask_results) of every frame. A batch of one frame
+        returns its (bbox_results, mask_results) only, as expected by
+        ``inference_detector`` and the evaluation hooks.
+        """
         for var, name in [(imgs, 'imgs'), (img_metas, 'img_metas'), (img_refers, 'img_refers')]:
             if not isinstance(var, list):
                 raise TypeError('{} must be a list, but got {}'.format(
@@ -72,30 +255,164 @@ class SiamPolar(SingleStageDetector):
             raise ValueError(
                 'num of augmentations ({}) != num of image meta ({})'.format(
                     len(imgs), len(img_metas)))
-        # TODO: remove the restriction of imgs_per_gpu == 1 when prepared
-        imgs_per_gpu = imgs[0].size(0)
-        assert imgs_per_gpu == 1
-
         if num_augs == 1:
-            return self.simple_test(imgs[0], img_metas[0], img_refers[0], rescale)
+            results = self.simple_test(imgs[0], img_metas[0], img_refers[0],
+                                       rescale)
         else:
-            return self.aug_test(imgs, img_metas, img_refers, rescale)
+            results = self.aug_test(imgs, img_metas, img_refers, rescale)
+        if len(results) == 1:
+            return results[0]
+        return results
 
-    def simple_test(self, img, img_meta, img_refer, rescale=False):
-        x = self.extract_feat(img, img_refer)
+    def simple_test_bboxes(self,
+                           img,
+                           img_meta,
+                           img_refer,
+                           rescale=False,
+                           template_feats=None):
+        """Get the (det_bboxes, det_labels, det_masks) of every frame, with
+        the masks as polygons, before they are rasterized."""
+        if template_feats is None:
+            template_feats = self.extract_template_feat(img_refer, img_meta)
+        x = self.extract_feat(img, img_refer, template_feats)
         outs = self.bbox_head(x)
 
         bbox_inputs = outs + (img_meta, self.test_cfg, rescale)
+        return self.bbox_head.get_bboxes(*bbox_inputs)
+
+    def simple_test(self, img, img_meta, img_refer, rescale=False,
+                    template_feats=None):
+        bbox_list = self.simple_test_bboxes(img, img_meta, img_refer, rescale,
+                                            template_feats)
+
+        # only rasterize the masks of the top detections if set
+        max_num = self.test_cfg.get('max_per_mask', -1)
+        return [
+            bbox_mask2result(det_bboxes, det_masks, det_labels, self.bbox_head.num_classes, img_meta[i], max_num)
+            for i, (det_bboxes, det_labels, det_masks) in enumerate(bbox_list)]
+
+    def aug_test(self, imgs, img_metas, img_refers, rescale=False):
+        """Test with multi-scale and flip augmentations.
+
+        The views of all the frames go through the backbone and the head as
+        a single batch, padded to the largest view, and share the templates
+        of the frames. The detections of the views of a frame are mapped
+        back to the original image and fused in ray space, see
+        ``merge_aug_polygons``.
+        """
+        num_augs = len(imgs)
+        num_imgs = imgs[0].size(0)
+        pad_h = max(img.size(2) for img in imgs)
+        pad_w = max(img.size(3) for img in imgs)
+        img = torch.cat([
+            F.pad(img, (0, pad_w - img.size(3), 0, pad_h - img.size(2)))
+            for img in imgs
+        ])
+        # the views of a frame are stacked view by view
+        aug_metas = [img_meta for metas in img_metas for img_meta in metas]
+        template_feats = self.extract_template_feat(img_refers[0],
+                                                    img_metas[0])
+        template_feats = tuple(
+            None if feat is None else feat.repeat(num_augs, *[1] *
+                                                  (feat.dim() - 1))
+            for feat in template_feats)
+        x = self.extract_feat(img, img_refers[0], template_feats)
+        outs = self.bbox_head(x)
+
+        bbox_inputs = outs + (aug_metas, self.test_cfg, False)
         bbox_list = self.bbox_head.get_bboxes(*bbox_inputs)
 
-        results = [
-            bbox_mask2result(det_bboxes, det_masks, det_labels, self.bbox_head.num_classes, img_meta[0])
-            for det_bboxes, det_labels, det_masks in bbox_list]
+        max_num = self.test_cfg.get('max_per_mask', -1)
+        results = []
+        for i in range(num_imgs):
+            view_metas = [metas[i] for metas in img_metas]
+            aug_bboxes, aug_labels, aug_masks = zip(*bbox_list[i::num_imgs])
+            det_bboxes, det_labels, det_masks = merge_aug_polygons(
+                aug_bboxes, aug_labels, aug_masks, view_metas, self.test_cfg)
+            img_meta = view_metas[0]
+            if not rescale:
+                # in the scale of the first view, which is not flipped
+                det_bboxes[:, :4] = bbox_mapping(
+                    det_bboxes[:, :4], img_meta['img_shape'],
+                    det_bboxes.new_tensor(img_meta['scale_factor']),
+                    img_meta['flip'])
+                det_masks = mask_mapping(det_masks, img_meta['img_shape'],
+                                         img_meta['scale_factor'],
+                                         img_meta['flip'])
+            results.append(
+                bbox_mask2result(det_bboxes, det_masks, det_labels,
+                                 self.bbox_head.num_classes, img_meta,
+                                 max_num))
+        return results
+
+    def simple_test_multi(self,
+                          img,
+                          img_meta,
+                          img_refers,
+                          obj_ids=None,
+                          refer_labels=None,
+                          rescale=False,
+                          template_feats=None):
+        """Segment several objects of a frame with one search forward.
+
+        The search backbone runs once and its features are correlated with
+        the K templates at once, so the head gets K correlated pyramids
+        (a single one when they do not differ, i.e. in inference, see
+        ``correlation_residual``). Every object is then decoded with its own
+        'refer_label', which selects its class with ``test_cfg.target_only``.
+
+        Args:
+            img (Tensor): The frame, of shape [1, C, H, W].
+            img_meta (list[dict]): Meta info of the frame.
+            img_refers (Tensor): The reference patches of the K objects, of
+                shape [K, C, h, w].
+            obj_ids (list, optional): Ids of the objects, default 0..K-1.
+                With a 'refer_key' in img_meta, the templates are cached by
+                (refer_key, obj_id).
+            refer_labels (list[int], optional): 0-based class of every
+                object, -1 (or None) for the best class of every point.
+            template_feats (tuple[Tensor], optional): Precomputed template
+                features of the K objects.
 
-        bbox_results = results[0][0]
-        mask_results = results[0][1]
+        Returns:
+            OrderedDict: (bbox_results, mask_results) of every object id.
+        """
+        assert img.size(0) == 1 and len(img_meta) == 1
+        num_objs = img_refers.size(0)
+        if obj_ids is None:
+            obj_ids = list(range(num_objs))
+        if refer_labels is None:
+            refer_labels = [-1] * num_objs
+        assert len(obj_ids) == num_objs and len(refer_labels) == num_objs
+        refer_key = img_meta[0].get('refer_key')
+        obj_metas = []
+        for obj_id, label in zip(obj_ids, refer_labels):
+            obj_meta = dict(img_meta[0])
+            obj_meta['refer_key'] = None if refer_key is None else (
+                refer_key, obj_id)
+            obj_meta['refer_label'] = -1 if label is None else label
+            obj_metas.append(obj_meta)
+
+        if template_feats is None:
+            template_feats = self.extract_template_feat(img_refers, obj_metas)
+        x = self.extract_feat(img, img_refers, template_feats)
+        outs = self.bbox_head(x)
+        # the pyramids of the objects, shared if they are the same
+        outs = tuple([
+            lvl_out.expand(num_objs, *lvl_out.shape[1:])
+            for lvl_out in head_out
+        ] for head_out in outs)
+
+        bbox_inputs = outs + (obj_metas, self.test_cfg, rescale)
+        bbox_list = self.bbox_head.get_bboxes(*bbox_inputs)
 
-        return bbox_results, mask_results
+        max_num = self.test_cfg.get('max_per_mask', -1)
+        return OrderedDict(
+            (obj_id, bbox_mask2result(det_bboxes, det_masks, det_labels,
+                                      self.bbox_head.num_classes,
+                                      obj_metas[i], max_num))
+            for i, (obj_id, (det_bboxes, det_labels, det_masks)) in enumerate(
+                zip(obj_ids, bbox_list)))
 
     @auto_fp16(apply_to=('img', ))
     @auto_fp16(apply_to=('img_refer', ))
@@ -1,12 +1,16 @@
 from .conv_module import ConvModule, build_conv_layer
 from .conv_ws import ConvWS2d, conv_ws_2d
+from .correlation import (CrossCorrelation, correlation_residual, xcorr_conv,
+                          xcorr_fft)
 from .norm import build_norm_layer
 from .scale import Scale
+from .template_cache import TemplateCache
 from .weight_init import (bias_init_with_prob, kaiming_init, normal_init,
                           uniform_init, xavier_init)
 
 __all__ = [
     'conv_ws_2d', 'ConvWS2d', 'build_conv_layer', 'ConvModule',
     'build_norm_layer', 'xavier_init', 'normal_init', 'uniform_init',
-    'kaiming_init', 'bias_init_with_prob', 'Scale'
+    'kaiming_init', 'bias_init_with_prob', 'Scale', 'TemplateCache',
+    'CrossCorrelation', 'correlation_residual', 'xcorr_conv', 'xcorr_fft'
 ]
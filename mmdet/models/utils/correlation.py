@@ -0,0 +1,93 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+# torch.fft is a module (with rfft2) only in newer versions of pytorch
+_HAS_FFT = hasattr(torch, 'fft') and hasattr(torch.fft, 'rfft2')
+
+
+def xcorr_conv(search, template):
+    """Correlate every search map with the template of the same sample.
+
+    The batch is folded into the channels, so that a grouped convolution
+    with one group per sample does all the correlations in a single call.
+    A single search map is correlated with every template, e.g. the K
+    objects tracked in a frame, by a plain convolution with K filters.
+
+    Args:
+        search (Tensor): Search features of shape [B, C, H, W] or
+            [1, C, H, W].
+        template (Tensor): Template features of shape [B, C, h, w].
+
+    Returns:
+        Tensor: Response maps of shape [B, 1, H - h + 1, W - w + 1].
+    """
+    b, c, h, w = search.shape
+    if b == 1:
+        return F.conv2d(search, template).permute(1, 0, 2, 3)
+    response = F.conv2d(search.reshape(1, b * c, h, w), template, groups=b)
+    return response.permute(1, 0, 2, 3)
+
+
+def xcorr_fft(search, template):
+    """Same as :func:`xcorr_conv`, computed in the frequency domain.
+
+    The cost does not depend on the template size, which makes it faster
+    than the convolution for large templates. A single search map is
+    broadcast to every template.
+    """
+    h, w = search.shape[-2:]
+    th, tw = template.shape[-2:]
+    search_f = torch.fft.rfft2(search.float())
+    template_f = torch.fft.rfft2(template.float(), s=(h, w))
+    response = torch.fft.irfft2(
+        (search_f * template_f.conj()).sum(dim=1, keepdim=True), s=(h, w))
+    # only the part without circular wrap-around is a valid correlation
+    return response[..., :h - th + 1, :w - tw + 1].to(search.dtype)
+
+
+class CrossCorrelation(nn.Module):
+    """Cross correlation between search and template features.
+
+    Args:
+        fft_threshold (int, optional): Use :func:`xcorr_fft` for templates
+            with at least this many pixels (h * w), and :func:`xcorr_conv`
+            otherwise. The FFT path is never used if it is None or if this
+            version of pytorch has no ``torch.fft`` module.
+    """
+
+    def __init__(self, fft_threshold=None):
+        super(CrossCorrelation, self).__init__()
+        self.fft_threshold = fft_threshold
+
+    def forward(self, search, template):
+        if (_HAS_FFT and self.fft_threshold is not None
+                and template.shape[-2] * template.shape[-1] >=
+                self.fft_threshold):
+            return xcorr_fft(search, template)
+        return xcorr_conv(search, template)
+
+
+def correlation_residual(search, match_map, gama):
+    """Fuse a response map into the search features.
+
+    Computes ``gama * softmax(match_map.repeat(1, C, 1, 1), dim=1) * search
+    + search`` without materializing the repeated map. The softmax over C
+    copies of the same value is ``1 / C``, i.e. the softmax over the single
+    channel of ``match_map`` (which is 1, with zero gradient) divided by C.
+
+    Args:
+        search (Tensor): Search features of shape [B, C, H, W].
+        match_map (Tensor | None): Response map of shape [B, 1, H, W], or
+            [K, 1, H, W] for K templates of a single search map. Since
+            it does not change the result, it may be None when no gradient
+            and no BatchNorm statistics are needed from it.
+        gama (Tensor): Residual scale of shape [1].
+
+    Returns:
+        Tensor: Fused features of shape [B, C, H, W].
+    """
+    weight = gama / search.size(1)
+    if match_map is not None:
+        weight = F.softmax(match_map, dim=1) * weight
+    return torch.addcmul(search, search, weight)
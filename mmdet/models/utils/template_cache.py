@@ -0,0 +1,94 @@
+import hashlib
+import os
+import os.path as osp
+import threading
+from collections import OrderedDict
+
+import mmcv
+import torch
+
+
+class TemplateCache(object):
+    """LRU cache of template features, keyed by video.
+
+    The template of a video never changes during tracking, so its backbone
+    features only need to be computed once per sequence. Levels of the
+    features may be None, e.g. the ones that are not correlated. The cache
+    can be shared by the replicas of MMDataParallel, which run in threads
+    on different devices.
+
+    Args:
+        max_size (int): Maximum number of cached templates. The least recently
+            used one is evicted when this is exceeded.
+        cache_dir (str, optional): If given, the templates are also saved to
+            this directory and loaded from it when they are not in memory,
+            e.g. in a later run with the same template weights.
+    """
+
+    def __init__(self, max_size=8, cache_dir=None):
+        assert max_size > 0
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        if cache_dir is not None:
+            mmcv.mkdir_or_exist(cache_dir)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def __contains__(self, key):
+        return key in self._cache
+
+    def _path(self, key):
+        name = hashlib.md5(str(key).encode()).hexdigest()
+        return osp.join(self.cache_dir, name + '.pth')
+
+    def get(self, key, device=None):
+        with self._lock:
+            feats = self._cache.get(key)
+            if feats is not None:
+                self._cache.move_to_end(key)
+        if feats is None:
+            if self.cache_dir is None or not osp.isfile(self._path(key)):
+                return None
+            feats = torch.load(self._path(key), map_location='cpu')
+            if device is not None:
+                feats = _apply(lambda feat: feat.to(device), feats)
+            with self._lock:
+                self._put(key, feats)
+        elif device is not None:
+            # no-op unless another replica cached it
+            feats = _apply(lambda feat: feat.to(device), feats)
+        return feats
+
+    def _put(self, key, feats):
+        self._cache[key] = feats
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    def put(self, key, feats):
+        feats = _apply(lambda feat: feat.detach(), feats)
+        with self._lock:
+            self._put(key, feats)
+        if self.cache_dir is not None:
+            path = self._path(key)
+            # write and rename, other processes (or threads) may read the
+            # same file
+            tmp_path = '{}.{}.{}.tmp'.format(path, os.getpid(),
+                                             threading.get_ident())
+            torch.save(_apply(lambda feat: feat.cpu(), feats), tmp_path)
+            os.replace(tmp_path, path)
+
+    def pop(self, key):
+        with self._lock:
+            return self._cache.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+def _apply(func, feats):
+    return tuple(None if feat is None else func(feat) for feat in feats)
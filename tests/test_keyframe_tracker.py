@@ -0,0 +1,99 @@
+"""Keyframe scheduling of KeyframeTracker with a local search region.
+
+    pytest tests/test_keyframe_tracker.py
+"""
+import cv2
+import mmcv
+import numpy as np
+import torch
+import torch.nn as nn
+
+
+class _DummyDetector(nn.Module):
+    """Only what the trackers read from a model loaded by init_detector."""
+
+    def __init__(self):
+        super(_DummyDetector, self).__init__()
+        self.weight = nn.Parameter(torch.zeros(1))
+        self.cfg = mmcv.Config(
+            dict(
+                img_norm_cfg=dict(
+                    mean=[102.9801, 115.9465, 122.7717],
+                    std=[1.0, 1.0, 1.0],
+                    to_rgb=False),
+                data=dict(
+                    test=dict(
+                        img_scale=(255, 255),
+                        refer_scale=(127, 127),
+                        size_divisor=32))))
+        self.test_cfg = mmcv.Config(dict())
+        self.bbox_head = nn.Module()
+        self.bbox_head.num_classes = 2
+
+    def init_template(self, img_refer):
+        return None
+
+
+def _moving_disk(num_frames, start=(100, 120), step=(4, 0), radius=30):
+    """Frames of a textured disk moving over a flat background, with its
+    (cx, cy) in every frame."""
+    rng = np.random.RandomState(0)
+    texture = rng.randint(0, 256, (2 * radius + 20, ) * 2).astype(np.uint8)
+    # smooth enough for the optical flow
+    texture = cv2.GaussianBlur(texture, (5, 5), 0)
+    ys, xs = np.mgrid[:240, :320]
+    frames, centers = [], []
+    for i in range(num_frames):
+        cx, cy = start[0] + i * step[0], start[1] + i * step[1]
+        disk = (xs - cx)**2 + (ys - cy)**2 <= radius**2
+        img = np.full((240, 320), 100, dtype=np.uint8)
+        img[disk] = texture[ys[disk] - cy + radius + 10,
+                            xs[disk] - cx + radius + 10]
+        frames.append(np.repeat(img[..., None], 3, axis=2))
+        centers.append((cx, cy))
+    return frames, centers
+
+
+def _disk_dets(center, radius=30, num_polar=36):
+    cx, cy = center
+    angles = torch.arange(0, 360, 360 // num_polar).float() / 180 * np.pi
+    polygon = torch.stack(
+        (cx + radius * torch.sin(angles), cy + radius * torch.cos(angles)))
+    bbox = torch.tensor(
+        [[cx - radius, cy - radius, cx + radius, cy + radius, 0.9]])
+    return bbox, torch.tensor([0]), polygon[None]
+
+
+def test_keyframe_search_window_follows_propagation():
+    from mmdet.apis import KeyframeTracker
+
+    interval = 5
+    frames, centers = _moving_disk(interval + 1)
+    cx, cy = centers[0]
+    tracker = KeyframeTracker(
+        _DummyDetector(),
+        frames[0], [cx - 30, cy - 30, cx + 30, cy + 30],
+        search_region=dict(context=2., min_size=64),
+        interval=interval)
+
+    windows = []
+    frame_idx = [0]
+
+    def _detect(img, window=None):
+        windows.append(window)
+        return _disk_dets(centers[frame_idx[0]])
+
+    tracker._detect = _detect
+    for i, frame in enumerate(frames):
+        frame_idx[0] = i
+        tracker.track(frame)
+
+    # the frames between the two keyframes are propagated
+    assert tracker.num_frames == interval + 1
+    assert tracker.num_keyframes == 2
+    assert len(windows) == 2 and all(w is not None for w in windows)
+    # the window of the second keyframe is centred on the object as
+    # propagated to the previous frame, not as found on the first keyframe
+    window_cx = (windows[1][0] + windows[1][2]) / 2
+    assert abs(window_cx - centers[interval - 1][0]) <= 2
+    assert abs(window_cx - centers[0][0]) > 10
@@ -0,0 +1,106 @@
+"""End-to-end check of SiamPolar inference on CPU.
+
+    pytest tests/test_siampolar_cpu.py
+"""
+import mmcv
+import numpy as np
+import torch
+
+
+def _tiny_siampolar_cfg():
+    """A SiamPolar with the layout of configs/siampolar, shrunk to a
+    ResNet-18 and 32 channels, without pretrained weights."""
+    model = dict(
+        type='SiamPolar',
+        pretrained=None,
+        backbone=dict(
+            type='SiamResNet',
+            depth=18,
+            template_depth=18,
+            template_pretrained=None,
+            num_stages=4,
+            strides=(1, 2, 2, 2),
+            out_indices=(0, 1, 2, 3),
+            frozen_stages=1,
+            style='pytorch',
+            correlation_blocks=[5]),
+        neck=dict(
+            type='FPN',
+            in_channels=[64, 128, 256, 512],
+            out_channels=32,
+            start_level=1,
+            num_outs=4),
+        bbox_head=dict(
+            type='SiamPolar_Head',
+            num_classes=3,
+            num_polar=36,
+            in_channels=32,
+            stacked_convs=1,
+            feat_channels=32,
+            strides=[8, 16, 32, 64],
+            regress_ranges=[(-1, 256), (256, 512), (512, 1024), (1024, 1e8)]))
+    test_cfg = mmcv.Config(
+        dict(
+            nms_pre=1000,
+            min_bbox_size=0,
+            score_thr=0.0,
+            nms=dict(type='nms', iou_thr=0.5),
+            max_per_img=10))
+    return model, test_cfg
+
+
+def _demo_inputs(img_shape=(255, 255), refer_shape=(127, 127)):
+    h, w = img_shape
+    img = torch.rand(1, 3, h, w)
+    img_refer = torch.rand(1, 3, *refer_shape)
+    img_meta = dict(
+        ori_shape=(h, w, 3),
+        img_shape=(h, w, 3),
+        pad_shape=(h, w, 3),
+        scale_factor=1.0,
+        flip=False)
+    return img, img_refer, img_meta
+
+
+def test_siampolar_cpu_inference(monkeypatch):
+    from mmdet.models import build_detector
+
+    model, test_cfg = _tiny_siampolar_cfg()
+    detector = build_detector(model, train_cfg=None, test_cfg=test_cfg)
+    detector.eval()
+
+    def _no_cuda(*args, **kwargs):
+        raise AssertionError('CUDA used in CPU inference')
+
+    # nothing may be moved to (or created on) a GPU
+    monkeypatch.setattr(torch.Tensor, 'cuda', _no_cuda)
+    monkeypatch.setattr(torch.nn.Module, 'cuda', _no_cuda)
+    for name, tensor in list(detector.named_parameters()) + list(
+            detector.named_buffers()):
+        assert tensor.device.type == 'cpu', name
+
+    img, img_refer, img_meta = _demo_inputs()
+    with torch.no_grad():
+        # a single frame returns its own results, simple_test one per frame
+        batch_results = detector.simple_test(
+            img, [img_meta], img_refer, rescale=True)
+        assert len(batch_results) == 1
+        results = [
+            detector.forward([img], [[img_meta]], [img_refer],
+                             return_loss=False,
+                             rescale=True), batch_results[0]
+        ]
+
+    for bbox_results, mask_results in results:
+        assert len(bbox_results) == len(mask_results) == 2
+        num_dets = 0
+        for bboxes, masks in zip(bbox_results, mask_results):
+            assert isinstance(bboxes, np.ndarray)
+            assert bboxes.shape[1:] == (5, )
+            assert len(masks) == bboxes.shape[0]
+            for rle in masks:
+                assert tuple(rle['size']) == (255, 255)
+            num_dets += bboxes.shape[0]
+        # score_thr=0 keeps the top max_per_img detections
+        assert 0 < num_dets <= test_cfg.max_per_img
+
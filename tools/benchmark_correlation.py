@@ -0,0 +1,115 @@
+"""Micro-benchmark of the SiamResNet correlation against the original one.
+
+The default shapes are those of the siampolar configs: search images of
+255x255, templates of 127x127 and correlation_blocks=[3, 4, 5].
+
+    python tools/benchmark_correlation.py --batch 16 --device cuda
+"""
+import argparse
+import time
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from mmdet.models.utils import correlation_residual, xcorr_conv, xcorr_fft
+
+# (channels, search size, template size) of blocks 3, 4 and 5
+BLOCK_SHAPES = [(512, 32, 16), (1024, 16, 8), (2048, 8, 4)]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the SiamResNet correlation')
+    parser.add_argument('--batch', type=int, default=16, help='batch size')
+    parser.add_argument('--device', default='cuda', help='cuda or cpu')
+    parser.add_argument('--iters', type=int, default=20, help='timed runs')
+    parser.add_argument(
+        '--train', action='store_true', help='run forward and backward')
+    args = parser.parse_args()
+    return args
+
+
+def reference_corr(search, template, bn, gama):
+    """The correlation of SiamResNet before CrossCorrelation."""
+    b, c, h, w = search.shape
+    match_map = F.conv2d(search.view(1, b * c, h, w), template, groups=b)
+    match_map = bn(match_map.permute(1, 0, 2, 3))
+    match_map = F.interpolate(
+        match_map, (h, w), mode='bilinear', align_corners=False)
+    match_map = match_map.repeat(1, c, 1, 1)
+    return gama * (F.softmax(match_map, dim=1) * search) + search
+
+
+def fused_corr(xcorr):
+
+    def corr(search, template, bn, gama):
+        match_map = None
+        if bn.training or torch.is_grad_enabled():
+            match_map = bn(xcorr(search, template))
+            match_map = F.interpolate(
+                match_map, search.shape[2:], mode='bilinear',
+                align_corners=False)
+        return correlation_residual(search, match_map, gama)
+
+    return corr
+
+
+def run(corr, inputs, bn, gama, train):
+    outs = [corr(search, template, bn, gama) for search, template in inputs]
+    if train:
+        sum(out.sum() for out in outs).backward()
+
+
+def benchmark(name, corr, inputs, bn, gama, args):
+    device = torch.device(args.device)
+    with torch.set_grad_enabled(args.train):
+        run(corr, inputs, bn, gama, args.train)  # warm up
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+            torch.cuda.reset_max_memory_allocated()
+            base = torch.cuda.memory_allocated()
+        start = time.time()
+        for _ in range(args.iters):
+            run(corr, inputs, bn, gama, args.train)
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+    msg = '{:<12} {:8.2f} ms'.format(
+        name, (time.time() - start) / args.iters * 1000)
+    if device.type == 'cuda':
+        peak = torch.cuda.max_memory_allocated() - base
+        msg += '  {:8.1f} MB peak'.format(peak / 1024**2)
+    print(msg)
+
+
+def main():
+    args = parse_args()
+    device = torch.device(args.device)
+
+    inputs = [(torch.randn(args.batch, c, s, s, device=device,
+                           requires_grad=args.train),
+               torch.randn(args.batch, c, t, t, device=device))
+              for c, s, t in BLOCK_SHAPES]
+    bn = nn.BatchNorm2d(1).to(device).train(args.train)
+    gama = nn.Parameter(torch.full((1, ), 0.5, device=device))
+
+    # the implementations must agree before they are timed
+    with torch.no_grad():
+        bn.eval()
+        for search, template in inputs:
+            ref = reference_corr(search, template, bn, gama)
+            for corr in (fused_corr(xcorr_conv), fused_corr(xcorr_fft)):
+                assert torch.allclose(
+                    corr(search, template, bn, gama), ref, atol=1e-4)
+        bn.train(args.train)
+
+    print('batch {}, {}, {}'.format(args.batch, device,
+                                    'train' if args.train else 'test'))
+    benchmark('reference', reference_corr, inputs, bn, gama, args)
+    benchmark('fused conv', fused_corr(xcorr_conv), inputs, bn, gama, args)
+    if hasattr(torch, 'fft') and hasattr(torch.fft, 'rfft2'):
+        benchmark('fused fft', fused_corr(xcorr_fft), inputs, bn, gama, args)
+
+
+if __name__ == '__main__':
+    main()
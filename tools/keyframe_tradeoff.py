@@ -0,0 +1,128 @@
+"""Trade-off of the keyframe rate of KeyframeTracker against J&F.
+
+Every video of the test set is tracked from the gt bbox of its first frame
+with each keyframe interval, and evaluated on the fly. Interval 1 runs the
+detector on every frame, as VOSTracker does.
+
+    python tools/keyframe_tradeoff.py ./configs/siampolar/siampolar_r101.py \
+        ./work_dirs/polar_r101/epoch_36.pth --intervals 1 2 3 5 10
+"""
+import argparse
+import os.path as osp
+import time
+
+import mmcv
+import torch
+from terminaltables import AsciiTable
+
+from mmdet.apis import KeyframeTracker, init_detector
+from mmdet.core import DAVISOnlineEval
+from mmdet.datasets import build_dataset, get_videos
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='J&F against the keyframe rate of KeyframeTracker')
+    parser.add_argument('config', help='test config file path')
+    parser.add_argument('checkpoint', help='checkpoint file')
+    parser.add_argument(
+        '--intervals',
+        type=int,
+        nargs='+',
+        default=[1, 2, 3, 5, 10],
+        help='maximum keyframe intervals to evaluate')
+    parser.add_argument(
+        '--score-thr', type=float, default=0.3, help='keyframe score_thr')
+    parser.add_argument(
+        '--motion-thr', type=float, default=0.2, help='keyframe motion_thr')
+    parser.add_argument(
+        '--min-inliers', type=float, default=0.5, help='keyframe min_inliers')
+    parser.add_argument('--device', default='cuda:0', help='model device')
+    parser.add_argument('--out', help='json file to save the table to')
+    args = parser.parse_args()
+    return args
+
+
+def track_videos(model, dataset, videos, evaluator, **kwargs):
+    """Track every video, returns the number of frames and keyframes and
+    the tracking time."""
+    num_frames = num_keyframes = 0
+    track_time = 0
+    prog_bar = mmcv.ProgressBar(len(dataset))
+    for start, end in videos:
+        first_frame = dataset.img_infos[start]['first_frame']
+        filename = osp.join(dataset.img_prefix,
+                            dataset.img_infos[first_frame]['filename'])
+        bbox = dataset.get_ann_info(first_frame)['bboxes'][0]
+        label = dataset.get_refer_label(first_frame)
+        tracker = KeyframeTracker(
+            model,
+            filename,
+            bbox,
+            label=label if label >= 0 else None,
+            **kwargs)
+        for idx in range(start, end):
+            img_info = dataset.img_infos[idx]
+            img = mmcv.imread(osp.join(dataset.img_prefix,
+                                       img_info['filename']))
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+            tic = time.time()
+            result = tracker.track(img)
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+            track_time += time.time() - tic
+            evaluator.update(img_info['id'], result)
+            prog_bar.update()
+        num_frames += tracker.num_frames
+        num_keyframes += tracker.num_keyframes
+    return num_frames, num_keyframes, track_time
+
+
+def main():
+    args = parse_args()
+
+    cfg = mmcv.Config.fromfile(args.config)
+    cfg.data.test.test_mode = True
+    dataset = build_dataset(cfg.data.test)
+    videos = get_videos(dataset)
+    model = init_detector(cfg, args.checkpoint, device=args.device)
+
+    rows = []
+    for interval in args.intervals:
+        print('\ninterval {}'.format(interval))
+        evaluator = DAVISOnlineEval(dataset.coco)
+        num_frames, num_keyframes, track_time = track_videos(
+            model,
+            dataset,
+            videos,
+            evaluator,
+            interval=interval,
+            score_thr=args.score_thr,
+            motion_thr=args.motion_thr,
+            min_inliers=args.min_inliers)
+        evaluator.evaluate(per_sequence=False)
+        j_mean = evaluator.stats['J'][0]
+        f_mean = evaluator.stats['F'][0]
+        rows.append(
+            dict(
+                interval=interval,
+                keyframe_rate=num_keyframes / num_frames,
+                fps=num_frames / track_time,
+                J=j_mean,
+                F=f_mean,
+                JF=(j_mean + f_mean) / 2))
+
+    table_data = [['interval', 'keyframes', 'fps', 'J(M)', 'F(M)', 'J&F']]
+    for row in rows:
+        table_data.append([
+            row['interval'], '{:.1%}'.format(row['keyframe_rate']),
+            '{:.1f}'.format(row['fps'])
+        ] + ['{:.3f}'.format(row[key]) for key in ('J', 'F', 'JF')])
+    print(AsciiTable(table_data).table)
+    if args.out:
+        mmcv.dump(rows, args.out)
+
+
+if __name__ == '__main__':
+    main()
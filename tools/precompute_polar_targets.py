@@ -0,0 +1,102 @@
+"""Precompute the polar targets of a training set.
+
+The targets are written as a PolarTargetStore and can be used by setting
+``target_store`` of the training dataset in the config, e.g.
+
+    python tools/precompute_polar_targets.py \
+        configs/siampolar/siampolar_r101.py data/DAVIS/polar_targets
+
+    data = dict(train=dict(..., target_store='data/DAVIS/polar_targets'))
+"""
+import argparse
+import os
+import os.path as osp
+
+import mmcv
+import numpy as np
+
+from mmdet.datasets import build_dataset
+from mmdet.datasets.polar_utils import PolarTargetStore, sparse_polar_targets
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Precompute polar targets of the training set')
+    parser.add_argument('config', help='config file path')
+    parser.add_argument('out_dir', help='output directory of the store')
+    args = parser.parse_args()
+    return args
+
+
+def get_transformed_anns(dataset, idx, flip):
+    """Apply the training transforms to the annotations of an image."""
+    img_info = dataset.img_infos[idx]
+    ann = dataset.get_ann_info(idx)
+    # only the image shape matters for the targets
+    img = np.zeros((img_info['height'], img_info['width'], 3), dtype=np.uint8)
+    img_scale = dataset.img_scales[0]
+    _, img_shape, pad_shape, scale_factor = dataset.img_transform(
+        img, img_scale, flip, keep_ratio=dataset.resize_keep_ratio)
+    gt_bboxes = dataset.bbox_transform(ann['bboxes'], img_shape, scale_factor,
+                                       flip)
+    gt_masks = dataset.mask_transform(ann['masks'], pad_shape, scale_factor,
+                                      flip)
+    return gt_bboxes, gt_masks, ann['labels'], pad_shape
+
+
+def main():
+    args = parse_args()
+
+    cfg = mmcv.Config.fromfile(args.config)
+    train_cfg = cfg.data.train.copy()
+    train_cfg.pop('target_store', None)
+    dataset = build_dataset(train_cfg)
+    # targets are computed for a fixed transform of every image
+    assert len(dataset.img_scales) == 1, \
+        'polar targets can only be precomputed for a single img_scale'
+    assert dataset.extra_aug is None, \
+        'polar targets can not be precomputed with extra_aug'
+
+    flips = [False, True] if dataset.flip_ratio > 0 else [False]
+    offsets = np.full((len(dataset), 2, 3), -1, dtype=np.int64)
+    arrays = {name: [] for name in PolarTargetStore.ARRAYS}
+    start = 0
+    prog_bar = mmcv.ProgressBar(len(dataset))
+    for idx in range(len(dataset)):
+        for flip in flips:
+            gt_bboxes, gt_masks, gt_labels, pad_shape = get_transformed_anns(
+                dataset, idx, flip)
+            if len(gt_bboxes) == 0:
+                # skipped by the dataset during training
+                offsets[idx, int(flip)] = (start, start, 0)
+                continue
+            targets = dataset.get_polar_targets(gt_bboxes, gt_masks,
+                                                gt_labels, pad_shape)
+            num_points = targets[0].numel()
+            targets = sparse_polar_targets(*targets)
+            for name, target in zip(PolarTargetStore.ARRAYS, targets):
+                arrays[name].append(target.numpy())
+            arrays['pos_inds'][-1] = arrays['pos_inds'][-1].astype(np.int32)
+            end = start + targets[0].numel()
+            offsets[idx, int(flip)] = (start, end, num_points)
+            start = end
+        prog_bar.update()
+
+    mmcv.mkdir_or_exist(args.out_dir)
+    for name, array in arrays.items():
+        if len(array) > 0:
+            array = np.concatenate(array).astype(
+                np.int32 if name == 'pos_inds' else np.float32)
+        else:
+            array = np.zeros(0, dtype=np.float32)
+        np.save(osp.join(args.out_dir, name + '.npy'), array)
+    np.save(osp.join(args.out_dir, 'offsets.npy'), offsets)
+    mmcv.dump(
+        PolarTargetStore.get_meta(dataset),
+        osp.join(args.out_dir, 'index.json'))
+    print('\n{} positive points of {} images written to {}'.format(
+        start, len(dataset), os.path.abspath(args.out_dir)))
+
+
+if __name__ == '__main__':
+    main()
@@ -10,7 +10,6 @@ os.environ['TORCH_HOME']='./torch-model' # the path to save the pretrained model
 
 import os.path as osp
 import shutil
-import tempfile
 
 import mmcv
 import torch
@@ -19,20 +18,40 @@ from mmcv.runner import load_checkpoint, get_dist_info
 from mmcv.parallel import MMDataParallel, MMDistributedDataParallel
 
 from mmdet.apis import init_dist
-from mmdet.core import results2json, coco_eval, wrap_fp16_model, davis_eval
+from mmdet.core import (results2json, coco_eval, wrap_fp16_model, davis_eval,
+                        DAVISOnlineEval, gather_objects)
 from mmdet.datasets import build_dataloader, build_dataset
 from mmdet.models import build_detector
 
 
-def single_gpu_test(model, data_loader, show=False):
+def update_evaluator(evaluator, dataset, indices, results):
+    # evaluate the results of a batch, given their dataset indices
+    for idx, result in zip(indices, results):
+        evaluator.update(dataset.img_infos[idx]['id'], result)
+
+
+def single_gpu_test(model,
+                    data_loader,
+                    show=False,
+                    evaluator=None,
+                    keep_results=True):
     model.eval()
     results = []
     dataset = data_loader.dataset
+    indices = iter(data_loader.sampler)
     prog_bar = mmcv.ProgressBar(len(dataset))
     for i, data in enumerate(data_loader):
         with torch.no_grad():
             result = model(return_loss=False, rescale=not show, **data)
-        results.append(result)
+        # one result per frame, or the result of a single frame, see
+        # SiamPolar.forward_test
+        batch_size = data['img'][0].size(0)
+        batch_results = result if batch_size > 1 else [result]
+        if evaluator is not None:
+            batch_inds = [next(indices) for _ in batch_results]
+            update_evaluator(evaluator, dataset, batch_inds, batch_results)
+        if keep_results:
+            results.extend(batch_results)
 
         if show:
             # save
@@ -42,75 +61,91 @@ def single_gpu_test(model, data_loader, show=False):
             # not save
             model.module.show_result(data, result, dataset.img_norm_cfg)
 
-        batch_size = data['img'][0].size(0)
         for _ in range(batch_size):
             prog_bar.update()
     return results
 
 
-def multi_gpu_test(model, data_loader, tmpdir=None):
+def multi_gpu_test(model,
+                   data_loader,
+                   tmpdir=None,
+                   evaluator=None,
+                   keep_results=True):
     model.eval()
     results = []
+    result_inds = []
     dataset = data_loader.dataset
+    indices = iter(data_loader.sampler)
     rank, world_size = get_dist_info()
     if rank == 0:
         prog_bar = mmcv.ProgressBar(len(dataset))
     for i, data in enumerate(data_loader):
         with torch.no_grad():
             result = model(return_loss=False, rescale=True, **data)
-        results.append(result)
+        batch_size = data['img'][0].size(0)
+        batch_results = result if batch_size > 1 else [result]
+        batch_inds = [next(indices) for _ in batch_results]
+        if evaluator is not None:
+            update_evaluator(evaluator, dataset, batch_inds, batch_results)
+        if keep_results:
+            results.extend(batch_results)
+            result_inds.extend(batch_inds)
 
         if rank == 0:
-            batch_size = data['img'][0].size(0)
             for _ in range(batch_size * world_size):
                 prog_bar.update()
 
     # collect results from all ranks
-    results = collect_results(results, len(dataset), tmpdir)
+    if keep_results:
+        results = collect_results(results, len(dataset), tmpdir, result_inds)
+    if evaluator is not None:
+        # only the per-frame measures are collected
+        states = gather_objects(evaluator.state())
+        if rank == 0:
+            for state in states:
+                evaluator.merge(state)
 
     return results
 
 
-def collect_results(result_part, size, tmpdir=None):
+def collect_results(result_part, size, tmpdir=None, indices=None):
+    """Collect the results of all ranks on rank 0.
+
+    The parts are sent to rank 0 one at a time, or through ``tmpdir`` if it
+    is given. ``indices`` are the dataset indices of the results of this
+    rank (round robin as in DistributedSampler if None), results of padded
+    duplicate samples are dropped.
+    """
     rank, world_size = get_dist_info()
-    # create a tmp dir if it is not specified
+    if indices is None:
+        indices = range(rank, len(result_part) * world_size, world_size)
+    part = (list(indices), result_part)
     if tmpdir is None:
-        MAX_LEN = 512
-        # 32 is whitespace
-        dir_tensor = torch.full((MAX_LEN, ),
-                                32,
-                                dtype=torch.uint8,
-                                device='cuda')
-        if rank == 0:
-            tmpdir = tempfile.mkdtemp()
-            tmpdir = torch.tensor(
-                bytearray(tmpdir.encode()), dtype=torch.uint8, device='cuda')
-            dir_tensor[:len(tmpdir)] = tmpdir
-        dist.broadcast(dir_tensor, 0)
-        tmpdir = dir_tensor.cpu().numpy().tobytes().decode().rstrip()
+        part_list = gather_objects(part)
     else:
         mmcv.mkdir_or_exist(tmpdir)
-    # dump the part result to the dir
-    mmcv.dump(result_part, osp.join(tmpdir, 'part_{}.pkl'.format(rank)))
-    dist.barrier()
+        # dump the part result to the dir
+        mmcv.dump(part, osp.join(tmpdir, 'part_{}.pkl'.format(rank)))
+        dist.barrier()
+        part_list = None
+        if rank == 0:
+            # load results of all parts from tmp dir
+            part_list = [
+                mmcv.load(osp.join(tmpdir, 'part_{}.pkl'.format(i)))
+                for i in range(world_size)
+            ]
+            # remove tmp dir
+            shutil.rmtree(tmpdir)
     # collect all parts
     if rank != 0:
         return None
-    else:
-        # load results of all parts from tmp dir
-        part_list = []
-        for i in range(world_size):
-            part_file = osp.join(tmpdir, 'part_{}.pkl'.format(i))
-            part_list.append(mmcv.load(part_file))
-        # sort the results
-        ordered_results = []
-        for res in zip(*part_list):
-            ordered_results.extend(list(res))
-        # the dataloader may pad some samples
-        ordered_results = ordered_results[:size]
-        # remove tmp dir
-        shutil.rmtree(tmpdir)
-        return ordered_results
+    # sort the results, the samplers may pad some samples
+    ordered_results = [None] * size
+    for part_inds, part_results in part_list:
+        for idx, result in zip(part_inds, part_results):
+            if idx < size:
+                ordered_results[idx] = result
+    return ordered_results
 
 
 def parse_args():
@@ -128,6 +163,15 @@ def parse_args():
         nargs='+',
         choices=['proposal', 'proposal_fast', 'bbox', 'segm', 'keypoints', 'vos'],
         help='eval types')
+    parser.add_argument(
+        '--eval-nproc',
+        type=int,
+        default=1,
+        help='number of processes of the vos evaluation')
+    parser.add_argument(
+        '--eval-online',
+        action='store_true',
+        help='evaluate vos while testing, without keeping the results')
     parser.add_argument('--show', action='store_true', help='show results')
     parser.add_argument('--tmpdir', help='tmp dir for writing some results')
     parser.add_argument(
@@ -145,9 +189,13 @@ def parse_args():
 def main():
     args = parse_args()
 
-    assert args.out or args.show or args.json_out, \
-        ('Please specify at least one operation (save or show the results) '
-         'with the argument "--out" or "--show" or "--json_out"')
+    assert args.out or args.show or args.json_out or args.eval_online, \
+        ('Please specify at least one operation (save, show or evaluate the '
+         'results) with the argument "--out", "--show", "--json_out" or '
+         '"--eval-online"')
+
+    assert not args.eval_online or args.eval == ['vos'], \
+        '--eval-online only supports "--eval vos"'
 
     if args.out is not None and not args.out.endswith(('.pkl', '.pickle')):
         raise ValueError('The output file must be a pkl file.')
@@ -170,14 +218,18 @@ def main():
         init_dist(args.launcher, **cfg.dist_params)
 
     # build the dataloader
-    # TODO: support multiple images per gpu (only minor changes are needed)
+    # batched inference is enabled by setting imgs_per_gpu in data.test
+    imgs_per_gpu = cfg.data.test.pop('imgs_per_gpu', 1)
+    assert not args.show or imgs_per_gpu == 1, \
+        '--show only supports imgs_per_gpu=1'
     dataset = build_dataset(cfg.data.test)
     data_loader = build_dataloader(
         dataset,
-        imgs_per_gpu=1,
+        imgs_per_gpu=imgs_per_gpu,
         workers_per_gpu=cfg.data.workers_per_gpu,
         dist=distributed,
-        shuffle=False)
+        shuffle=False,
+        video_shards=True)
 
     # build the model and load checkpoint
     model = build_detector(cfg.model, train_cfg=None, test_cfg=cfg.test_cfg)
@@ -192,26 +244,33 @@ def main():
     else:
         model.CLASSES = dataset.CLASSES
 
+    evaluator = DAVISOnlineEval(dataset.coco) if args.eval_online else None
+    keep_results = bool(args.out or args.json_out)
     if not distributed:
         model = MMDataParallel(model, device_ids=[0])
-        outputs = single_gpu_test(model, data_loader, args.show)
+        outputs = single_gpu_test(model, data_loader, args.show, evaluator,
+                                  keep_results)
     else:
         model = MMDistributedDataParallel(model.cuda())
-        outputs = multi_gpu_test(model, data_loader, args.tmpdir)
+        outputs = multi_gpu_test(model, data_loader, args.tmpdir, evaluator,
+                                 keep_results)
 
     rank, _ = get_dist_info()
+    if evaluator is not None and rank == 0:
+        print('\nStarting evaluate vos')
+        evaluator.evaluate()
     if args.out and rank == 0:
         print('\nwriting results to {}'.format(args.out))
         mmcv.dump(outputs, args.out)
         eval_types = args.eval
-        if eval_types:
+        if eval_types and not args.eval_online:
             print('Starting evaluate {}'.format(' and '.join(eval_types)))
             if eval_types == ['proposal_fast']: 
                 result_file = args.out
                 coco_eval(result_file, eval_types, dataset.coco)
             elif eval_types == ['vos']: 
                 result_files = results2json(dataset, outputs, args.out)
-                davis_eval(result_files, dataset.coco)
+                davis_eval(result_files, dataset.coco, nproc=args.eval_nproc)
             else:
                 if not isinstance(outputs[0], dict):
                     result_files = results2json(dataset, outputs, args.out)